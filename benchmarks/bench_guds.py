@@ -0,0 +1,206 @@
+"""
+Benchmarks the main guds operations against a local stub geoserver using
+synthetic AWSM netcdfs. Reports the wall time, number of requests and peak
+python memory of each operation.
+
+Usage:
+    python benchmarks/bench_guds.py --sizes 100 500 --latency 0.02
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from netCDF4 import Dataset
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from guds.upload import AWSM_Geoserver
+from stub_geoserver import Catalog, StubGeoserver
+
+# UTM zone 11N, written the way spatialnc stores projections
+WKT = ('PROJCS["WGS 84 / UTM zone 11N",GEOGCS["WGS 84",DATUM["WGS_1984",'
+       'SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],'
+       'UNIT["degree",0.0174532925199433]],PROJECTION["Transverse_Mercator"],'
+       'PARAMETER["latitude_of_origin",0],PARAMETER["central_meridian",-117],'
+       'PARAMETER["scale_factor",0.9996],PARAMETER["false_easting",500000],'
+       'PARAMETER["false_northing",0],UNIT["metre",1]]')
+
+
+def make_modeled(path, n, day="2019-04-01"):
+    """
+    Writes a synthetic snow.nc, em.nc and mask.nc of n x n cells
+
+    Returns:
+        tuple: path to snow.nc and mask.nc
+    """
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(n)
+
+    files = {"snow.nc":["thickness", "snow_density", "specific_mass"],
+             "em.nc":["cold_content"]}
+
+    for fname, variables in files.items():
+        ds = Dataset(os.path.join(path, fname), "w")
+        ds.createDimension("time", None)
+        ds.createDimension("y", n)
+        ds.createDimension("x", n)
+
+        t = ds.createVariable("time", "f8", ("time",))
+        t.units = "hours since {} 00:00".format(day)
+        t.calendar = "standard"
+        t[:] = [23]
+
+        ds.createVariable("x", "f8", ("x",))[:] = 500000 + np.arange(n) * 50.0
+        ds.createVariable("y", "f8", ("y",))[:] = 4200000 - np.arange(n) * 50.0
+        ds.createVariable("projection", "S1").spatial_ref = WKT
+
+        for v in variables:
+            ds.createVariable(v, "f4", ("time", "y", "x"))[:] = \
+                                            rng.random((1, n, n)) * 100
+        ds.close()
+
+    mask = np.zeros((n, n), dtype="f4")
+    mask[n // 8:-n // 8, n // 8:-n // 8] = 1
+
+    ds = Dataset(os.path.join(path, "mask.nc"), "w")
+    ds.createDimension("y", n)
+    ds.createDimension("x", n)
+    ds.createVariable("mask", "f4", ("y", "x"))[:] = mask
+    ds.close()
+
+    return os.path.join(path, "snow.nc"), os.path.join(path, "mask.nc")
+
+
+def make_styles(path, count):
+    """
+    Writes count SLD files named after the colormap keywords
+    """
+    os.makedirs(path, exist_ok=True)
+    keys = ["depth", "density", "swe", "cold_content"]
+    files = []
+
+    for i in range(count):
+        fname = os.path.join(path, "{}_bench{}.sld".format(keys[i % len(keys)],
+                                                          i))
+        with open(fname, "w") as fp:
+            fp.write("<StyledLayerDescriptor/>")
+        files.append(fname)
+
+    return files
+
+
+def measure(stub, func, *args, **kwargs):
+    """
+    Runs func and returns the wall time, requests made and peak memory
+    """
+    requests = stub.requests()
+    tracemalloc.start()
+    start = time.time()
+
+    func(*args, **kwargs)
+
+    seconds = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"seconds":seconds,
+            "requests":stub.requests() - requests,
+            "peak_mb":peak / 1024**2}
+
+
+def run(sizes, latency, stores, styles, jobs):
+    """
+    Runs each benchmark for each grid size
+
+    Returns:
+        list: Dictionaries of the results
+    """
+    results = []
+    cwd = os.getcwd()
+
+    for n in sizes:
+        catalog = Catalog(basins=["kings"], stores=stores, styles=styles)
+
+        with StubGeoserver(latency=latency, catalog=catalog) as stub, \
+             tempfile.TemporaryDirectory() as tmp:
+
+            os.chdir(tmp)
+            try:
+                cred = os.path.join(tmp, "geoserver.json")
+                with open(cred, "w") as fp:
+                    json.dump({"url":stub.url, "geoserver_username":"admin",
+                               "geoserver_password":"geoserver",
+                               "data":"resource/data/basins"}, fp)
+
+                snow, mask = make_modeled(os.path.join(tmp, "run"), n)
+                sld = make_styles(os.path.join(tmp, "styles"), 4)
+
+                log = logging.getLogger("guds.bench")
+                gs = AWSM_Geoserver(cred, log=log, bypass=True,
+                                    cleanup=False, jobs=jobs,
+                                    journal=os.path.join(tmp, "journal.json"),
+                                    state=os.path.join(tmp, "state.db"))
+                log.setLevel(logging.WARNING)
+
+                benchmarks = [
+                    ("upload", gs.upload, ("kings", snow), {"mask":mask}),
+                    ("submit_styles", gs.submit_styles, (sld,), {}),
+                    ("create_latest_layers", gs.create_latest_layers,
+                                             ("kings",), {}),
+                    ("download", gs.download, ("kings", "2019-04-01"), {})]
+
+                for name, func, args, kwargs in benchmarks:
+                    r = measure(stub, func, *args, **kwargs)
+                    r.update({"benchmark":name, "size":n})
+                    results.append(r)
+
+            finally:
+                os.chdir(cwd)
+
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmarks guds against a local"
+                                            " stub geoserver")
+    p.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000],
+                   help="Grid sizes (cells per side) of the synthetic netcdfs")
+    p.add_argument("--latency", type=float, default=0.0,
+                   help="Seconds the stub waits before answering each request")
+    p.add_argument("--stores", type=int, default=50,
+                   help="Number of daily stores already in the stub catalog")
+    p.add_argument("--styles", type=int, default=50,
+                   help="Number of styles already in the stub catalog")
+    p.add_argument("-j", "--jobs", type=int, default=1,
+                   help="Number of workers guds uses to create layers")
+    p.add_argument("--json", dest="json_out", default=None,
+                   help="Path to write the results as json")
+    args = p.parse_args()
+
+    results = run(args.sizes, args.latency, args.stores, args.styles,
+                  args.jobs)
+
+    print("{:<22} {:>6} {:>10} {:>9} {:>9}".format("Benchmark", "Size",
+                                                   "Time (s)", "Requests",
+                                                   "Peak MB"))
+    for r in results:
+        print("{:<22} {:>6} {:>10.3f} {:>9} {:>9.1f}".format(r["benchmark"],
+                                                             r["size"],
+                                                             r["seconds"],
+                                                             r["requests"],
+                                                             r["peak_mb"]))
+    if args.json_out != None:
+        with open(args.json_out, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
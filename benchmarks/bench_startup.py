@@ -0,0 +1,104 @@
+"""
+Benchmarks how long the guds command line takes to start. Each command is run
+in a fresh interpreter several times and the best and median times are
+reported along with the slowest modules imported along the way.
+
+Usage:
+    python benchmarks/bench_startup.py --repeat 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {"import": ["-c", "import guds.upload"],
+            "help": ["-c", "from guds.upload import main; main()", "--help"],
+            "basins help": ["-c", "from guds.orchestrate import main; main()",
+                            "--help"]}
+
+
+def time_command(args, repeat):
+    """
+    Runs python with args repeat times
+
+    Returns:
+        list: Wall time of each run in seconds
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    times = []
+
+    for i in range(repeat):
+        start = time.time()
+        subprocess.run([sys.executable] + args, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.time() - start)
+
+    return times
+
+
+def slowest_imports(args, count):
+    """
+    Runs python with -X importtime and returns the modules imported directly
+    by the command's own imports with the largest cumulative import time
+
+    Returns:
+        list: Tuples of the module name and microseconds
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    p = subprocess.run([sys.executable, "-X", "importtime"] + args, env=env,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                       universal_newlines=True)
+    modules = []
+
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        self_us, cumulative, name = line[len("import time:"):].split("|")
+
+        # Nesting is shown by two spaces per level after the first
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level == 1:
+            modules.append((name.strip(), int(cumulative)))
+
+    return sorted(modules, key=lambda m: m[1], reverse=True)[:count]
+
+
+def main():
+    p = argparse.ArgumentParser(description="Benchmarks the startup time of the"
+                                            " guds command line")
+    p.add_argument("--repeat", type=int, default=5,
+                   help="Number of times to run each command")
+    p.add_argument("--imports", type=int, default=10,
+                   help="Number of the slowest imports to report")
+    p.add_argument("--json", dest="json_out", default=None,
+                   help="Path to write the results as json")
+    args = p.parse_args()
+
+    results = []
+    print("{:<14} {:>9} {:>11}".format("Command", "Best (s)", "Median (s)"))
+
+    for name, cmd in COMMANDS.items():
+        times = time_command(cmd, args.repeat)
+        results.append({"command":name, "best":min(times),
+                        "median":statistics.median(times)})
+        print("{:<14} {:>9.3f} {:>11.3f}".format(name, min(times),
+                                                 statistics.median(times)))
+
+    print("\nSlowest modules imported by guds.upload:")
+    for name, us in slowest_imports(COMMANDS["import"], args.imports):
+        print("{:<30} {:>9.1f} ms".format(name, us / 1000.0))
+
+    if args.json_out != None:
+        with open(args.json_out, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
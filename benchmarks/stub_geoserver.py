@@ -0,0 +1,489 @@
+"""
+In process stand in for the parts of the GeoServer REST API that guds uses.
+The catalog lives in memory, every request can be delayed to mimic network
+latency and requests are counted so benchmarks can report them.
+"""
+
+import json
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+class Catalog(object):
+    """
+    In memory geoserver catalog
+
+    Args:
+        basins: Workspace names to create
+        stores: Number of daily modeled stores to create in each basin
+        styles: Number of styles to create
+    """
+
+    variables = ["density", "SWE", "depth", "cold_content"]
+
+    def __init__(self, basins=("kings",), stores=0, styles=0):
+        self.lock = threading.RLock()
+        self.workspaces = {}
+        self.styles = {}
+        self.layers = {}
+        self.resources = {}
+
+        for b in basins:
+            self.add_workspace(b)
+            start = date(2018, 10, 1)
+
+            for i in range(stores):
+                d = (start + timedelta(days=i)).strftime("%Y%m%d")
+                store = "{}_masked_snow_{}".format(b, d)
+                self.add_store(b, "coverageStores", {"name":store,
+                                                     "type":"NetCDF"})
+                for v in self.variables:
+                    self.add_layer(b, "coverageStores", store,
+                                   {"name":"{}{}".format(v, d)})
+
+        keys = ["depth", "density", "swe", "dem", "cold_content", "veg"]
+        for i in range(styles):
+            name = "{}_{}".format(keys[i % len(keys)], i)
+            self.styles[name] = b""
+
+    def add_workspace(self, name):
+        self.workspaces[name] = {"coverageStores":{}, "dataStores":{}}
+
+    def add_store(self, basin, kind, info):
+        self.workspaces[basin][kind][info["name"]] = {"info":info,
+                                                      "layers":{}}
+
+    def add_layer(self, basin, kind, store, info):
+        self.workspaces[basin][kind][store]["layers"][info["name"]] = info
+        self.layers["{}:{}".format(basin, info["name"])] = {"styles":[],
+                                                           "defaultStyle":None}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Routes requests to the catalog. Paths are relative to /geoserver/rest/
+    """
+
+    kinds = {"coveragestores":("coverageStores", "coverageStore",
+                               "coverages", "coverage"),
+             "datastores":("dataStores", "dataStore",
+                           "featuretypes", "featureType")}
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def catalog(self):
+        return self.server.catalog
+
+    def href(self, path):
+        return "http://{}:{}/geoserver/rest/{}".format(
+                                self.server.server_address[0],
+                                self.server.server_address[1], path)
+
+    def respond(self, code, body=None, headers=None, ctype=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            ctype = "application/json"
+        elif ctype == None:
+            ctype = "application/octet-stream"
+
+        body = body or b""
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+
+        self.end_headers()
+
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def read_body(self):
+        n = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(n) if n else b""
+
+    def route(self):
+        # Mimic latency then count the request
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.counts[self.command] += 1
+
+        url = urlparse(self.path)
+        path = unquote(url.path)
+
+        # Workspace OWS services e.g. /geoserver/kings/wcs
+        ows = re.match(r"^/geoserver/([^/]+)/wcs$", path)
+        if ows:
+            with self.catalog.lock:
+                return self.wcs(ows.group(1), parse_qs(url.query))
+
+        if not path.startswith("/geoserver/rest/"):
+            return self.respond(404)
+
+        path = path[len("/geoserver/rest/"):]
+        self.query = parse_qs(url.query)
+
+        if path.startswith("resource/"):
+            return self.resource(path[len("resource/"):])
+
+        path = re.sub(r"\.(json|xml)$", "", path.strip("/"))
+        parts = path.split("/")
+
+        with self.catalog.lock:
+            if parts[0] == "workspaces":
+                return self.workspaces(parts[1:])
+
+            elif parts[0] == "styles":
+                return self.styles(parts[1:])
+
+            elif parts[0] == "layers":
+                return self.layers(parts[1:])
+
+        return self.respond(404)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = route
+
+    def workspaces(self, parts):
+        ws = self.catalog.workspaces
+
+        if not parts:
+            if self.command == "POST":
+                body = json.loads(self.read_body())
+                self.catalog.add_workspace(body["workspace"]["name"])
+                return self.respond(201)
+
+            items = [{"name":n, "href":self.href("workspaces/{}".format(n))}
+                     for n in ws]
+            return self.respond(200, {"workspaces":{"workspace":items}
+                                      if items else ""})
+
+        basin = parts[0]
+        if basin not in ws:
+            return self.respond(404)
+
+        if len(parts) == 1:
+            base = "workspaces/{}".format(basin)
+            return self.respond(200, {"workspace":{
+                        "name":basin,
+                        "coverageStores":self.href(base + "/coveragestores"),
+                        "dataStores":self.href(base + "/datastores")}})
+
+        if parts[1] == "layers":
+            names = [n.split(":")[1] for n in self.catalog.layers
+                     if n.split(":")[0] == basin]
+            return self.respond(200, {"layers":{"layer":[{"name":n}
+                                                         for n in names]}
+                                      if names else ""})
+
+        if parts[1] not in self.kinds:
+            return self.respond(404)
+
+        return self.stores(basin, parts[1], parts[2:])
+
+    def stores(self, basin, collection, parts):
+        kind, key, lyr_collection, item = self.kinds[collection]
+        stores = self.catalog.workspaces[basin][kind]
+        base = "workspaces/{}/{}".format(basin, collection)
+
+        if not parts:
+            if self.command == "POST":
+                info = json.loads(self.read_body())[key]
+                self.catalog.add_store(basin, kind, info)
+                return self.respond(201)
+
+            items = [{"name":n, "href":self.href("{}/{}".format(base, n))}
+                     for n in stores]
+            return self.respond(200, {kind:{key:items} if items else ""})
+
+        store = parts[0]
+
+        # Shapefile uploads create the store and the featuretype
+        if len(parts) == 2 and parts[1].startswith("file.") \
+                           and self.command == "PUT":
+            self.read_body()
+            if store not in stores:
+                self.catalog.add_store(basin, kind, {"name":store})
+
+            name = self.query.get("filename", [store.replace("_store", "")])[0]
+            self.catalog.add_layer(basin, kind, store, {"name":name})
+            return self.respond(201)
+
+        # External uploads point at files already in the resources
+        if len(parts) == 2 and parts[1].startswith("external.") \
+                           and self.command in ["PUT", "POST"]:
+            return self.external(basin, kind, stores, store)
+
+        if store not in stores:
+            return self.respond(404)
+
+        if len(parts) == 1:
+            if self.command == "DELETE":
+                for n in stores[store]["layers"]:
+                    self.catalog.layers.pop("{}:{}".format(basin, n), None)
+                stores.pop(store)
+                return self.respond(200)
+
+            info = dict(stores[store]["info"])
+            info[lyr_collection] = self.href("{}/{}/{}".format(base, store,
+                                                               lyr_collection))
+            return self.respond(200, {key:info})
+
+        layers = stores[store]["layers"]
+        lbase = "{}/{}/{}".format(base, store, lyr_collection)
+
+        if len(parts) == 2:
+            if self.command == "POST":
+                info = json.loads(self.read_body())[item]
+                self.catalog.add_layer(basin, kind, store, info)
+                return self.respond(201)
+
+            items = [{"name":n, "href":self.href("{}/{}".format(lbase, n))}
+                     for n in layers]
+            # Listed as e.g. {"featureTypes":{"featureType":[...]}}
+            return self.respond(200, {item + "s":{item:items}
+                                      if items else ""})
+
+        name = parts[2]
+        if name not in layers:
+            return self.respond(404)
+
+        if parts[3:] == ["index", "granules"]:
+            return self.granules(stores[store])
+
+        if self.command == "PUT":
+            layers[name].update(json.loads(self.read_body())[item])
+            return self.respond(200)
+
+        if self.command == "DELETE":
+            layers.pop(name)
+            self.catalog.layers.pop("{}:{}".format(basin, name), None)
+            return self.respond(200)
+
+        return self.respond(200, {item:layers[name]})
+
+    def external(self, basin, kind, stores, store):
+        """
+        PUT makes an ImageMosaic store from a folder of granules named by its
+        indexer.properties, POST harvests one more granule into it
+        """
+        path = "data/" + self.read_body().decode()[len("file:"):]
+        resources = self.catalog.resources
+
+        if self.command == "PUT":
+            if store not in stores:
+                self.catalog.add_store(basin, kind, {"name":store,
+                                                     "type":"ImageMosaic"})
+
+            props = resources.get(path + "/indexer.properties", b"").decode()
+            props = dict([l.split("=", 1) for l in props.splitlines()
+                          if "=" in l])
+            self.catalog.add_layer(basin, kind, store,
+                                   {"name":props.get("Name", store)})
+            granules = [p for p in resources
+                        if p.startswith(path + "/") and p.endswith(".tif")]
+            code = 201
+
+        else:
+            if store not in stores:
+                return self.respond(404)
+
+            granules = [path]
+            code = 202
+
+        stores[store].setdefault("granules", []).extend(granules)
+        return self.respond(code)
+
+    def granules(self, store):
+        """
+        Lists or removes the granules of a mosaic, removals are filtered by
+        location LIKE '%text%'
+        """
+        granules = store.setdefault("granules", [])
+
+        if self.command == "DELETE":
+            text = self.query.get("filter", [""])[0].split("'")[1].strip("%")
+            removed = [g for g in granules if text in g]
+            store["granules"] = [g for g in granules if g not in removed]
+
+            if self.query.get("purge", ["none"])[0] == "all":
+                for g in removed:
+                    self.catalog.resources.pop(g, None)
+
+            return self.respond(200)
+
+        return self.respond(200, {"type":"FeatureCollection", "features":[
+                                  {"properties":{"location":g}}
+                                  for g in granules]})
+
+    def styles(self, parts):
+        styles = self.catalog.styles
+
+        if not parts:
+            if self.command == "POST":
+                styles[json.loads(self.read_body())["style"]["name"]] = b""
+                return self.respond(201)
+
+            return self.respond(200, {"styles":{"style":[{"name":n}
+                                                         for n in styles]}})
+        name = parts[0]
+
+        if self.command == "PUT":
+            styles[name] = self.read_body()
+            return self.respond(200)
+
+        if name not in styles:
+            return self.respond(404)
+
+        if self.command == "DELETE":
+            styles.pop(name)
+            return self.respond(200)
+
+        return self.respond(200, {"style":{"name":name}})
+
+    def layers(self, parts):
+        if not parts or parts[0] not in self.catalog.layers:
+            return self.respond(404)
+
+        layer = self.catalog.layers[parts[0]]
+
+        if len(parts) == 2 and parts[1] == "styles":
+            if self.command == "POST":
+                name = json.loads(self.read_body())["style"]["name"]
+                if name not in layer["styles"]:
+                    layer["styles"].append(name)
+                return self.respond(201)
+
+            return self.respond(200, {"styles":{"style":[{"name":n} for n in
+                                                         layer["styles"]]}})
+        if self.command == "PUT":
+            info = json.loads(self.read_body())["layer"]
+            if "styles" in info:
+                layer["styles"] = [s["name"] for s in info["styles"]["style"]]
+            if "defaultStyle" in info:
+                layer["defaultStyle"] = info["defaultStyle"]["name"]
+            return self.respond(200)
+
+        styles = [{"name":n} for n in layer["styles"]]
+        default = layer["defaultStyle"]
+        return self.respond(200, {"layer":{
+                        "name":parts[0].split(":")[1],
+                        "defaultStyle":{"name":default} if default else None,
+                        "styles":{"style":styles} if styles else ""}})
+
+    def wcs(self, basin, query):
+        """
+        GetCoverage returning a placeholder body of the format requested,
+        subsets are smaller than whole coverages
+        """
+        coverage = query.get("coverageId", [""])[0].replace("__", ":", 1)
+
+        if coverage not in self.catalog.layers:
+            return self.respond(200, b"<ows:ExceptionReport><ows:Exception>"
+                                     b"No such coverage</ows:Exception>"
+                                     b"</ows:ExceptionReport>",
+                                ctype="application/xml")
+
+        size = 1024 if "subset" in query else 4096
+        return self.respond(200, b"\0" * size,
+                            ctype=query.get("format", ["image/tiff"])[0])
+
+    def resource(self, path):
+        path = path.strip("/")
+        resources = self.catalog.resources
+
+        if self.command == "PUT":
+            body = self.read_body()
+            content_range = self.headers.get("Content-Range")
+
+            # Partial uploads append at the offset given
+            if content_range:
+                start = int(content_range.split()[1].split("-")[0])
+                body = resources.get(path, b"")[:start] + body
+
+            resources[path] = body
+            return self.respond(201)
+
+        if self.command == "DELETE":
+            if resources.pop(path, None) == None:
+                return self.respond(404)
+            return self.respond(200)
+
+        if path in resources:
+            data = resources[path]
+            rng = self.headers.get("Range")
+
+            if rng and self.command == "GET":
+                start, end = rng.split("=")[1].split("-")
+                end = int(end) if end else len(data) - 1
+                return self.respond(206, data[int(start):end + 1],
+                        {"Content-Range":"bytes {}-{}/{}".format(start, end,
+                                                                 len(data)),
+                         "Accept-Ranges":"bytes"})
+
+            return self.respond(200, data, {"Accept-Ranges":"bytes"})
+
+        # Directory listing
+        children = sorted(set([p[len(path) + 1:].split("/")[0]
+                               for p in resources
+                               if p.startswith(path + "/")]))
+        if children:
+            items = [{"name":c, "link":{"href":self.href("resource/{}/{}"
+                                                         "".format(path, c))}}
+                     for c in children]
+            return self.respond(200, {"ResourceDirectory":{
+                                        "name":path.split("/")[-1],
+                                        "children":{"child":items}}})
+
+        return self.respond(404)
+
+
+class StubGeoserver(object):
+    """
+    Runs the stub on a background thread, use as a context manager.
+
+    Args:
+        latency: Seconds to delay every request
+        catalog: Catalog to serve, defaults to an empty kings basin
+    """
+
+    def __init__(self, latency=0.0, catalog=None):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.catalog = catalog or Catalog()
+        self.server.counts = Counter()
+        self.server.lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    @property
+    def url(self):
+        return "http://{}:{}/geoserver/".format(*self.server.server_address)
+
+    @property
+    def catalog(self):
+        return self.server.catalog
+
+    def requests(self):
+        """
+        Returns the total number of requests received so far
+        """
+        with self.server.lock:
+            return sum(self.server.counts.values())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,371 @@
+import time
+from threading import RLock
+
+
+class Catalog(object):
+    """
+    In memory index of the geoserver catalog. Workspaces are listed once and
+    each workspace's stores and each store's layers are listed the first time
+    they are asked about. Afterwards existence checks are dictionary lookups.
+
+    Styles are listed once as well along with an index of the styles whose
+    names contain each keyword so matching styles to a layer is a lookup.
+
+    The index is kept current by passing successful POST and DELETE requests
+    to record_make and record_delete. If a ttl is provided the whole index is
+    dropped and relisted once it is older than ttl seconds.
+
+    Args:
+        get: Function that receives a resource and returns the json response
+             as a dictionary, e.g. AWSM_Geoserver.get
+        ttl: Seconds before the index is considered stale, None never expires
+        log: Logger to report to
+        keywords: Keywords to index the style names by
+    """
+
+    # Store types, their rest collection, json keys and their layer collection
+    store_types = {"coverageStores": ("coveragestores", "coverageStore",
+                                      "coverages", "coverages", "coverage"),
+                   "dataStores": ("datastores", "dataStore",
+                                  "featuretypes", "featureTypes",
+                                  "featureType")}
+
+    def __init__(self, get, ttl=None, log=None, keywords=()):
+        self.get = get
+        self.ttl = ttl
+        self.log = log
+        self.keywords = keywords
+        self.lock = RLock()
+
+        self.workspaces = None
+        self.loaded_at = None
+
+        self.styles = None
+        self.style_index = None
+        self.styles_loaded_at = None
+
+    def clear(self):
+        """
+        Drops everything in the index so it is relisted on the next check
+        """
+        with self.lock:
+            self.workspaces = None
+            self.loaded_at = None
+
+            self.styles = None
+            self.style_index = None
+            self.styles_loaded_at = None
+
+    def expired(self, loaded_at):
+        """
+        Returns True if part of the index has never been loaded or is older
+        than the ttl
+
+        Args:
+            loaded_at: Time the part of the index being checked was loaded
+        """
+        if loaded_at == None:
+            return True
+
+        elif self.ttl != None:
+            return (time.time() - loaded_at) > self.ttl
+
+        return False
+
+    def load(self):
+        """
+        Lists all the workspaces on the geoserver, stores are left unlisted
+        until they are requested.
+        """
+        with self.lock:
+            if self.log != None:
+                self.log.debug("Loading the geoserver catalog index...")
+
+            rjson = self.get("workspaces")
+            self.workspaces = {}
+
+            if rjson["workspaces"]:
+                for w in rjson["workspaces"]["workspace"]:
+                    self.workspaces[w["name"]] = self.new_workspace()
+
+            self.loaded_at = time.time()
+
+    def new_workspace(self):
+        """
+        Returns an empty, unlisted entry for a workspace
+        """
+        return {k:None for k in self.store_types.keys()}
+
+    def get_workspaces(self):
+        """
+        Returns the dictionary of workspaces, loading it if need be
+        """
+        with self.lock:
+            if self.expired(self.loaded_at):
+                self.load()
+
+            return self.workspaces
+
+    def get_stores(self, basin, store_type="coverageStores"):
+        """
+        Returns the dictionary of stores in a workspace, listing it from the
+        geoserver if it hasn't been yet.
+
+        Args:
+            basin: Name of the workspace
+            store_type: coverageStores or dataStores
+
+        Returns:
+            dict: store names mapped to a set of layers or None if unlisted,
+                  None if the workspace doesn't exist
+        """
+        with self.lock:
+            workspaces = self.get_workspaces()
+
+            if basin not in workspaces:
+                return None
+
+            if workspaces[basin][store_type] == None:
+                collection, key = self.store_types[store_type][0:2]
+                rjson = self.get("workspaces/{}/{}".format(basin, collection))
+
+                stores = {}
+                if rjson[store_type]:
+                    for s in rjson[store_type][key]:
+                        stores[s["name"]] = None
+
+                workspaces[basin][store_type] = stores
+
+            return workspaces[basin][store_type]
+
+    def get_store_layers(self, basin, store, store_type="coverageStores"):
+        """
+        Returns the set of layer names in a store listing them from the
+        geoserver if it hasn't been yet.
+
+        Args:
+            basin: Name of the workspace
+            store: Name of the coverage or data store
+            store_type: coverageStores or dataStores
+
+        Returns:
+            set: Names of the layers, None if the store doesn't exist
+        """
+        with self.lock:
+            stores = self.get_stores(basin, store_type=store_type)
+
+            if stores == None or store not in stores:
+                return None
+
+            if stores[store] == None:
+                collection = self.store_types[store_type][0]
+                lyr_collection, key, item = self.store_types[store_type][2:]
+                rjson = self.get("workspaces/{}/{}/{}/{}".format(basin,
+                                                                 collection,
+                                                                 store,
+                                                                 lyr_collection))
+                layers = set()
+                if rjson[key]:
+                    for lyr in rjson[key][item]:
+                        layers.add(lyr["name"])
+
+                stores[store] = layers
+
+            return stores[store]
+
+    def load_styles(self):
+        """
+        Lists all the styles on the geoserver and indexes them by keyword
+        """
+        with self.lock:
+            if self.log != None:
+                self.log.debug("Loading the geoserver style index...")
+
+            rjson = self.get("styles")
+            self.styles = set()
+            self.style_index = {k:set() for k in self.keywords}
+
+            if rjson["styles"]:
+                for style in rjson["styles"]["style"]:
+                    self.add_style(style["name"])
+
+            self.styles_loaded_at = time.time()
+
+    def add_style(self, name):
+        """
+        Adds a style name to the list and to the index of each keyword in it
+        """
+        self.styles.add(name)
+
+        for k in self.keywords:
+            if k in name.lower():
+                self.style_index[k].add(name)
+
+    def get_styles(self):
+        """
+        Returns the set of style names, loading them if need be
+        """
+        with self.lock:
+            if self.expired(self.styles_loaded_at):
+                self.load_styles()
+
+            return self.styles
+
+    def get_keyword_styles(self, keyword):
+        """
+        Returns the set of style names containing a keyword
+        """
+        with self.lock:
+            self.get_styles()
+            return self.style_index.get(keyword, set())
+
+    def has_workspace(self, basin):
+        return basin in self.get_workspaces()
+
+    def has_store(self, basin, store, store_type="coverageStores"):
+        stores = self.get_stores(basin, store_type=store_type)
+        return stores != None and store in stores
+
+    def has_layer(self, basin, store, layer, store_type="coverageStores"):
+        layers = self.get_store_layers(basin, store, store_type=store_type)
+        return layers != None and layer in layers
+
+    def parse(self, resource):
+        """
+        Splits a relative rest resource into its parts, dropping any format
+        extension and slashes
+        """
+        resource = resource.split('?')[0].strip('/')
+
+        for ext in ['.json', '.xml']:
+            if resource.endswith(ext):
+                resource = resource[:-len(ext)]
+
+        return resource.split('/')
+
+    def find_store_type(self, collection):
+        """
+        Returns the store type from its rest collection name, e.g. datastores
+        """
+        for store_type, info in self.store_types.items():
+            if info[0] == collection:
+                return store_type
+
+        return None
+
+    def record_make(self, resource, payload):
+        """
+        Updates the index after a successful POST to resource.
+
+        Args:
+            resource: Relative rest resource that was posted to
+            payload: Dictionary that was posted
+        """
+        parts = self.parse(resource)
+
+        with self.lock:
+            # New style
+            if parts == ["styles"] and "style" in payload:
+                if self.styles != None:
+                    self.add_style(payload["style"]["name"])
+                return
+
+            if self.workspaces == None or parts[0] != "workspaces":
+                return
+
+            # New workspace, nothing in it yet
+            if len(parts) == 1 and "workspace" in payload:
+                name = payload["workspace"]["name"]
+                self.workspaces[name] = {k:{} for k in self.store_types.keys()}
+                return
+
+            basin = parts[1]
+            if basin not in self.workspaces:
+                return
+
+            store_type = self.find_store_type(parts[2]) if len(parts) > 2 \
+                                                        else None
+            if store_type == None:
+                self.forget(basin)
+                return
+
+            stores = self.workspaces[basin][store_type]
+            key = self.store_types[store_type][1]
+            item = self.store_types[store_type][4]
+
+            # New store, layers may be auto configured so leave unlisted
+            if len(parts) == 3 and key in payload:
+                if stores != None:
+                    stores[payload[key]["name"]] = None
+
+            # New layer in a store
+            elif len(parts) == 5 and item in payload:
+                if stores != None and stores.get(parts[3]) != None:
+                    stores[parts[3]].add(payload[item]["name"])
+
+            else:
+                self.forget(basin)
+
+    def record_delete(self, resource):
+        """
+        Updates the index after a successful DELETE of resource.
+
+        Args:
+            resource: Relative rest resource that was deleted
+        """
+        parts = self.parse(resource)
+
+        with self.lock:
+            # Style removed
+            if len(parts) == 2 and parts[0] == "styles":
+                if self.styles != None:
+                    self.styles.discard(parts[1])
+                    for styles in self.style_index.values():
+                        styles.discard(parts[1])
+                return
+
+            if self.workspaces == None or parts[0] != "workspaces" \
+                                      or len(parts) < 2:
+                return
+
+            basin = parts[1]
+
+            if len(parts) == 2:
+                self.workspaces.pop(basin, None)
+                return
+
+            if basin not in self.workspaces:
+                return
+
+            store_type = self.find_store_type(parts[2])
+            if store_type == None:
+                self.forget(basin)
+                return
+
+            stores = self.workspaces[basin][store_type]
+
+            if stores == None:
+                return
+
+            # Mosaic granules aren't part of the catalog
+            if len(parts) > 6 and parts[6] == "index":
+                return
+
+            # Whole store removed
+            if len(parts) == 4:
+                stores.pop(parts[3], None)
+
+            # Single layer removed
+            elif len(parts) == 6 and parts[4] == self.store_types[store_type][2]:
+                if stores.get(parts[3]) != None:
+                    stores[parts[3]].discard(parts[5])
+
+            else:
+                self.forget(basin)
+
+    def forget(self, basin):
+        """
+        Marks a workspace's stores as unlisted so they're relisted on demand
+        """
+        if self.workspaces != None and basin in self.workspaces:
+            self.workspaces[basin] = self.new_workspace()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import coloredlogs
+
+from guds import __version__
+
+
+def setup_logging(debug=False):
+    """
+    Sets up the guds logger, messages from each basin are prefixed with the
+    logger name guds.<basin>
+    """
+    log = logging.getLogger("guds")
+    coloredlogs.install(fmt='%(levelname)-5s %(name)s %(message)s',
+                        level='DEBUG' if debug else 'INFO', logger=log)
+    return log
+
+
+def upload_basin(basin, config, credentials, options):
+    """
+    Runs a complete upload for a single basin. Meant to run in its own process
+    with its own geoserver session and temporary directory.
+
+    Args:
+        basin: Name of the basin/workspace
+        config: Dictionary from the manifest for this basin containing files
+                and optionally data_type, mask, espg and latest
+        credentials: Path to the geoserver credentials json
+        options: Dictionary of keyword arguments for AWSM_Geoserver
+
+    Returns:
+        dict: Summary of the upload for the basin
+    """
+    from guds.upload import AWSM_Geoserver
+
+    start = time.time()
+    summary = {"basin":basin, "files":0, "failed":[], "error":None}
+
+    tmp = tempfile.mkdtemp(prefix="guds_{}_".format(basin))
+    journal = os.path.join(os.path.expanduser('~'), '.guds',
+                           'transfers_{}.json'.format(basin))
+    log = logging.getLogger("guds.{}".format(basin))
+
+    try:
+        gs = AWSM_Geoserver(credentials, log=log, bypass=True, tmp=tmp,
+                                         journal=journal, **options)
+
+        # Let the shared handler print it so each line is tagged by basin
+        for h in list(log.handlers):
+            log.removeHandler(h)
+
+        setup_logging(options.get("debug", False))
+
+        data_type = config.get("data_type", "modeled")
+        files = gs.find_files(config["files"], upload_type=data_type)
+        summary["files"] = len(files)
+
+        errors = gs.upload_batch(basin, files, upload_type=data_type,
+                                               espg=config.get("espg"),
+                                               mask=config.get("mask"))
+        summary["failed"] = list(errors.keys())
+
+        if data_type == 'modeled' and config.get("latest", False):
+            gs.create_latest_layers(basin)
+
+    # Report everything back to the parent, including user input errors that
+    # still exit
+    except (Exception, SystemExit) as e:
+        summary["error"] = repr(e)
+
+    # Uploads only clean up after themselves when they finish
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    summary["seconds"] = time.time() - start
+
+    return summary
+
+
+def run_manifest(manifest, credentials, workers=None, options=None, log=None):
+    """
+    Runs an upload for every basin in a manifest using a pool of processes.
+
+    Args:
+        manifest: Dictionary of basin names to their upload configuration
+        credentials: Path to the geoserver credentials json
+        workers: Max number of basins to upload at once, defaults to all
+        options: Dictionary of keyword arguments for AWSM_Geoserver
+        log: Logger to report to
+
+    Returns:
+        list: Summaries of each basin's upload
+    """
+    if log == None:
+        log = logging.getLogger(__name__)
+
+    options = dict(options or {})
+    workers = workers or len(manifest)
+    summaries = []
+
+    log.info("Uploading {} basins using {} processes..."
+             "".format(len(manifest), workers))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(upload_basin, basin, config, credentials,
+                                             options):basin
+                   for basin, config in manifest.items()}
+
+        for f in as_completed(futures):
+            basin = futures[f]
+
+            try:
+                summary = f.result()
+
+            except Exception as e:
+                summary = {"basin":basin, "files":0, "failed":[],
+                           "error":repr(e), "seconds":None}
+
+            log.info("Finished the {} basin".format(basin))
+            summaries.append(summary)
+
+    return sorted(summaries, key=lambda s: s["basin"])
+
+
+def report(summaries, log):
+    """
+    Logs a table summarizing each basin's upload
+
+    Returns:
+        bool: True if every basin uploaded without failures
+    """
+    ok = True
+    lines = ["{:<12} {:>6} {:>7} {:>9}  {}".format("Basin", "Files", "Failed",
+                                                    "Time (s)", "Error")]
+
+    for s in summaries:
+        failed = len(s["failed"])
+        seconds = "" if s["seconds"] == None else "{:0.1f}".format(s["seconds"])
+        lines.append("{:<12} {:>6} {:>7} {:>9}  {}".format(s["basin"],
+                                                           s["files"], failed,
+                                                           seconds,
+                                                           s["error"] or ""))
+        if failed or s["error"]:
+            ok = False
+
+    log.info("Summary:\n" + "\n".join(lines))
+
+    return ok
+
+
+def main():
+    p = argparse.ArgumentParser(description="Uploads data for many basins at"
+                                            " once, each in its own process,"
+                                            " using a manifest of basins and"
+                                            " their files")
+
+    p.add_argument('manifest',
+                    help="JSON mapping each basin name to a dictionary with"
+                         " files (list of paths, globs or run directories) and"
+                         " optionally data_type, mask, espg and latest")
+
+    p.add_argument('-c','--credentials', dest='credentials',
+                    default='./geoserver.json',
+                    help="JSON containing geoserver credentials for logging in")
+
+    p.add_argument('-w','--workers', dest='workers', type=int, default=None,
+                    help="Max number of basins to upload at once, default is"
+                         " all of them")
+
+    p.add_argument('-j','--jobs', dest='jobs', type=int, default=1,
+                    help="Number of workers each basin uses to create layers")
+
+    p.add_argument('-s','--summary', dest='summary', default=None,
+                    help="Path to write the summary of the uploads as json")
+
+    p.add_argument('-d','--debug', dest='debug', action='store_true',
+                    help="Shows debug messages")
+
+    args = p.parse_args()
+
+    log = setup_logging(args.debug)
+
+    log.info("GUDS v{} multi-basin upload".format(__version__))
+    log.warning("Running unattended, all questions will be answered yes.")
+
+    with open(args.manifest) as fp:
+        manifest = json.load(fp)
+
+    start = time.time()
+    summaries = run_manifest(manifest, args.credentials, workers=args.workers,
+                             options={"debug":args.debug, "jobs":args.jobs},
+                             log=log)
+    ok = report(summaries, log)
+
+    if args.summary != None:
+        with open(args.summary, 'w') as fp:
+            json.dump(summaries, fp, indent=2)
+
+    log.info("Completed in {0:0.1f}s".format(time.time() - start))
+
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
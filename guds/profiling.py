@@ -0,0 +1,103 @@
+import json
+import time
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock
+
+
+class Profiler(object):
+    """
+    Collects the time spent in each phase of an upload and the latency, status
+    and size of every request sent to the geoserver.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.start = time.time()
+        self.phases = {}
+        self.requests = []
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager timing a named phase, repeated phases are summed
+        """
+        start = time.time()
+
+        try:
+            yield
+
+        finally:
+            elapsed = time.time() - start
+
+            with self.lock:
+                p = self.phases.setdefault(name, {"calls":0, "seconds":0.0})
+                p["calls"] += 1
+                p["seconds"] += elapsed
+
+    def record_response(self, r, *args, **kwargs):
+        """
+        Hook for a requests session recording each response. Sizes come from
+        the Content-Length headers so streamed bodies are not read here.
+        """
+        body = r.request.body
+        if body == None:
+            sent = 0
+        elif isinstance(body, (bytes, str)):
+            sent = len(body)
+        else:
+            sent = int(r.request.headers.get('Content-Length', 0))
+
+        with self.lock:
+            self.requests.append({"method":r.request.method,
+                                  "url":r.url,
+                                  "status":r.status_code,
+                                  "seconds":r.elapsed.total_seconds(),
+                                  "sent":sent,
+                                  "received":int(r.headers.get('Content-Length',
+                                                               0))})
+
+    def report(self):
+        """
+        Returns a dictionary of the phases, requests and a summary of the
+        requests by method
+        """
+        with self.lock:
+            methods = {}
+            for req in self.requests:
+                m = methods.setdefault(req["method"], {"count":0,
+                                                        "seconds":0.0,
+                                                        "sent":0,
+                                                        "received":0})
+                m["count"] += 1
+                m["seconds"] += req["seconds"]
+                m["sent"] += req["sent"]
+                m["received"] += req["received"]
+
+            return {"seconds":time.time() - self.start,
+                    "phases":dict(self.phases),
+                    "request_summary":methods,
+                    "requests":list(self.requests)}
+
+    def write(self, fname):
+        """
+        Writes the report to a json file
+        """
+        with open(fname, 'w') as fp:
+            json.dump(self.report(), fp, indent=2)
+
+
+def timed(name):
+    """
+    Decorator for AWSM_Geoserver methods that times the method as a phase
+    using the instance's profiler.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.phase(name):
+                return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,263 @@
+import random
+import time
+from threading import Lock
+
+import requests
+
+
+class GeoserverError(Exception):
+    """
+    Raised when the geoserver can't do what was asked of it
+
+    Args:
+        message: Description of the problem
+        resource: Resource the request was made to
+        status: HTTP status code received, None if there was no response
+    """
+
+    def __init__(self, message, resource=None, status=None):
+        super().__init__(message)
+        self.resource = resource
+        self.status = status
+
+
+class AuthenticationError(GeoserverError):
+    """
+    Raised on a 401, the credentials are missing or wrong
+    """
+    pass
+
+
+class ForbiddenError(GeoserverError):
+    """
+    Raised on a 403, the credentials don't have access to the resource
+    """
+    pass
+
+
+class NotFoundError(GeoserverError):
+    """
+    Raised on a 404, the resource doesn't exist
+    """
+    pass
+
+
+class ServerError(GeoserverError):
+    """
+    Raised on a 5xx that didn't go away after retrying
+    """
+    pass
+
+
+class UnavailableError(GeoserverError):
+    """
+    Raised when the geoserver can't be reached or doesn't answer in time after
+    retrying
+    """
+    pass
+
+
+class CircuitOpenError(UnavailableError):
+    """
+    Raised without sending a request while the circuit breaker is open
+    """
+    pass
+
+
+def status_error(resource, code):
+    """
+    Returns the exception for a failed status code
+
+    Args:
+        resource: Resource the request was made to
+        code: HTTP status code of the response
+
+    Returns:
+        GeoserverError: Exception to raise
+    """
+    msg = "Resource {}".format(resource)
+
+    if code == 401:
+        return AuthenticationError(msg + " requires credentials with more"
+                                         " access.", resource, code)
+    elif code == 403:
+        return ForbiddenError(msg + " is forbidden to access.", resource, code)
+
+    elif code == 404:
+        return NotFoundError(msg + " was not found on geoserver.", resource,
+                                                                   code)
+    elif code >= 500:
+        return ServerError(msg + " failed with a server error ({})."
+                                 "".format(code), resource, code)
+
+    return GeoserverError(msg + " was rejected ({}).".format(code), resource,
+                                                                     code)
+
+
+class CircuitBreaker(object):
+    """
+    Stops requests from being sent once the geoserver has failed several
+    times in a row so a run fails fast instead of waiting on every timeout.
+    After a cool down requests are let through again, the first success
+    closes the circuit and another failure opens it for another cool down.
+
+    Args:
+        threshold: Number of failures in a row that opens the circuit
+        reset: Seconds to wait before trying the geoserver again
+    """
+
+    def __init__(self, threshold=5, reset=30):
+        self.lock = Lock()
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+
+    def check(self, url):
+        """
+        Raises a CircuitOpenError if requests shouldn't be sent right now
+        """
+        with self.lock:
+            if self.opened_at == None:
+                return
+
+            wait = self.opened_at + self.reset - time.time()
+
+            if wait > 0:
+                raise CircuitOpenError("Geoserver is unavailable, not sending"
+                                       " {} for another {:0.0f}s"
+                                       "".format(url, wait), url)
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        """
+        Records a failure
+
+        Returns:
+            bool: True if this failure opened the circuit
+        """
+        with self.lock:
+            self.failures += 1
+
+            if self.failures >= self.threshold:
+                opened = self.opened_at == None
+                self.opened_at = time.time()
+                return opened
+
+            return False
+
+
+class GeoserverSession(requests.Session):
+    """
+    Session that gives every request a timeout, retries the ones that failed
+    because the geoserver was busy or unreachable and trips a circuit breaker
+    when it stays down.
+
+    Idempotent requests are retried on connection errors, timeouts and a 502,
+    503 or 504. A POST is only retried on a 503 since the geoserver turned it
+    away without doing anything. Only bytes, strings, dictionaries and files
+    that can be rewound are sent again. Other bodies like generators are
+    never retried, the transfers handle resuming those themselves.
+
+    Args:
+        log: Logger to report retries to
+        timeout: Connect and read timeouts in seconds
+        retries: Number of times to retry a failed request
+        backoff: Seconds to wait before the first retry, doubled each time
+        breaker: CircuitBreaker shared by the requests, None to disable
+    """
+
+    idempotent = ["GET", "HEAD", "PUT", "DELETE", "OPTIONS"]
+
+    # Statuses sent by a geoserver or proxy shedding load
+    retry_statuses = [502, 503, 504]
+
+    def __init__(self, log, timeout=(10, 300), retries=3, backoff=1,
+                            breaker=None):
+        super().__init__()
+        self.log = log
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") == None:
+            kwargs["timeout"] = self.timeout
+
+        method = method.upper()
+        body = kwargs.get("data")
+        position = None
+        seekable = body == None or isinstance(body, (bytes, str, dict))
+
+        # Remember where a file body starts so it can be sent again, anything
+        # else like a generator is used up by the first attempt
+        if not seekable and hasattr(body, "seek") and hasattr(body, "tell"):
+            try:
+                position = body.tell()
+                seekable = True
+
+            except OSError:
+                pass
+
+        attempt = 0
+        while True:
+            if self.breaker != None:
+                self.breaker.check(url)
+
+            if attempt > 0 and position != None:
+                body.seek(position)
+
+            try:
+                r = super().request(method, url, **kwargs)
+
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                self.failed()
+
+                if not self.retryable(method, attempt, seekable):
+                    raise UnavailableError("Unable to reach the geoserver for"
+                                           " {} {}: {}".format(method, url, e),
+                                           url) from e
+                reason = repr(e)
+
+            else:
+                if r.status_code not in self.retry_statuses:
+                    if self.breaker != None:
+                        self.breaker.success()
+                    return r
+
+                self.failed()
+
+                if not self.retryable(method, attempt, seekable,
+                                      status=r.status_code):
+                    return r
+
+                reason = "status {}".format(r.status_code)
+                r.close()
+
+            attempt += 1
+            wait = self.backoff * 2 ** (attempt - 1) * random.uniform(1, 1.5)
+            self.log.warning("{} {} failed ({}), retrying in {:0.1f}s..."
+                             "".format(method, url, reason, wait))
+            time.sleep(wait)
+
+    def retryable(self, method, attempt, seekable, status=None):
+        """
+        Returns True if a failed request can be sent again
+        """
+        if attempt >= self.retries or not seekable:
+            return False
+
+        return method in self.idempotent or (method == "POST" and
+                                             status == 503)
+
+    def failed(self):
+        if self.breaker != None and self.breaker.failure():
+            self.log.error("Geoserver failed {} times in a row, pausing"
+                           " requests for {}s".format(self.breaker.threshold,
+                                                      self.breaker.reset))
@@ -0,0 +1,407 @@
+import os
+import sqlite3
+import time
+from threading import Lock
+
+
+class State(object):
+    """
+    Local SQLite record of what GUDS has published to a geoserver. Per basin
+    it keeps the data files sent (size, checksum and remote path), the stores
+    and layers made, the range of each layer and the styles assigned to it.
+
+    The record only grows from what GUDS publishes and confirms. It is only a
+    hint, anything it says is published is confirmed with the geoserver before
+    it's relied on so changes made outside of GUDS aren't missed. Reconciling
+    a basin replaces its record with a listing from the geoserver.
+
+    The database is opened the first time it's used. If it can't be written,
+    e.g. a read only home directory, the record is only kept in memory for
+    this run.
+
+    Args:
+        fname: Path to the database, created if need be, :memory: to only
+               keep the record for this run
+        data: Resource path of the data folder, e.g. resource/data/basins,
+              used to recognize deleted data files
+        log: Logger to warn if the database can't be opened
+    """
+
+    schema = ["CREATE TABLE IF NOT EXISTS basins ("
+              " name TEXT PRIMARY KEY,"
+              " reconciled_at REAL)",
+
+              "CREATE TABLE IF NOT EXISTS files ("
+              " basin TEXT, path TEXT, checksum TEXT, size INTEGER,"
+              " updated_at REAL,"
+              " PRIMARY KEY (basin, path))",
+
+              "CREATE TABLE IF NOT EXISTS stores ("
+              " basin TEXT, name TEXT, store_type TEXT, source TEXT,"
+              " PRIMARY KEY (basin, name, store_type))",
+
+              "CREATE TABLE IF NOT EXISTS layers ("
+              " basin TEXT, name TEXT, store TEXT,"
+              " range_min REAL, range_max REAL,"
+              " styled INTEGER DEFAULT 0, default_style TEXT,"
+              " PRIMARY KEY (basin, name))",
+
+              "CREATE TABLE IF NOT EXISTS layer_styles ("
+              " basin TEXT, layer TEXT, style TEXT, position INTEGER,"
+              " PRIMARY KEY (basin, layer, style))"]
+
+    # Rest collections of each store type and of their layers
+    store_types = {"coveragestores":("coverageStores", "coverages"),
+                   "datastores":("dataStores", "featuretypes")}
+
+    def __init__(self, fname, data=None, log=None):
+        self.fname = fname
+        self.data = data
+        self.log = log
+        self.lock = Lock()
+        self.db = None
+
+    def open(self, fname):
+        """
+        Connects to a database and makes sure it has the tables
+        """
+        if fname != ":memory:":
+            path = os.path.dirname(os.path.abspath(fname))
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        # Basins uploading in other processes share the database
+        db = sqlite3.connect(fname, timeout=30, check_same_thread=False)
+
+        try:
+            with db:
+                if fname != ":memory:":
+                    db.execute("PRAGMA journal_mode=WAL")
+
+                for table in self.schema:
+                    db.execute(table)
+
+        except sqlite3.Error:
+            db.close()
+            raise
+
+        return db
+
+    def connect(self):
+        """
+        Returns the connection to the database, opening it on first use
+        """
+        if self.db == None:
+            try:
+                self.db = self.open(self.fname)
+
+            except (OSError, sqlite3.Error) as e:
+                if self.log != None:
+                    self.log.warning("Unable to open the local state {} ({}),"
+                                     " keeping it in memory for this run"
+                                     "".format(self.fname, e))
+                self.db = self.open(":memory:")
+
+        return self.db
+
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.connect().execute(sql, args).fetchall()
+
+    def execute(self, statements):
+        """
+        Runs a list of (sql, args) in a single transaction
+        """
+        with self.lock:
+            db = self.connect()
+
+            with db:
+                for sql, args in statements:
+                    db.execute(sql, args)
+
+    def add_basin(self, basin):
+        self.execute([("INSERT OR IGNORE INTO basins (name) VALUES (?)",
+                       (basin,))])
+
+    def has_basin(self, basin):
+        return len(self.query("SELECT 1 FROM basins WHERE name=?",
+                              (basin,))) > 0
+
+    def get_basins(self):
+        return [r[0] for r in self.query("SELECT name FROM basins"
+                                         " ORDER BY name")]
+
+    def add_file(self, basin, path, checksum, size):
+        """
+        Records a data file sent to the geoserver
+
+        Args:
+            basin: Name of the basin
+            path: Path of the file in the basin's data folder
+            checksum: md5 of the file
+            size: Size of the file in bytes
+        """
+        self.execute([("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                       (basin, path, checksum, size, time.time()))])
+
+    def get_file(self, basin, path):
+        """
+        Returns a dictionary of the checksum and size of a data file or None
+        if it isn't recorded
+        """
+        rows = self.query("SELECT checksum, size FROM files"
+                          " WHERE basin=? AND path=?", (basin, path))
+
+        if not rows:
+            return None
+
+        return {"checksum":rows[0][0], "size":rows[0][1]}
+
+    def add_store(self, basin, store, store_type="coverageStores",
+                                      source=None):
+        """
+        Records a store on the geoserver
+
+        Args:
+            basin: Name of the basin
+            store: Name of the store
+            store_type: coverageStores or dataStores
+            source: Name of the store this one was copied from, e.g. for the
+                    latest stores
+        """
+        self.execute([("INSERT OR IGNORE INTO basins (name) VALUES (?)",
+                       (basin,)),
+                      ("INSERT OR REPLACE INTO stores VALUES (?, ?, ?, ?)",
+                       (basin, store, store_type, source))])
+
+    def has_store(self, basin, store, store_type="coverageStores"):
+        return len(self.query("SELECT 1 FROM stores WHERE basin=? AND name=?"
+                              " AND store_type=?",
+                              (basin, store, store_type))) > 0
+
+    def get_stores(self, basin, store_type="coverageStores"):
+        return [r[0] for r in self.query("SELECT name FROM stores WHERE"
+                                         " basin=? AND store_type=?"
+                                         " ORDER BY name",
+                                         (basin, store_type))]
+
+    def get_source(self, basin, store):
+        """
+        Returns the name of the store a store was copied from or None
+        """
+        rows = self.query("SELECT source FROM stores WHERE basin=? AND name=?",
+                          (basin, store))
+        return rows[0][0] if rows else None
+
+    def add_layer(self, basin, store, layer, value_range=None):
+        """
+        Records a layer and optionally its range, keeping any styles and
+        range already recorded for it
+
+        Args:
+            basin: Name of the basin
+            store: Name of the store the layer belongs to
+            layer: Name of the layer
+            value_range: Min and max of the layer's values
+        """
+        low, high = value_range if value_range != None else (None, None)
+
+        self.execute([("INSERT OR IGNORE INTO layers (basin, name)"
+                       " VALUES (?, ?)", (basin, layer)),
+                      ("UPDATE layers SET store=?,"
+                       " range_min=COALESCE(?, range_min),"
+                       " range_max=COALESCE(?, range_max)"
+                       " WHERE basin=? AND name=?",
+                       (store, low, high, basin, layer))])
+
+    def has_layer(self, basin, store, layer):
+        return len(self.query("SELECT 1 FROM layers WHERE basin=? AND name=?"
+                              " AND store=?", (basin, layer, store))) > 0
+
+    def get_layers(self, basin):
+        return [r[0] for r in self.query("SELECT name FROM layers WHERE"
+                                         " basin=? AND store IS NOT NULL"
+                                         " ORDER BY name", (basin,))]
+
+    def get_range(self, basin, layer):
+        rows = self.query("SELECT range_min, range_max FROM layers WHERE"
+                          " basin=? AND name=?", (basin, layer))
+
+        if not rows or rows[0][0] == None:
+            return None
+
+        return rows[0]
+
+    def set_styles(self, basin, layer, styles, default=None):
+        """
+        Records the styles assigned to a layer and its default style
+
+        Args:
+            basin: Name of the basin
+            layer: Name of the layer
+            styles: List of style names
+            default: Name of the default style, None leaves it unchanged
+        """
+        statements = [("INSERT OR IGNORE INTO layers (basin, name)"
+                       " VALUES (?, ?)", (basin, layer)),
+                      ("UPDATE layers SET styled=1 WHERE basin=? AND name=?",
+                       (basin, layer)),
+                      ("DELETE FROM layer_styles WHERE basin=? AND layer=?",
+                       (basin, layer))]
+
+        statements += [("INSERT OR IGNORE INTO layer_styles"
+                        " VALUES (?, ?, ?, ?)", (basin, layer, s, i))
+                       for i, s in enumerate(styles)]
+
+        if default != None:
+            statements.append(("UPDATE layers SET default_style=? WHERE"
+                               " basin=? AND name=?", (default, basin, layer)))
+
+        self.execute(statements)
+
+    def get_styles(self, basin, layer):
+        """
+        Returns the styles of a layer as a tuple of the style names and the
+        default style, None if they aren't recorded
+        """
+        rows = self.query("SELECT default_style FROM layers WHERE basin=?"
+                          " AND name=? AND styled=1", (basin, layer))
+        if not rows:
+            return None
+
+        styles = self.query("SELECT style FROM layer_styles WHERE basin=? AND"
+                            " layer=? ORDER BY position", (basin, layer))
+
+        return [s[0] for s in styles], rows[0][0]
+
+    def remove_basin(self, basin):
+        self.execute([("DELETE FROM {} WHERE basin=?".format(t), (basin,))
+                      for t in ["files", "stores", "layers", "layer_styles"]] +
+                     [("DELETE FROM basins WHERE name=?", (basin,))])
+
+    def remove_store(self, basin, store, store_type="coverageStores"):
+        """
+        Removes a store and its layers from the record
+        """
+        layers = "SELECT name FROM layers WHERE basin=? AND store=?"
+        self.execute([("DELETE FROM layer_styles WHERE basin=? AND layer IN"
+                       " ({})".format(layers), (basin, basin, store)),
+                      ("DELETE FROM layers WHERE basin=? AND store=?",
+                       (basin, store)),
+                      ("DELETE FROM stores WHERE basin=? AND name=? AND"
+                       " store_type=?", (basin, store, store_type))])
+
+    def remove_layer(self, basin, layer):
+        self.execute([("DELETE FROM layer_styles WHERE basin=? AND layer=?",
+                       (basin, layer)),
+                      ("DELETE FROM layers WHERE basin=? AND name=?",
+                       (basin, layer))])
+
+    def remove_style(self, style):
+        """
+        Removes a style from every layer, the geoserver does the same when a
+        style is deleted
+        """
+        self.execute([("DELETE FROM layer_styles WHERE style=?", (style,)),
+                      ("UPDATE layers SET default_style=NULL WHERE"
+                       " default_style=?", (style,))])
+
+    def remove_file(self, basin, path):
+        self.execute([("DELETE FROM files WHERE basin=? AND path=?",
+                       (basin, path))])
+
+    def record_delete(self, resource):
+        """
+        Updates the record after a successful DELETE of resource.
+
+        Args:
+            resource: Relative rest resource that was deleted
+        """
+        resource = resource.split('?')[0].strip('/')
+
+        # Data file removed
+        if self.data != None and resource.startswith(self.data + '/'):
+            parts = resource[len(self.data) + 1:].split('/', 1)
+            if len(parts) == 2:
+                self.remove_file(*parts)
+            return
+
+        for ext in ['.json', '.xml']:
+            if resource.endswith(ext):
+                resource = resource[:-len(ext)]
+
+        parts = resource.split('/')
+
+        if len(parts) == 2 and parts[0] == "styles":
+            self.remove_style(parts[1])
+
+        elif parts[0] != "workspaces" or len(parts) < 2:
+            return
+
+        elif len(parts) == 2:
+            self.remove_basin(parts[1])
+
+        elif parts[2] in self.store_types:
+            store_type, layers = self.store_types[parts[2]]
+
+            # Whole store removed
+            if len(parts) == 4:
+                self.remove_store(parts[1], parts[3], store_type=store_type)
+
+            # Single layer removed, mosaic granules aren't recorded
+            elif len(parts) == 6 and parts[4] == layers:
+                self.remove_layer(parts[1], parts[5])
+
+    def replace_basin(self, basin, files, stores, layers, styles):
+        """
+        Replaces the record of a basin with a complete listing from the
+        geoserver and marks it reconciled. Layer ranges and the sources of
+        copied stores aren't on the geoserver so they're kept.
+
+        Args:
+            basin: Name of the basin
+            files: Dictionary of data file paths to (checksum, size)
+            stores: Dictionary of store types to lists of store names
+            layers: Dictionary of layer names to the name of their store
+            styles: Dictionary of layer names to (styles, default style)
+        """
+        ranges = {r[0]:(r[1], r[2]) for r in self.query(
+                        "SELECT name, range_min, range_max FROM layers"
+                        " WHERE basin=?", (basin,))}
+        sources = {r[0]:r[1] for r in self.query(
+                        "SELECT name, source FROM stores WHERE basin=?",
+                        (basin,))}
+
+        statements = [("DELETE FROM {} WHERE basin=?".format(t), (basin,))
+                      for t in ["files", "stores", "layers", "layer_styles"]]
+
+        statements.append(("INSERT OR REPLACE INTO basins VALUES (?, ?)",
+                           (basin, time.time())))
+
+        for path, (checksum, size) in files.items():
+            statements.append(("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                               (basin, path, checksum, size, time.time())))
+
+        for store_type, names in stores.items():
+            statements += [("INSERT INTO stores VALUES (?, ?, ?, ?)",
+                            (basin, s, store_type, sources.get(s)))
+                           for s in names]
+
+        for lyr, store in layers.items():
+            low, high = ranges.get(lyr, (None, None))
+            lyr_styles, default = styles.get(lyr, ([], None))
+
+            statements.append(("INSERT INTO layers VALUES (?, ?, ?, ?, ?,"
+                               " ?, ?)", (basin, lyr, store, low, high,
+                                          int(lyr in styles), default)))
+            statements += [("INSERT OR IGNORE INTO layer_styles"
+                            " VALUES (?, ?, ?, ?)", (basin, lyr, s, i))
+                           for i, s in enumerate(lyr_styles)]
+
+        self.execute(statements)
+
+    def close(self):
+        with self.lock:
+            if self.db != None:
+                self.db.close()
+                self.db = None
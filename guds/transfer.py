@@ -0,0 +1,683 @@
+import hashlib
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, RLock
+
+import requests
+
+# Locks the journal between processes, not available on Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from guds.rest import CircuitOpenError, UnavailableError
+
+
+class TransferError(Exception):
+    """
+    Raised when a file can't be moved or doesn't match after moving it
+    """
+    pass
+
+
+def file_checksum(fname, algorithm='md5', blocksize=2**20):
+    """
+    Computes the checksum of a file without reading it all into memory
+
+    Args:
+        fname: Path to a local file
+        algorithm: Any hashlib algorithm name
+        blocksize: Bytes to read at a time
+
+    Returns:
+        string: hex digest of the file
+    """
+    h = hashlib.new(algorithm)
+
+    with open(fname, 'rb') as fp:
+        for block in iter(lambda: fp.read(blocksize), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+class Journal(object):
+    """
+    Small json file recording the progress of transfers so that an
+    interrupted transfer can be picked back up on the next attempt or run.
+
+    Several guds processes can share a journal. Saving locks the file, reads
+    what the other processes have saved and only replaces the entries this
+    process changed. If the file can't be written the journal is only kept
+    in memory for this run.
+
+    Args:
+        fname: Path to the json file, created when first written
+        log: Logger to warn if the journal can't be written
+    """
+
+    def __init__(self, fname, log=None):
+        self.fname = fname
+        self.log = log
+        self.lock = RLock()
+        self.entries = self.read()
+
+        # Keys changed by this process since the last save
+        self.changed = set()
+
+    def read(self):
+        """
+        Returns the entries saved in the journal file
+        """
+        if os.path.isfile(self.fname):
+            try:
+                with open(self.fname) as fp:
+                    return json.load(fp)
+
+            except ValueError:
+                pass
+
+        return {}
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def update(self, key, **kwargs):
+        with self.lock:
+            self.entries.setdefault(key, {}).update(kwargs)
+            self.changed.add(key)
+            self.save()
+
+    def remove(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) != None:
+                self.changed.add(key)
+                self.save()
+
+    def save(self):
+        with self.lock:
+            if self.fname == None:
+                return
+
+            try:
+                self.write()
+
+            except OSError as e:
+                if self.log != None:
+                    self.log.warning("Unable to write the transfer journal {}"
+                                     " ({}), transfers will only resume"
+                                     " during this run".format(self.fname, e))
+                self.fname = None
+
+    def write(self):
+        path = os.path.dirname(os.path.abspath(self.fname))
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        with self.lock, open(self.fname + '.lock', 'w') as lock:
+            if fcntl != None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+
+            # Keep what other processes saved, replace only our entries
+            entries = self.read()
+
+            for key in self.changed:
+                if key in self.entries:
+                    entries[key] = self.entries[key]
+                else:
+                    entries.pop(key, None)
+
+            tmp = "{}.{}.tmp".format(self.fname, os.getpid())
+            with open(tmp, 'w') as fp:
+                json.dump(entries, fp, indent=2)
+
+            os.replace(tmp, self.fname)
+
+            self.entries = entries
+            self.changed = set()
+
+
+class FileReader(object):
+    """
+    File like object that reads from an offset to the end of a file and
+    reports progress. Having a length lets requests send a Content-Length
+    instead of chunking the body.
+
+    Args:
+        fname: Path to a local file
+        offset: Byte to start reading from
+        callback: Called with the total bytes read so far
+    """
+
+    def __init__(self, fname, offset=0, callback=None):
+        self.fp = open(fname, 'rb')
+        self.fp.seek(offset)
+
+        self.offset = offset
+        self.length = os.path.getsize(fname) - offset
+        self.sent = 0
+        self.callback = callback
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        chunk = self.fp.read(size)
+        self.sent += len(chunk)
+
+        if self.callback != None:
+            self.callback(self.offset + self.sent)
+
+        return chunk
+
+    def close(self):
+        self.fp.close()
+
+
+class Transfer(object):
+    """
+    Moves files to a url with a PUT, retrying dropped connections, resuming
+    partially sent files when the server supports Content-Range PUTs and
+    checking the size and checksum once finished. The checksum is stored
+    next to the file as <file>.md5 so later runs can compare against it.
+
+    Downloads fetch several byte ranges at once into a preallocated file and
+    pick up where they left off when interrupted.
+
+    Args:
+        session: requests.Session to use
+        journal: Journal to record progress in
+        log: Logger to report to
+        timeout: Connect and read timeouts in seconds
+        retries: Number of times to retry a failed transfer
+        backoff: Seconds to wait before the first retry, doubled each time
+        verify: True to read the file back to confirm its checksum
+    """
+
+    # Only record progress this often to keep the journal writes small
+    progress_step = 2**26
+
+    # Bytes written to disk at a time when downloading
+    buffer_size = 2**20
+
+    # Smallest byte range worth fetching on its own connection
+    min_segment = 2**23
+
+    def __init__(self, session, journal, log, timeout=(10, 300), retries=3,
+                                               backoff=2, verify=False):
+        self.session = session
+        self.journal = journal
+        self.log = log
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.verify = verify
+
+    def upload(self, url, fname, checksum=None):
+        """
+        Sends a local file to url, resuming from a prior attempt if possible
+
+        Args:
+            url: Full url of the remote resource
+            fname: Path to a local file
+            checksum: md5 of the local file if already known
+
+        Returns:
+            requests.Response: The final response from the server
+        """
+        size = os.path.getsize(fname)
+
+        if checksum == None:
+            checksum = file_checksum(fname)
+
+        # Only resume the same content we started with
+        entry = self.journal.get(url)
+        if entry == None or entry.get('checksum') != checksum:
+            self.journal.update(url, file=os.path.abspath(fname), size=size,
+                                     checksum=checksum, sent=0)
+
+        attempt = 0
+        while True:
+            try:
+                r = self.send(url, fname, size)
+
+                # Server is shedding load, try again
+                if r.status_code in [502, 503, 504]:
+                    raise TransferError("Server responded with {}"
+                                        "".format(r.status_code))
+
+                if r.status_code < 300:
+                    self.check(url, fname, size, checksum)
+
+                break
+
+            # Don't keep trying while the geoserver is known to be down
+            except CircuitOpenError:
+                raise
+
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    UnavailableError,
+                    TransferError) as e:
+
+                attempt += 1
+                if attempt > self.retries:
+                    raise TransferError("Failed to send {} after {} attempts: "
+                                        "{}".format(fname, attempt, e))
+
+                wait = self.backoff * 2 ** (attempt - 1) * random.uniform(1, 1.5)
+                self.log.warning("Transfer of {} interrupted ({}), retrying in"
+                                 " {:0.1f}s...".format(fname, e, wait))
+                time.sleep(wait)
+
+        if r.status_code < 300:
+            self.journal.remove(url)
+
+        return r
+
+    def send(self, url, fname, size):
+        """
+        Makes a single attempt at sending the file, starting from whatever the
+        server already has when resuming.
+        """
+        offset = self.remote_offset(url, size)
+        headers = {"accept": "application/octet-stream",
+                   "content-type": "application/octet-stream"}
+
+        if offset > 0:
+            self.log.info("Resuming transfer of {} at {:0.1f}/{:0.1f} MB"
+                          "".format(fname, offset / 1e6, size / 1e6))
+            headers["Content-Range"] = "bytes {}-{}/{}".format(offset, size - 1,
+                                                                size)
+        last = [offset]
+
+        def progress(sent):
+            if sent - last[0] >= self.progress_step or sent == size:
+                last[0] = sent
+                self.journal.update(url, sent=sent)
+
+        reader = FileReader(fname, offset=offset, callback=progress)
+
+        try:
+            r = self.session.put(url, headers=headers, data=reader,
+                                      timeout=self.timeout,
+                                      allow_redirects=True)
+        finally:
+            reader.close()
+
+        # Server doesn't take partial PUTs, send the whole thing next time
+        if offset > 0 and r.status_code in [400, 416, 501]:
+            self.log.warning("Server won't resume transfers, restarting {}"
+                             "".format(fname))
+            self.journal.update(url, sent=0, resumable=False)
+            raise TransferError("Resume rejected with {}".format(r.status_code))
+
+        return r
+
+    def remote_offset(self, url, size):
+        """
+        Determines where to resume a transfer from. Only resumes when the
+        journal shows this file was partially sent and the server holds fewer
+        bytes than the local file.
+
+        Returns:
+            int: byte offset to start sending from
+        """
+        entry = self.journal.get(url)
+
+        if entry == None or entry.get('sent', 0) == 0 \
+                         or entry.get('resumable') == False:
+            return 0
+
+        remote = self.remote_size(url)
+
+        if remote != None and 0 < remote < size:
+            return remote
+
+        return 0
+
+    def remote_size(self, url):
+        """
+        Returns the size in bytes of a remote resource using a HEAD request or
+        None if it is missing or doesn't report a size.
+        """
+        r = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+
+        if r.status_code != 200 or 'Content-Length' not in r.headers:
+            return None
+
+        return int(r.headers['Content-Length'])
+
+    def remote_checksum(self, url):
+        """
+        Returns the checksum stored next to a remote resource by a prior
+        transfer or None if there isn't one.
+        """
+        r = self.session.get(url + '.md5', timeout=self.timeout)
+
+        if r.status_code != 200 or not r.text.strip():
+            return None
+
+        return r.text.split()[0]
+
+    def unchanged(self, url, fname, checksum=None):
+        """
+        Checks whether the remote resource already matches the local file by
+        comparing the remote size and stored checksum.
+
+        Args:
+            url: Full url of the remote resource
+            fname: Path to a local file
+            checksum: md5 of the local file if already known
+
+        Returns:
+            bool: True if the remote file is the same as the local one
+        """
+        size = self.remote_size(url)
+
+        if size == None or size != os.path.getsize(fname):
+            return False
+
+        if checksum == None:
+            checksum = file_checksum(fname)
+
+        return self.remote_checksum(url) == checksum
+
+    def read_checksum(self, url):
+        """
+        Streams a remote resource back and returns its md5
+        """
+        h = hashlib.md5()
+        r = self.session.get(url, stream=True, timeout=self.timeout)
+        r.raise_for_status()
+
+        for chunk in r.iter_content(chunk_size=2**20):
+            h.update(chunk)
+
+        return h.hexdigest()
+
+    def check(self, url, fname, size, checksum):
+        """
+        Confirms the remote file matches the local one then stores the
+        checksum on the server alongside it.
+        """
+        remote = self.remote_size(url)
+
+        if remote == None:
+            self.log.warning("Server did not report a size for {}, unable to "
+                             "check it".format(url))
+
+        # A server ignoring Content-Range will hold only the tail of the file
+        elif remote != size:
+            self.journal.update(url, sent=0, resumable=False)
+            raise TransferError("Remote size {} doesn't match the local size {}"
+                                " for {}".format(remote, size, fname))
+
+        if self.verify:
+            remote_md5 = self.read_checksum(url)
+
+            if remote_md5 != checksum:
+                self.journal.update(url, sent=0, resumable=False)
+                raise TransferError("Remote checksum doesn't match {}"
+                                    "".format(fname))
+
+            self.log.info("Verified checksum of {}".format(url))
+
+        r = self.session.put(url + '.md5',
+                             headers={"content-type": "text/plain"},
+                             data="{}  {}".format(checksum,
+                                                  os.path.basename(fname)),
+                             timeout=self.timeout)
+
+        if r.status_code >= 300:
+            self.log.warning("Unable to store checksum for {}".format(url))
+
+    def download(self, url, fname, segments=4):
+        """
+        Fetches a remote resource into a local file. When the server accepts
+        Range requests the file is split into segments fetched in parallel
+        into a preallocated <fname>.part, otherwise it is streamed over one
+        connection. Progress is kept in the journal so an interrupted download
+        only fetches the missing bytes next time. The file is moved into place
+        once complete and checked against the remote <file>.md5 if there is
+        one.
+
+        Args:
+            url: Full url of the remote resource
+            fname: Path of the local file to write
+            segments: Max number of ranges to fetch at once
+
+        Returns:
+            requests.Response: Response to the HEAD request, the file is only
+                               written when its status is 200
+        """
+        r = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+
+        if r.status_code != 200:
+            return r
+
+        size = int(r.headers.get('Content-Length', -1))
+        ranged = r.headers.get('Accept-Ranges') == 'bytes' and size > 0
+
+        key = "download:{}".format(url)
+        part = fname + '.part'
+
+        # Only resume a partial file of the same remote content
+        entry = self.journal.get(key)
+        if entry == None or entry.get('size') != size \
+                         or entry.get('file') != os.path.abspath(part) \
+                         or not os.path.isfile(part):
+            entry = None
+
+        attempt = 0
+        while True:
+            try:
+                if ranged and (entry == None or entry['mode'] == 'ranges'):
+                    self.fetch_ranges(url, part, size, key, entry, segments)
+
+                else:
+                    self.fetch_stream(url, part, size, key, ranged, entry)
+
+                break
+
+            # Don't keep trying while the geoserver is known to be down
+            except CircuitOpenError:
+                raise
+
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    UnavailableError,
+                    TransferError) as e:
+
+                attempt += 1
+                if attempt > self.retries:
+                    raise TransferError("Failed to download {} after {} "
+                                        "attempts: {}".format(url, attempt, e))
+
+                wait = self.backoff * 2 ** (attempt - 1) * random.uniform(1, 1.5)
+                self.log.warning("Download of {} interrupted ({}), retrying in"
+                                 " {:0.1f}s...".format(fname, e, wait))
+                time.sleep(wait)
+
+                entry = self.journal.get(key)
+                if entry != None and entry.get('ranged') == False:
+                    ranged = False
+                    entry = None
+
+        remote_md5 = self.remote_checksum(url)
+
+        if remote_md5 != None and file_checksum(part) != remote_md5:
+            self.journal.remove(key)
+            os.remove(part)
+            raise TransferError("Checksum of {} doesn't match the remote file"
+                                "".format(fname))
+
+        os.replace(part, fname)
+        self.journal.remove(key)
+
+        return r
+
+    def fetch_ranges(self, url, part, size, key, entry, segments):
+        """
+        Fetches the missing bytes of each segment of a file in parallel,
+        writing them into place in a preallocated file.
+        """
+        if entry == None:
+            count = max(1, min(segments, size // self.min_segment))
+            step = -(-size // count)
+            ranges = [[start, min(start + step, size) - 1, 0]
+                      for start in range(0, size, step)]
+
+            with open(part, 'wb') as fp:
+                fp.truncate(size)
+
+            self.journal.update(key, file=os.path.abspath(part), size=size,
+                                     mode='ranges', ranges=ranges)
+        else:
+            ranges = entry['ranges']
+            done = sum([r[2] for r in ranges])
+            self.log.info("Resuming download of {} at {:0.1f}/{:0.1f} MB"
+                          "".format(url, done / 1e6, size / 1e6))
+
+        lock = Lock()
+
+        def fetch(segment):
+            start, end, done = segment
+
+            if start + done > end:
+                return
+
+            headers = {"Range": "bytes={}-{}".format(start + done, end)}
+            r = self.session.get(url, headers=headers, stream=True,
+                                      timeout=self.timeout)
+
+            # Server ignored the range, fall back to a single stream
+            if r.status_code == 200:
+                r.close()
+                self.journal.update(key, ranged=False)
+                raise TransferError("Server ignored the range request")
+
+            if r.status_code != 206:
+                r.close()
+                raise TransferError("Range request responded with {}"
+                                    "".format(r.status_code))
+
+            # The journal only records bytes this segment has flushed so the
+            # buffered writes of the other segments are never counted
+            written = done
+            with open(part, 'r+b', buffering=self.buffer_size) as fp:
+                fp.seek(start + done)
+
+                for chunk in r.iter_content(chunk_size=self.buffer_size):
+                    fp.write(chunk)
+                    written += len(chunk)
+
+                    if written - segment[2] >= self.progress_step:
+                        fp.flush()
+
+                        with lock:
+                            segment[2] = written
+                            self.journal.update(key, ranges=ranges)
+
+            with lock:
+                segment[2] = written
+                self.journal.update(key, ranges=ranges)
+
+            if start + segment[2] <= end:
+                raise TransferError("Connection closed {} bytes short"
+                                    "".format(end - start - segment[2] + 1))
+
+        with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+            for f in [pool.submit(fetch, seg) for seg in ranges]:
+                f.result()
+
+    def fetch_stream(self, url, part, size, key, ranged, entry):
+        """
+        Streams a file over a single connection, appending to a partial file
+        when the server accepts Range requests.
+        """
+        offset = 0
+        headers = {}
+
+        if ranged and entry != None and entry['mode'] == 'stream':
+            offset = os.path.getsize(part)
+
+        if offset > 0:
+            self.log.info("Resuming download of {} at {:0.1f}/{:0.1f} MB"
+                          "".format(url, offset / 1e6, size / 1e6))
+            headers["Range"] = "bytes={}-".format(offset)
+
+        r = self.session.get(url, headers=headers, stream=True,
+                                  timeout=self.timeout)
+
+        if r.status_code not in [200, 206]:
+            r.close()
+            raise TransferError("Download responded with {}"
+                                "".format(r.status_code))
+
+        # Whole file was sent back, start over
+        if r.status_code == 200:
+            offset = 0
+
+        self.journal.update(key, file=os.path.abspath(part), size=size,
+                                 mode='stream')
+
+        with open(part, 'ab' if offset else 'wb',
+                  buffering=self.buffer_size) as fp:
+            for chunk in r.iter_content(chunk_size=self.buffer_size):
+                fp.write(chunk)
+
+        written = os.path.getsize(part)
+        if size > 0 and written != size:
+            raise TransferError("Downloaded {} of {} bytes".format(written,
+                                                                   size))
+
+    def stream(self, url, fname, params=None, types=None):
+        """
+        Streams the response to a GET into a file with large buffered writes,
+        for content made on request that can't be fetched in ranges. The file
+        is only moved into place once complete.
+
+        Args:
+            url: Full url to request
+            fname: Path of the local file to write
+            params: Dictionary of query parameters
+            types: Content types expected, anything else is left unread in
+                   the response, e.g. an error document sent with a 200
+
+        Returns:
+            requests.Response: The response, the file is only written when its
+                               status is 200 and its type is expected
+        """
+        r = self.session.get(url, params=params, stream=True,
+                                  timeout=self.timeout)
+
+        if r.status_code != 200:
+            return r
+
+        ctype = r.headers.get('Content-Type', '')
+        if types != None and not any([ctype.startswith(t) for t in types]):
+            return r
+
+        part = fname + '.part'
+
+        try:
+            with open(part, 'wb', buffering=self.buffer_size) as fp:
+                for chunk in r.iter_content(chunk_size=self.buffer_size):
+                    fp.write(chunk)
+
+        except requests.exceptions.RequestException as e:
+            os.remove(part)
+            raise TransferError("Failed to download {}: {}".format(url, e))
+
+        os.replace(part, fname)
+
+        return r
@@ -5,23 +5,56 @@ import requests
 from urllib.parse import urljoin, urlparse
 from shutil import copyfile, rmtree
 import os
-from netCDF4 import Dataset, num2date
+import glob
+import io
 import subprocess as sp
 import logging
-import coloredlogs
-import certifi
-from spatialnc.proj import add_proj
-from spatialnc.utilities import copy_nc, mask_nc
+import re
 from datetime import datetime as dt
-import numpy as np
+from datetime import timedelta
 from guds import __version__
+from guds.catalog import Catalog
+from guds.profiling import Profiler, timed
+from guds.rest import (CircuitBreaker, GeoserverError, GeoserverSession,
+                       status_error)
+from guds.state import State
+from guds.transfer import Journal, Transfer, TransferError, file_checksum
 import time
-import pandas as pd
 from pprint import pformat
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZipFile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import RLock
+
+# The scientific stack (netCDF4, numpy, pandas, spatialnc) and guds.utilities
+# which depends on it are imported in the methods that use them so the CLI
+# starts quickly for commands like --write_json, --download and --styles.
+
+# Output profiles for the netcdfs sent to the geoserver. Chunks are tiles of
+# one time step by tile x tile cells to suit how the geoserver reads them.
+# Digits are the decimal places kept by quantizing each modeled variable.
+nc_profiles = {"default": None,
+               "compressed": {"zlib":True, "complevel":4, "shuffle":True,
+                              "tile":256, "digits":{}},
+               "quantized": {"zlib":True, "complevel":4, "shuffle":True,
+                             "tile":256,
+                             "digits":{"thickness":3,
+                                       "specific_mass":1,
+                                       "snow_density":1,
+                                       "cold_content":0}}}
+
+# netCDF4 and HDF5 aren't thread safe, netcdfs are only read or written while
+# holding this lock so the next file of a batch can be extracted while the
+# current one is published.
+nc_lock = RLock()
 
 class AWSM_Geoserver(object):
-    def __init__(self, fname, log=None, debug=False, bypass=False, cleanup=True):
+    def __init__(self, fname, log=None, debug=False, bypass=False, cleanup=True,
+                              pool_size=10, jobs=1, catalog_ttl=None,
+                              verify=False, force=False, memory=256,
+                              percentiles=None, nc_profile='default',
+                              publish_format='netcdf', tmp='tmp',
+                              journal=None, segments=4, timeout=(10, 300),
+                              retries=3, state=None):
 
         # Setup external logging if need be
         if log==None:
@@ -38,7 +71,11 @@ class AWSM_Geoserver(object):
 
         self.cleanup = cleanup
 
+        # Force will always copy data even if the geoserver has it already
+        self.force = force
+
         # Assign some colors and formats
+        import coloredlogs
         coloredlogs.install(fmt='%(levelname)-5s %(message)s', level=level,
                                                                logger=self.log)
         self.log.info("\n================================================\n"
@@ -86,20 +123,115 @@ class AWSM_Geoserver(object):
         # Auto assign layers to colormaps
         self.colormaps_keys = ["depth", "density","swe", "dem", "cold_content",
                             "veg","height", "mask", "basin", "subbasin"]
+
+        # Files that make up a shapefile
+        self.shapefile_exts = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+
+        # WCS output formats and the extension of the file written
+        self.wcs_formats = {"geotiff":("image/tiff", "tif"),
+                            "netcdf":("application/x-netcdf", "nc")}
         # temporary directory
-        self.tmp = 'tmp'
+        self.tmp = tmp
 
         # Make a temporary folder for files
         if not os.path.isdir(self.tmp):
-            os.mkdir(self.tmp)
+            os.makedirs(self.tmp)
 
-        # A location to store image ranges
+        # A location to store image ranges and statistics
         self.ranges = {}
+        self.stats = {}
+
+        # Percentiles to estimate for each layer
+        self.percentiles = percentiles
+
+        # Compression and chunking used for netcdfs sent to the geoserver
+        self.nc_profile = nc_profile
+
+        # Format modeled data is published in, netcdf or cog
+        self.publish_format = publish_format
+
+        # Max bytes of netcdf data to hold in memory at once
+        self.memory_budget = memory * 1024**2
+
+        # Number of workers used for concurrent geoserver requests
+        self.jobs = max(1, jobs)
+
+        # Max number of byte ranges fetched at once per download
+        self.segments = max(1, segments)
+
+        # Timing of each phase and request for profiling
+        self.profiler = Profiler()
+
+        # Connect and read timeouts and retries of every geoserver request
+        self.timeout = timeout
+        self.retries = retries
+
+        # Single keep-alive session shared by all the REST wrappers
+        self.session = self.create_session(pool_size=max(pool_size,
+                                                    self.jobs * self.segments))
+
+        # Resumable file transfers, progress is kept between runs
+        if journal == None:
+            journal = os.path.join(os.path.expanduser('~'), '.guds',
+                                   'transfers.json')
+
+        self.transfer = Transfer(self.session, Journal(journal, log=self.log),
+                                               self.log,
+                                               timeout=timeout,
+                                               retries=retries,
+                                               verify=verify)
+
+        # Index of what is on the geoserver for quick existence checks
+        self.catalog = Catalog(self.get, ttl=catalog_ttl, log=self.log,
+                                         keywords=self.colormaps_keys)
+
+        # Local record of what has been published, opened on first use
+        if state == None:
+            host = urlparse(self.url).netloc.replace(':', '_')
+            state = os.path.join(os.path.expanduser('~'), '.guds',
+                                 'state_{}.db'.format(host))
+
+        self.state = State(state, data=self.data, log=self.log)
 
         # Some basin info
         self.log.info("URL:{}".format(self.url))
         self.log.debug("Base URL: {}".format(self.base_url))
 
+    def create_session(self, pool_size=10):
+        """
+        Creates a requests session with a connection pool so that every call
+        to the geoserver reuses the same TCP/TLS connections instead of opening
+        a new one per request. Credentials are attached once here. Every
+        request gets a timeout, requests that fail because the geoserver is
+        busy are retried and a circuit breaker stops sending them when it is
+        down.
+
+        Args:
+            pool_size: Max number of connections kept alive to the geoserver
+
+        Returns:
+            session: requests.Session used by all the request wrappers
+        """
+        session = GeoserverSession(self.log, timeout=self.timeout,
+                                             retries=self.retries,
+                                             breaker=CircuitBreaker())
+        session.auth = self.credential
+        session.verify = True
+        session.headers.update({'Connection': 'keep-alive'})
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        # Record every request for the profile report
+        session.hooks['response'].append(self.profiler.record_response)
+
+        self.log.debug("Created session with a pool size of {}"
+                       "".format(pool_size))
+
+        return session
+
     def post(self, resource, payload):
         """
         Wrapper for post request.
@@ -115,18 +247,16 @@ class AWSM_Geoserver(object):
         headers = {'content-type' : 'application/json'}
         request_url = urljoin(self.url, resource)
         self.log.debug("POST request to {} with {}".format(request_url, payload))
-        r = requests.post(
+        r = self.session.post(
             request_url,
             headers=headers,
-            json=payload,
-            verify=True,
-            auth=self.credential
+            json=payload
         )
 
-        result = r.raise_for_status()
-
         self.handle_status(resource,r.status_code)
 
+        result = r.raise_for_status()
+
         self.log.debug("POST request returns {}:".format(result))
         return result
 
@@ -145,27 +275,57 @@ class AWSM_Geoserver(object):
         headers = {'content-type' : 'application/json'}
         request_url = urljoin(self.url, resource)
         self.log.debug("POST request to {}".format(request_url))
-        r = requests.post(
+        r = self.session.post(
             request_url,
             headers=headers,
-            data=json.dumps(payload),
-            verify=True,
-            auth=self.credential
+            data=json.dumps(payload)
         )
 
-        result = r.raise_for_status()
-
         self.handle_status(resource,r.status_code)
 
+        result = r.raise_for_status()
+        self.catalog.record_make(resource, payload)
+
         self.log.debug("POST/MAKE request returns {}:".format(result))
         return result
 
-    def delete(self, resource, **kwargs):
+    def external(self, resource, path, method="PUT", **kwargs):
+        """
+        Wrapper for the external uploads, e.g. external.imagemosaic, which
+        point the geoserver at a file or folder it already has.
+
+        Args:
+            resource: Relative location from the http root
+            path: Path to the file or folder as the geoserver sees it
+            method: PUT to create a store, POST to add to one
+            kwargs: Any pass through items that the request will take
+
+        Returns:
+            string: request status
+        """
+        headers = {'content-type':'text/plain'}
+        request_url = urljoin(self.url, resource)
+        self.log.debug("{} request to {} with {}".format(method, request_url,
+                                                         path))
+        r = self.session.request(
+            method,
+            request_url,
+            headers=headers,
+            data="file:{}".format(path),
+            params=kwargs
+        )
+
+        self.handle_status(resource, r.status_code)
+
+        return r.raise_for_status()
+
+    def delete(self, resource, missing_ok=False, **kwargs):
         """
         Wrapper for delete request.
 
         Args:
             resource: Relative location from the http root
+            missing_ok: Only log a warning if the resource doesn't exist
             kwargs: Any pass through items that the request will take
 
         Returns:
@@ -176,24 +336,41 @@ class AWSM_Geoserver(object):
         request_url = urljoin(self.url, resource)
         self.log.debug("DELETE request to {}".format(request_url))
 
-        r = requests.delete(
+        r = self.session.delete(
             request_url,
             headers=headers,
-            verify=True,
-            auth=self.credential,
             params=kwargs
         )
 
+        # Already gone, e.g. removed outside of GUDS after it was recorded
+        if missing_ok and r.status_code == 404:
+            self.log.warning("{} was already removed from the geoserver."
+                             "".format(resource))
+            self.catalog.record_delete(resource)
+            self.state.record_delete(resource)
+            return None
+
         self.handle_status(resource, r.status_code)
 
         self.log.debug("Response from DELETE: {}".format(r))
 
-        return r.raise_for_status()
+        result = r.raise_for_status()
+        self.catalog.record_delete(resource)
+        self.state.record_delete(resource)
+
+        return result
 
-    def move(self, resource, fname, data_type="style", stream=False):
+    def move(self, resource, fname, data_type="style", stream=False,
+                                    params=None):
         """
         Wrapper for the put function in the request library, this is written
         to move files from loca to the geoserver
+
+        Args:
+            resource: Relative location from the http root
+            fname: Path to a local file or a file like object to send
+            data_type: style, shapefile or anything else for binary data
+            params: Dictionary of query parameters
         """
         if data_type =="style":
             headers = {'accept':'application/vnd.ogc.sld+xml',
@@ -212,15 +389,24 @@ class AWSM_Geoserver(object):
 
         self.log.debug("PUT/MOVE request to {}".format(request_url))
 
-        with open(fname, mode) as fp:
-            r = requests.put(
+        if hasattr(fname, 'read'):
+            r = self.session.put(
                 request_url,
                 headers=headers,
-                data=fp,
-                auth=self.credential,
+                data=fname,
+                params=params,
                 allow_redirects=True)
 
-            fp.close()
+        else:
+            with open(fname, mode) as fp:
+                r = self.session.put(
+                    request_url,
+                    headers=headers,
+                    data=fp,
+                    params=params,
+                    allow_redirects=True)
+
+                fp.close()
 
         self.handle_status(resource, r.status_code)
 
@@ -230,22 +416,15 @@ class AWSM_Geoserver(object):
 
     def handle_status(self, resource, code):
         """
-        Handles logging code
+        Handles logging code, raises a GeoserverError for any failed request,
+        e.g. NotFoundError on a 404 or ServerError when a 5xx persisted
+        through the retries.
         """
         msg = "Resource {}".format(resource)
         self.log.debug("Status Code Recieved: {}".format(code))
 
-        if code == 404:
-            self.log.error(msg + " was not found on geoserver.".format(resource))
-            sys.exit()
-
-        elif code == 403:
-            self.log.error(msg + " is forbidden to access.".format(resource))
-            sys.exit()
-
-        elif code == 401:
-            self.log.error(msg + " requires credentials with more access.".format(resource))
-            sys.exit()
+        if code >= 400:
+            raise status_error(resource, code)
 
         elif code == 200:
             self.log.debug(msg + " was found successfully!")
@@ -259,7 +438,7 @@ class AWSM_Geoserver(object):
 
     def get(self, resource, headers = {'Accept':'application/json'}, skip_json=False):
         """
-        Wrapper for requests.get function.
+        Wrapper for the session get function.
         Retrieves info from the resource and returns the dictionary from the
         json
 
@@ -273,11 +452,9 @@ class AWSM_Geoserver(object):
         request_url = urljoin(self.url, resource)
         self.log.debug("GET request to {}".format(request_url))
 
-        r = requests.get(
+        r = self.session.get(
             request_url,
-            verify=True,
-            headers=headers,
-            auth=self.credential
+            headers=headers
         )
 
         if not skip_json:
@@ -292,7 +469,7 @@ class AWSM_Geoserver(object):
 
     def put(self, resource, payload, headers = {'Accept':'application/json', "Content-Type":"application/json"}):
         """
-        Wrapper for requests.put function.
+        Wrapper for the session put function.
         puts info into the resource and returns the dictionary from the
         json
 
@@ -306,26 +483,26 @@ class AWSM_Geoserver(object):
         request_url = urljoin(self.url, resource)
         self.log.debug("PUT request to {}".format(request_url))
 
-        r = requests.put(
+        r = self.session.put(
             request_url,
             headers=headers,
             json=payload,
-            verify=True,
-            auth=self.credential,
             allow_redirects=True
         )
 
-        result = r.raise_for_status()
-
         self.handle_status(resource,r.status_code)
 
+        result = r.raise_for_status()
+
         self.log.debug("PUT request returns {}:".format(result))
         return result
 
+    @timed('download')
     def grab(self, resource, fname):
         """
-        Wrapper for requests.get function.
-        Retrieves data from the resource and writes a file
+        Wrapper for the session get function.
+        Retrieves data from the resource and writes a file, fetching byte
+        ranges in parallel and resuming a prior partial download if possible.
 
         Args:
             resource: Relative location from the http root
@@ -335,28 +512,12 @@ class AWSM_Geoserver(object):
         request_url = urljoin(self.url, resource)
 
         self.log.debug("GET/GRAB request to {}".format(request_url))
+        self.log.info("Writing data to {} ...".format(fname))
 
-        r = requests.get(
-            request_url,
-            stream=True,
-            verify=True,
-            auth=self.credential,
-            allow_redirects=True
-        )
-# /geoserver/rest/resource/data/basins/kings/masked_snow_20180418.nc
-#
-# /geoserver/rest/resource/data/basins/kings/masked_snow_20190418.nc
-
+        r = self.transfer.download(request_url, fname, segments=self.segments)
 
         self.handle_status(resource,r.status_code)
 
-        self.log.info("Writing data to {} ...".format(fname))
-        with open(fname,"wb") as fp:
-            for chunk in r.iter_content(chunk_size=1024):
-                 # writing one chunk at a time to pdf file
-                 if chunk:
-                     fp.write(chunk)
-
         self.log.info("File Downloaded to {}".format(fname))
 
     def get_basins(self):
@@ -374,18 +535,46 @@ class AWSM_Geoserver(object):
 
         return basins
 
+    def get_data_files(self, basin, folder=None):
+        """
+        Lists the data files the geoserver holds for a basin using the
+        resource API, one request for the whole folder
+
+        Args:
+            basin: Name of the basin/workspace
+            folder: Sub folder of the basin to list
+
+        Returns:
+            list: Names of the files in the basin's data folder
+        """
+        resource = "{}/{}".format(self.data, basin)
+        if folder != None:
+            resource = "{}/{}".format(resource, folder)
+        r = self.get(resource, skip_json=True)
+
+        # No data has been uploaded for this basin
+        if r.status_code == 404:
+            return []
+
+        self.handle_status(resource, r.status_code)
+        children = r.json()["ResourceDirectory"].get("children") or {}
+        children = children.get("child", [])
+
+        # A single child comes back as a dictionary
+        if type(children) == dict:
+            children = [children]
+
+        return [c["name"] for c in children]
+
     def get_coverages(self, basin):
         """
         Returns a list of names currently on the geoserver for a given basin
         """
-        coverageStores = []
-        rjson = self.get("workspaces/{}/coveragestores".format(basin))
+        stores = self.catalog.get_stores(basin)
+        coverageStores = list(stores.keys()) if stores else []
 
         # If there is a list
-        if rjson["coverageStores"]:
-            for cs in rjson["coverageStores"]["coverageStore"]:
-                coverageStores.append(cs["name"])
-        else:
+        if not coverageStores:
             self.log.warn("No coverages found for the {}".format(basin))
 
         return coverageStores
@@ -411,6 +600,7 @@ class AWSM_Geoserver(object):
         """
         This assumes a snow.nc is always next to an em.nc file. Or vice versa.
         It then extracts and joins the variables that are being requested.
+        Sets the date and ranges used for naming and describing the layers.
 
         Args:
             fname: String path to a local file.
@@ -421,6 +611,61 @@ class AWSM_Geoserver(object):
         Returns:
             fname: New name of file where data was extracted.
         """
+        fname, date, stats = self.extract(fname, upload_type=upload_type,
+                                                 espg=espg,
+                                                 mask=mask)
+        if date != None:
+            self.date = date
+
+        self.set_stats(stats)
+
+        return fname
+
+    def set_stats(self, stats, reset=False):
+        """
+        Stores the statistics of the extracted layers and the ranges used for
+        the layers on the geoserver.
+
+        Args:
+            stats: Dictionary of layer names to RangeStats
+            reset: Drop stats from previously extracted files
+        """
+        if reset:
+            self.stats = {}
+            self.ranges = {}
+
+        for name, s in stats.items():
+            self.stats[name] = s
+            self.ranges[name] = s.get_range()
+            self.log.debug("{} statistics: {}".format(name, s.summary()))
+
+    @timed('extract')
+    def extract(self, fname, upload_type='modeled', espg=None, mask=None):
+        """
+        Does the work of extract_data without changing the state of the class
+        so that it can run in the background while another file is uploaded.
+
+        Args:
+            fname: String path to a local file.
+            upload_type: specifies whether to name a file differently
+            espg: Projection code to use if projection information not found if
+                  none, user will be prompted
+
+        Returns:
+            tuple: New name of the extracted file, the date of the data and a
+                   dictionary of the RangeStats of each variable inside the
+                   mask
+        """
+        from netCDF4 import Dataset, num2date
+        from spatialnc.proj import add_proj
+        from guds.utilities import (RangeStats, copy_dataset, copy_variable,
+                                    write_profile)
+
+        date = None
+        stats = {}
+
+        # Statistics are only taken inside the mask to match the final file
+        mask_data, mask_dims = self.read_mask(mask)
 
         # Check for netcdfs
         if fname.split('.')[-1] == 'nc':
@@ -458,17 +703,24 @@ class AWSM_Geoserver(object):
                 time = snow_ds.variables['time']
                 dates = num2date(time[:], units=time.units,
                                           calendar=time.calendar)
-                self.date = dates[0].isoformat().split('T')[0]
+                date = dates[0].isoformat().split('T')[0]
 
-                cleaned_date = "".join([c for c in self.date if c not in ':-'])
+                cleaned_date = "".join([c for c in date if c not in ':-'])
                 bname = bname.split(".")[0] + "_{}.nc".format(cleaned_date)
                 fname = bname
 
+                # Only the masked copy is made and sent
+                if mask != None:
+                    self.log.info("Masking netcdf using {}".format(mask))
+                    fname = "masked_{}".format(fname)
+
                 # Create a copy and join data
                 keep_vars = ['x','y','time','projection']
 
                 exclude_vars = [v for v in snow_ds.variables.keys() if v not in keep_vars]
-                new_ds = copy_nc(snow_ds, os.path.join(self.tmp,fname),exclude = exclude_vars)
+                new_ds, _ = copy_dataset(snow_ds, os.path.join(self.tmp,fname),
+                                         self.memory_budget,
+                                         exclude=exclude_vars)
 
                 self.log.info("Joining datasets and copy over variables: {}"
                               "".format( ", ".join(keep_vars)))
@@ -484,44 +736,47 @@ class AWSM_Geoserver(object):
 
                     new_ds.createVariable(var, variable.datatype,
                                                 variable.dimensions)
-                    new_ds.variables[var][:] = variable[:]
+
+                    # Copy and mask in slabs, gathering the stats along the
+                    # way
+                    stats[var] = copy_variable(variable, new_ds.variables[var],
+                                        self.memory_budget,
+                                        stats=RangeStats(self.percentiles),
+                                        mask=mask_data,
+                                        mask_dims=mask_dims,
+                                        apply_mask=True)
                 snow_ds.close()
                 em_ds.close()
 
-                mask_exlcude = []
-
             elif upload_type=='topo':
-                self.date = dt.today().isoformat().split('T')[0]
+                date = dt.today().isoformat().split('T')[0]
                 mask = fname
-                bname = bname.split(".")[0] + "_{}.nc".format(self.date)
-                fname = bname
-                mask_exlcude = ['mask']
+                mask_data, mask_dims = self.read_mask(mask)
+                ds = Dataset(fname)
+                bname = bname.split(".")[0] + "_{}.nc".format(date)
+                fname = "masked_{}".format(bname)
                 keep_vars = ds.variables.keys()
 
                 fname = os.path.join(self.tmp, fname)
                 exclude_vars = [v for v in ds.variables.keys() \
                                 if v not in keep_vars]
 
-                # Create a copy
-                self.log.info("Copying netcdf...")
-                new_ds = copy_nc(ds, fname, exclude = exclude_vars)
+                # Create a masked copy, the stats are taken inside the mask
+                self.log.info("Copying and masking netcdf...")
+                new_ds, layer_stats = copy_dataset(ds, fname,
+                                                   self.memory_budget,
+                                                   exclude=exclude_vars,
+                                                   mask=mask_data,
+                                                   mask_dims=mask_dims,
+                                                   mask_exclude=['mask'],
+                                                   percentiles=self.percentiles)
+
+                stats = {lyr:s for lyr, s in layer_stats.items()
+                         if lyr not in ['x','y','time','projection']}
                 ds.close()
 
-            # Calculate mins and maxes
-            for lyr in [l for l in keep_vars if l not in ['x','y','time','projection']]:
-                self.ranges[lyr] = [np.nanmin(new_ds.variables[lyr][:]),
-                                    np.nanmax(new_ds.variables[lyr][:])]
             fname = new_ds.filepath()
 
-            # Optional Masking
-            if mask != None:
-                new_ds.close()
-
-                self.log.info("Masking netcdf using {}".format(mask))
-                new_ds = mask_nc(fname, mask, exclude=mask_exlcude,
-                                              output=self.tmp)
-                fname = new_ds.filepath()
-
             # Check for missing projection
             if 'projection' not in new_ds.variables:
                 self.log.info("Netcdf is missing projection information...")
@@ -532,37 +787,96 @@ class AWSM_Geoserver(object):
 
                 self.log.info("Adding projection information using ESPG code "
                               "{}...".format(espg))
-                new_ds = add_proj(new_ds, espg)
+                with self.profiler.phase('projection'):
+                    new_ds = add_proj(new_ds, espg)
 
             # Clean up
             fname = new_ds.filepath()
             new_ds.close()
 
-        return fname
+            # Shrink what gets sent to the geoserver
+            if nc_profiles[self.nc_profile] != None:
+                self.log.info("Writing netcdf using the {} profile..."
+                              "".format(self.nc_profile))
+                with self.profiler.phase('compression'):
+                    before, after = write_profile(fname,
+                                                  nc_profiles[self.nc_profile],
+                                                  self.memory_budget)
+
+                self.log.info("Compressed {} from {:0.1f} MB to {:0.1f} MB, a "
+                              "ratio of {:0.1f}x".format(os.path.basename(fname),
+                                                        before / 1024**2,
+                                                        after / 1024**2,
+                                                        before / after))
+
+        return fname, date, stats
 
-    def copy_data(self, fname, basin):
+    def read_mask(self, mask):
+        """
+        Reads the mask variable from a netcdf
+
+        Args:
+            mask: Path to a netcdf containing a variable named mask or None
+
+        Returns:
+            tuple: mask array and its dimension names, both None without a mask
+        """
+        if mask == None:
+            return None, None
+
+        import numpy as np
+        from netCDF4 import Dataset
+
+        with Dataset(mask) as ds:
+            variable = ds.variables['mask']
+            return np.ma.filled(variable[:], 0), variable.dimensions
+
+    @timed('copy')
+    def copy_data(self, fname, basin, folder=None):
         """
         Data for the geoserver has to be in the host location for this. We
 
-        Copies data from users location to geoserver/data/<basin>/
+        Copies data from users location to geoserver/data/<basin>/. Interrupted
+        copies are retried and resumed, and the result is checked against the
+        local file's size and checksum. If the geoserver already has a file
+        with the same size and checksum the copy is skipped.
 
         Args:
             fname: String path to a local file.
             basin: String name of the targeted basin/workspace to put the file
                    in
+            folder: Sub folder of the basin to put the file in
 
         Returns:
             final_fname: The remote path to the file we copied
         """
 
         bname = os.path.basename(fname)
+        if folder != None:
+            bname = "{}/{}".format(folder, bname)
+
         resource = "{}/{}/{}".format(self.data, basin, bname)
 
-        self.log.info("Copying local data to remote, this may take a couple "
-                      "minutes...")
+        url = urljoin(self.url, resource)
+        checksum = file_checksum(fname)
+        size = os.path.getsize(fname)
+
+        if not self.force and self.transfer.unchanged(url, fname,
+                                                      checksum=checksum):
+            self.log.info("{} is unchanged on the geoserver, skipping copy."
+                          "".format(resource))
+            self.state.add_file(basin, bname, checksum, size)
+
+        else:
+            self.log.info("Copying local data to remote, this may take a "
+                          "couple minutes...")
+
+            r = self.transfer.upload(url, fname, checksum=checksum)
+            self.handle_status(resource, r.status_code)
+            r.raise_for_status()
+            self.state.add_file(basin, bname, checksum, size)
 
-        self.move(resource, fname, data_type="modeled", stream=True)
-        self.log.info("Data sent to: {}".format(resource))
+            self.log.info("Data sent to: {}".format(resource))
 
         # Geoserver paths don't see the resource folder.
         final_fname = "{}/{}/{}".format(os.path.basename(self.data), basin, bname)
@@ -574,7 +888,8 @@ class AWSM_Geoserver(object):
         """
         Checks the geoserver if the object exist already by name. If basin
         store and layer are provided it will check all three and only return
-        true if all 3 exist.
+        true if all 3 exist. Answers come from the catalog index which only
+        lists each part of the geoserver once.
 
         Args:
             basin: String name of the targeted, this script assumes the basin
@@ -592,94 +907,39 @@ class AWSM_Geoserver(object):
         layer_exists = None
         dstore_exists = None
 
-        # We always will check for the basins existence
-        ws_exists = False
-
         # Does the workspace > coveragetore/datastore exist
         if store != None:
-            store_exists = False
             if dstore != None:
                 raise ValueError(" Cannot check for coverage and data stores at"
                                 " the same time")
 
-        # Check for data stores
-        elif dstore != None:
-            dstore_exists = False
-
-        # Does the workspace > coverage/datastore > layer exist
-        if layer != None:
-            layer_exists = False
-
-        rjson = self.get('workspaces')
-
-        # Are there any workspaces?
-        if rjson['workspaces']:
-            ws_info = rjson['workspaces']
-
-            # Check if the basin exists as a workspace
-            for w in ws_info['workspace']:
-                if basin.lower() == w['name']:
-                    ws_exists = True
-                    break
+        # We always will check for the basins existence
+        ws_exists = self.catalog.has_workspace(basin.lower())
 
+        if ws_exists:
             # coverageStore existence requested
             if store != None:
-                # Grab info about this existing workspace
-                ws_dict = self.get(w['href'])
-
-                # Grab info on any coverage stores
-                cs_dict = self.get(ws_dict['workspace']['coverageStores'])
-
-                # Check if there are any coverage stores
-                if cs_dict['coverageStores']:
-                    cs_info = cs_dict['coverageStores']
-
-                    # Check for matching name in the coverages
-                    for cs in cs_info['coverageStore']:
-                        if store == cs['name']:
-                            store_exists = True
-                            break
+                store_exists = self.catalog.has_store(basin, store)
 
             # Check if there are any datastores
             elif dstore != None:
-                # Grab info about this existing workspace
-                ws_dict = self.get(w['href'])
-                ds_dict = self.get(ws_dict['workspace']['dataStores'])
-
-                if ds_dict["dataStores"]:
-                    ds_info = ds_dict['dataStores']
-
-                    # Check for matching name in the coverages
-                    for ds in ds_info['dataStore']:
-                        if dstore == ds['name']:
-                            dstore_exists = True
-                            break
-
-
-            # layer existence requested
-            if layer != None and store_exists:
-                # Grab info about this existing store
-                store_info = self.get(cs['href'])
-                coverages = self.get(store_info['coverageStore']['coverages'])
-
-                # Check to see if there any coverages at all
-                if coverages['coverages']:
-                    for cv in coverages['coverages']['coverage']:
-                        if layer == cv['name']:
-                            layer_exists = True
+                dstore_exists = self.catalog.has_store(basin, dstore,
+                                                    store_type="dataStores")
 
             # layer existence requested
-        elif layer != None and dstore_exists:
-                # Grab info about this existing store
-                store_info = self.get(ds['href'])
-                vectors = self.get(store_info['coverageStore']['coverages'])
-
-                # Check to see if there any datastores at all
-                if vectors['coverages']:
-                    for v in vectors['coverages']['coverage']:
-                        if layer == v['name']:
-                            layer_exists = True
+            if layer != None:
+                if store_exists:
+                    layer_exists = self.catalog.has_layer(basin, store, layer)
 
+                elif dstore_exists:
+                    layer_exists = self.catalog.has_layer(basin, dstore, layer,
+                                                    store_type="dataStores")
+                else:
+                    layer_exists = False
+        else:
+            store_exists = False if store != None else None
+            dstore_exists = False if dstore != None else None
+            layer_exists = False if layer != None else None
 
         result = [ws_exists, store_exists, dstore_exists, layer_exists]
         expected = [r for r in result if r != None]
@@ -689,11 +949,28 @@ class AWSM_Geoserver(object):
 
         if len(truth) == len(expected):
             self.log.debug("{} already exists on the geoserver.".format(msg))
+            self.add_to_state(basin, store=store, dstore=dstore, layer=layer)
             return True
         else:
             self.log.debug("{} doesn't exist on the geoserver.".format(msg))
             return False
 
+    def add_to_state(self, basin, store=None, dstore=None, layer=None):
+        """
+        Records the non-None values of the basin, store and layer as existing
+        in the local state
+        """
+        self.state.add_basin(basin)
+
+        if store != None:
+            self.state.add_store(basin, store)
+
+        elif dstore != None:
+            self.state.add_store(basin, dstore, store_type="dataStores")
+
+        if layer != None:
+            self.state.add_layer(basin, store or dstore, layer)
+
     def create_basin(self, basin):
         """
         Creates a new basin on the geoserver. Important to note that this script
@@ -717,7 +994,9 @@ class AWSM_Geoserver(object):
                                      'enabled':True}}
 
             rjson = self.make('workspaces', payload)
+            self.state.add_basin(basin)
 
+    @timed('store creation')
     def create_coveragestore(self, basin, store, filename, description=None,
                                                            store_type="NetCDF"):
         """
@@ -777,25 +1056,43 @@ class AWSM_Geoserver(object):
             self.log.info("Creating a new coverage on geoserver...")
             self.log.debug(pformat(payload))
             rjson = self.make(resource, payload)
+            self.state.add_store(basin, store)
 
     def create_latest_layers(self, basin):
         """
         Creates a 3 new layers call latest_<variable>
         for a given basin. Calculates all the layers dates and finds the most
-        recent one and makes a copy of it associated to lates_<variable>
+        recent one and makes a copy of it associated to lates_<variable>.
+        Mosaics aren't dated and already default to their latest date so they
+        are skipped.
 
         """
+        import pandas as pd
+
+        if self.publish_format == 'mosaic':
+            self.log.info("Mosaics default to their latest date, no latest"
+                          " layers are needed.")
+            return
 
         self.log.info("Determining the date for latest variables...")
+
         coverages = self.get_coverages(basin)
+
         dates = []
 
         # Get all the coverage names/ check dates avoiding latest
         for cs in coverages:
             var_nm_date = cs.split(':')[-1].lower()
-            if "latest" not in var_nm_date:
+            if "latest" not in var_nm_date \
+                                and not var_nm_date.endswith("_mosaic"):
                 sdate = "".join([s for s in var_nm_date if s.isnumeric()])
-                dates.append(pd.to_datetime(sdate))
+                if sdate:
+                    dates.append(pd.to_datetime(sdate))
+
+        if not dates:
+            self.log.warning("No dated stores found in {}, unable to create"
+                             " latest layers".format(basin))
+            return
 
         # Find the most recent modeling date
         latest_date = max(dates)
@@ -808,19 +1105,43 @@ class AWSM_Geoserver(object):
         # Grab all the coverages with the most recent date in their name
         latest_coverages = [cs for cs in coverages if latest_str in cs]
 
-        # Get the coverage stor info
-        resource = "workspaces/{}/coveragestores/{}".format(basin,
-                                                            latest_coverages[0])
-        cs_info = self.get(resource)
+        # GeoTIFF uploads have a store per variable so copy them all
+        for store in latest_coverages:
+            self.copy_latest_store(basin, store)
 
-        # Modify the info's name
-        name_o = cs_info['coverageStore']["name"]
-        name = self.get_latest_name(name_o)
+    def copy_latest_store(self, basin, store):
+        """
+        Copies a coverage store and its coverages under the latest name,
+        nothing is done if the local state records the latest store as a copy
+        of it and the geoserver's latest store still points at the same data.
+
+        Args:
+            basin: Name of the basin/workspace
+            store: Name of the dated store to copy
+        """
+        name = self.get_latest_name(store)
 
         # Remove any trailing underscores
         if name[-1] == "_":
             name = name[0:-1]
 
+        # Get the coverage stor info
+        resource = "workspaces/{}/coveragestores/{}".format(basin, store)
+        cs_info = self.get(resource)
+
+        # The state only hints at a copy, confirm it with the geoserver
+        if not self.force and self.state.get_source(basin, name) == store \
+                          and self.exists(basin, store=name):
+            latest = self.get("workspaces/{}/coveragestores/{}"
+                              "".format(basin, name))["coverageStore"]
+
+            if latest.get("url") == cs_info["coverageStore"].get("url"):
+                self.log.info("{} is already a copy of {}, skipping."
+                              "".format(name, store))
+                return
+
+        # Modify the info's name
+        name_o = cs_info['coverageStore']["name"]
         cs_info["coverageStore"]["name"] = name
 
         # Check to see if the store already exists
@@ -833,6 +1154,7 @@ class AWSM_Geoserver(object):
                       "".format(name, name_o))
         resource = "workspaces/{}/coveragestores/".format(basin)
         self.make(resource, cs_info)
+        self.state.add_store(basin, name, source=name_o)
 
         # Copy existing coverages
         resource = "workspaces/{}/coveragestores/{}/coverages".format(basin,
@@ -856,13 +1178,15 @@ class AWSM_Geoserver(object):
                 cov_info['name'] = cov_name
                 cov_info['store'] = {"name":"{}:{}".format(basin, name)}
                 self.make(resource, {"coverage":cov_info})
-                self.assign_colormaps(basin, cov_name)
+                self.state.add_layer(basin, name, cov_name)
+                self.assign_colormaps(basin, cov_name, current=([], None))
 
         else:
             self.log.error("No layers associated to store {} to copy for latest"
                            "".format(name_o))
 
-    def create_layer(self, basin, store, layer):
+    @timed('layer creation')
+    def create_layer(self, basin, store, layer, native=None):
         """
         Create a raster layer on the geoserver
 
@@ -870,6 +1194,8 @@ class AWSM_Geoserver(object):
             basin: String name of the targeted basin/workspace
             store: String name of the targeted data/coverage store
             layer: String name of the new layer to be made
+            native: Name of the coverage in the store if it isn't the layer
+                    name, e.g. the file name of a GeoTIFF
 
         """
         resource = ("workspaces/{}/coveragestores/{}/coverages.json"
@@ -902,8 +1228,11 @@ class AWSM_Geoserver(object):
         if hasattr(self,'date'):
             name = "{}{}".format(name, self.date.replace('-',''))
 
+        if native != None:
+            native_name = native
+
         payload = {"coverage":{"name":name,
-                               "nativeName":lyr_name,
+                               "nativeName":native_name,
                                "nativeCoverageName":native_name,
                                "store":{"name": "{}:{}".format(basin, store)},
                                "enabled":True,
@@ -931,92 +1260,218 @@ class AWSM_Geoserver(object):
                                                         recursive=True)
 
         response = self.make(resource, payload)
+        self.state.add_layer(basin, store, name,
+                             value_range=self.ranges.get(lyr_name))
 
-        # Assign Colormaps
-        self.assign_colormaps(basin, name)
+        # Assign Colormaps, the layer is new so it has none yet
+        self.assign_colormaps(basin, name, current=([], None))
 
-    def assign_colormaps(self, basin, name, layer_type="raster"):
+    @timed('styling')
+    def assign_colormaps(self, basin, name, layer_type="raster", current=None):
         """
-        currently utilizes a hacky version to accomplish our goal. function
-        Assigns the colormaps to default and styles available
+        Assigns the colormaps matching the layer name and its default style
+        with a single PUT of the layer. Styles already on the layer are kept
+        and nothing is sent if the layer already has them all.
 
         Args:
             basin: name of the basin
             name: name of the layer
             layer_type: raster or vector to identify how we assign defaults
+            current: Tuple of the style names and default style already on the
+                     layer, looked up when None
+
+        Returns:
+            bool: True if the layer's styles were changed
+        """
+        colormaps, default = self.get_layer_colormaps(name,
+                                                      layer_type=layer_type)
+
+        if current == None:
+            current = self.get_layer_styles(basin, name)
+
+        styles, current_default = current
+        missing = [c for c in colormaps if c not in styles]
+
+        if not missing and default in [None, current_default]:
+            self.log.debug("{}:{} already has its styles".format(basin, name))
+            return False
+
+        self.log.info("Adding styles {} to {}:{}".format(", ".join(missing),
+                                                         basin, name))
+        self.set_layer_styles(basin, name, list(styles) + missing,
+                                           default=default)
+        return True
+
+    def get_layer_colormaps(self, name, layer_type="raster"):
+        """
+        Returns the styles a layer should have based on its name
+
+        Args:
+            name: name of the layer
+            layer_type: raster or vector to identify how we assign defaults
+
+        Returns:
+            tuple: list of the style names and the default style, None if the
+                   default shouldn't be set
         """
         # All colormaps we want to assign
         colormaps = self.get_keyword_styles(name)
+        default = None
 
         # Default colormap
         if layer_type=='raster':
             colormaps.append("raster")
+            default = "raster"
 
             if "dynamic_default" in colormaps:
-                colormaps.append("dynamic_default")
-
-        # Add all the colormaps on at a time
-        styles_list = [{"name":c} for c in colormaps]
-        resource = "layers/{}:{}/styles.json".format(basin, name)
-        for c in colormaps:
-            self.log.info("Adding style {} to {}:{}".format(c, basin, name))
-            payload = {"style":{"name":c}}
-            self.post(resource, payload)
-
-        # Currently Erases all my added styles when I attempt to add default
-        # self.log.info("Default style for {}:{} set to {}".format(basin, name,
-        #                 colormaps[-1]))
-        # Set the default colormap which should always be the last one
-        # styles = self.get(resource)["styles"]
-        # default = [c for c in styles["style"] if c["name"]==colormaps[-1]][0]
-        # payload = {"layer":{"defaultStyle":default}}
-        #
-        # resource = "layers/{}:{}.json".format(basin, name)
-        # r = self.put(resource, payload)
+                default = "dynamic_default"
+
+        return colormaps, default
+
+    def get_layer_styles(self, basin, name):
+        """
+        Returns the styles assigned to a layer on the geoserver and records
+        them in the local state. The geoserver is always asked since styles
+        can be added outside of GUDS and replacing the list would drop them.
+
+        Args:
+            basin: name of the basin
+            name: name of the layer
+
+        Returns:
+            tuple: list of the style names and the name of the default style
+        """
+        layer = self.get("layers/{}:{}.json".format(basin, name))["layer"]
+
+        styles = []
+        if layer.get("styles"):
+            styles = layer["styles"]["style"]
+
+            # A single style comes back as a dictionary
+            if type(styles) == dict:
+                styles = [styles]
+
+            styles = [st["name"].split(":")[-1] for st in styles]
+
+        default = None
+        if layer.get("defaultStyle"):
+            default = layer["defaultStyle"]["name"].split(":")[-1]
+
+        self.state.set_styles(basin, name, styles, default=default)
 
+        return styles, default
+
+    def set_layer_styles(self, basin, name, styles, default=None):
+        """
+        Replaces the styles of a layer and optionally its default style with
+        one PUT
+
+        Args:
+            basin: name of the basin
+            name: name of the layer
+            styles: List of style names
+            default: Name of the default style, None leaves it unchanged
+        """
+        payload = {"layer":{"styles":{"style":[{"name":c} for c in styles]}}}
+
+        if default != None:
+            payload["layer"]["defaultStyle"] = {"name":default}
+
+        self.put("layers/{}:{}.json".format(basin, name), payload)
+        self.state.set_styles(basin, name, styles, default=default)
 
     def get_keyword_styles(self, layer_name):
         """
         Returns all the styles that has keywords matching in the layer_name
-        and in the style name for rasters only
+        and in the style name for rasters only. Styles come from the catalog
+        which indexes them by keyword once per run.
 
         Args:
             layer_name: Name of the layer being made
         """
 
-        styles = self.get('styles/')
-        avail = [k['name'] for  k in styles['styles']['style']]
-        result = []
+        avail = self.catalog.get_styles()
+        result = set()
 
         # Filter the styles
         for key in self.colormaps_keys:
-            for style in avail:
-                if key in style.lower() and key in layer_name.lower():
-                    result.append(style)
+            if key in layer_name.lower():
+                result.update(self.catalog.get_keyword_styles(key))
 
-        self.log.info("{}/{} availables styles are matching".format(len(result),
+        self.log.debug("{}/{} availables styles are matching".format(len(result),
                                                                     len(avail)))
 
         # Add in dynamic_default default if it is there
         if "dynamic_default" in avail:
-            result.append('dynamic_default')
+            result.add('dynamic_default')
 
-        return list(set(result))
+        return list(result)
 
     def create_layers_from_netcdf(self, basin, store, layers=None,):
         """
         Opens a netcdf locally and adds all layers to the geoserver that are in
         the entire image if layers = None otherwise adds only the layers listed.
+        When self.jobs > 1 the layers are created concurrently. Every layer is
+        attempted before any failures are raised.
 
         Args:
             basin: String name of the targeted basin/workspace
             store: String name of a targeted netcdf coverage store
             layers: List of layers to add, if none add all layers except x,y,
                     time, and projection
+
+        Raises:
+            GeoserverError: Naming the layers that couldn't be created
         """
+        timing = {}
+        errors = {}
+
+        if self.jobs > 1 and len(layers) > 1:
+            self.log.info("Creating {} layers using {} workers..."
+                          "".format(len(layers), self.jobs))
+
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                futures = {pool.submit(self.add_layer, basin, store, name):name
+                                                            for name in layers}
+
+                for f in as_completed(futures):
+                    name = futures[f]
+                    timing[name], errors[name] = f.result()
+        else:
+            for name in layers:
+                timing[name], errors[name] = self.add_layer(basin, store, name)
+
+        errors = {name:e for name, e in errors.items() if e != None}
 
         for name in layers:
+            self.log.info("Layer {} finished in {:0.2f}s".format(name,
+                                                                 timing[name]))
+
+        if errors:
+            raise GeoserverError("Failed to create {}/{} layers in {}: {}"
+                                 "".format(len(errors), len(layers), store,
+                                           ", ".join(sorted(errors.keys()))),
+                                 "workspaces/{}/coveragestores/{}"
+                                 "".format(basin, store))
 
+    def add_layer(self, basin, store, name):
+        """
+        Creates a single layer from a store if it doesn't already exist.
+        Catches any errors so a worker can report them without stopping the
+        other layers.
+
+        Args:
+            basin: String name of the targeted basin/workspace
+            store: String name of a targeted netcdf coverage store
+            name: Name of the netcdf variable to make a layer from
+
+        Returns:
+            tuple: seconds spent on the layer, error raised or None
+        """
+        start = time.time()
+        error = None
+
+        try:
             if self.exists(basin, store=store, layer=name):
                 self.log.info("Layer {} from store {} in the {} exists..."
                       "".format(name, store, basin))
@@ -1027,6 +1482,14 @@ class AWSM_Geoserver(object):
                                                            basin))
                 self.create_layer(basin, store, name)
 
+        # Keep failures local to this layer
+        except Exception as e:
+            self.log.error("Unable to create layer {}: {}".format(name,
+                                                                  repr(e)))
+            error = e
+
+        return time.time() - start, error
+
     def upload(self, basin, filename, upload_type='modeled', espg=None,
                                                              mask=None):
         """
@@ -1045,20 +1508,14 @@ class AWSM_Geoserver(object):
         self.log.info("Source Filename: {}".format(filename))
         self.log.info("Mask Filename: {}".format(mask))
 
-        if not os.path.isfile(filename):
-            self.log.error("Upload file doesn't exist.")
-            sys.exit()
-
-        if mask != None:
-            if not os.path.isfile(mask):
-                self.log.error("Mask file doesn't exist.")
-                sys.exit()
+        self.check_inputs(filename, mask=mask)
 
         # Ensure that this workspace exists
         if not self.exists(basin):
             self.create_basin(basin)
 
         # Handle netcdfs
+        layers = None
         if upload_type in ['topo','modeled']:
             # Reduce the size of netcdfs if possible return the new filename
             filename = self.extract_data(filename, upload_type=upload_type,
@@ -1066,20 +1523,73 @@ class AWSM_Geoserver(object):
                                                    mask=mask)
 
             # Grab the layer names
+            layers = self.get_nc_layers(filename)
+
+        self.publish(basin, filename, upload_type=upload_type, layers=layers)
+
+        # Cleanup
+        if self.cleanup:
+            self.log.info("Cleaning up files... Removing {}".format(self.tmp))
+            rmtree(self.tmp)
+
+    def check_inputs(self, filename, mask=None):
+        """
+        Exits if the file to upload or the mask doesn't exist locally
+        """
+        if not os.path.isfile(filename):
+            self.log.error("Upload file doesn't exist.")
+            sys.exit()
+
+        if mask != None:
+            if not os.path.isfile(mask):
+                self.log.error("Mask file doesn't exist.")
+                sys.exit()
+
+    def get_nc_layers(self, filename):
+        """
+        Returns the variable names in a netcdf that will become layers
+
+        Args:
+            filename: path to a local netcdf
+        """
+        from netCDF4 import Dataset
+
+        with nc_lock:
             ds = Dataset(filename)
 
             layers = []
             for name in ds.variables.keys():
                 if name not in ['time','x','y','projection']:
                     layers.append(name)
-            self.log.info("Uploading {} from netcdf...".format(", ".join(layers)))
+            ds.close()
 
-            if len(layers) == 0:
-                self.log.error("No variables found in netcdf...exiting.")
-                sys.exit()
+        self.log.info("Uploading {} from netcdf...".format(", ".join(layers)))
 
-        # Copy users data up to the remote location
-        remote_fname = self.copy_data(filename, basin)
+        if len(layers) == 0:
+            self.log.error("No variables found in netcdf...exiting.")
+            sys.exit()
+
+        return layers
+
+    def publish(self, basin, filename, upload_type='modeled', layers=None):
+        """
+        Copies a prepared local file to the geoserver and creates the stores
+        and layers for it.
+
+        Args:
+            basin: string name of the basin/workspace to upload to.
+            filename: path of the local file ready to be uploaded
+            upload_type: Determines how the data is uploaded
+            layers: Netcdf variables names to add as layers on GS
+        """
+
+        # Copy users data up to the remote location, GeoTIFFs are made and
+        # copied per variable instead
+        if upload_type == 'modeled' and self.publish_format in ['cog',
+                                                                'mosaic']:
+            remote_fname = None
+        else:
+            remote_fname = self.copy_data(filename, basin)
 
         # Check for the upload type which determines the filename, and store
         if upload_type == 'topo':
@@ -1100,11 +1610,177 @@ class AWSM_Geoserver(object):
         else:
             raise ValueError("Invalid or undeveloped upload type requested!")
 
+    def find_files(self, filenames, upload_type='modeled'):
+        """
+        Expands the files requested for uploading. Entries can be files, glob
+        patterns or directories. Directories are searched for a snow.nc when
+        uploading modeled data.
+
+        Args:
+            filenames: list of paths, patterns or directories
+            upload_type: Determines what to look for in directories
+
+        Returns:
+            list: Sorted paths of the files found
+        """
+        found = []
+
+        for f in filenames:
+            if os.path.isdir(f):
+                if upload_type == 'modeled':
+                    candidates = [os.path.join(f, 'snow.nc')]
+                else:
+                    candidates = [os.path.join(f, n) for n in os.listdir(f)]
+
+            elif glob.has_magic(f):
+                candidates = sorted(glob.glob(f))
+
+            else:
+                candidates = [f]
+
+            for c in candidates:
+                if os.path.isdir(c) and upload_type == 'modeled':
+                    c = os.path.join(c, 'snow.nc')
+
+                if not os.path.isfile(c):
+                    self.log.warning("No file found at {}, skipping...".format(c))
+
+                elif c not in found:
+                    found.append(c)
+
+        return found
+
+    def prepare(self, filename, upload_type='modeled', espg=None, mask=None):
+        """
+        Extracts a netcdf and finds its layers without changing the state of
+        the class. Used to prepare the next file while the current one uploads,
+        the date and stats are returned for the caller to set once the file is
+        published.
+
+        Returns:
+            tuple: extracted filename, date, layer stats and layer names
+        """
+        with nc_lock:
+            filename, date, stats = self.extract(filename,
+                                                 upload_type=upload_type,
+                                                 espg=espg,
+                                                 mask=mask)
+            layers = self.get_nc_layers(filename)
+
+        return filename, date, stats, layers
+
+    def remove_tmp(self, fname):
+        """
+        Removes a file written to the temporary folder once it has been sent,
+        unless cleanup is off. Files outside the temporary folder are left.
+        """
+        tmp = os.path.abspath(self.tmp) + os.sep
+
+        if self.cleanup and os.path.abspath(fname).startswith(tmp) \
+                        and os.path.isfile(fname):
+            self.log.debug("Removing {}".format(fname))
+            os.remove(fname)
+
+    def upload_batch(self, basin, filenames, upload_type='modeled', espg=None,
+                                                                    mask=None):
+        """
+        Uploads many files to the same basin. Netcdfs are pipelined so the next
+        file is extracted in the background while the current one is copied to
+        the geoserver and its layers are made. A failed file is logged and
+        the rest of the batch continues.
+
+        Args:
+            basin: string name of the basin/workspace to upload to.
+            filenames: list of paths, patterns or directories to upload
+            upload_type: Determines how the data is uploaded
+            mask: Filename of a netcdf containing a mask layer
+
+        Returns:
+            dict: filenames that failed mapped to their error
+        """
+        files = self.find_files(filenames, upload_type=upload_type)
+
+        self.log.info("Associated Basin: {}".format(basin))
+        self.log.info("Data Upload Type: {}".format(upload_type))
+        self.log.info("Batch uploading {} files".format(len(files)))
+        self.log.info("Mask Filename: {}".format(mask))
+
+        if not files:
+            self.log.error("No files found to upload.")
+            sys.exit()
+
+        self.check_inputs(files[0], mask=mask)
+
+        # Ensure that this workspace exists
+        if not self.exists(basin):
+            self.create_basin(basin)
+
+        errors = {}
+        is_netcdf = upload_type in ['topo', 'modeled']
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pending = None
+
+            if is_netcdf:
+                pending = pool.submit(self.prepare, files[0],
+                                      upload_type=upload_type, espg=espg,
+                                      mask=mask)
+
+            for i, f in enumerate(files):
+                start = time.time()
+                self.log.info("Processing {} ({}/{})...".format(f, i + 1,
+                                                                len(files)))
+                try:
+                    if is_netcdf:
+                        filename, date, stats, layers = pending.result()
+                    else:
+                        filename, layers = f, None
+
+                # Keep the pipeline full even when this file fails
+                except (Exception, SystemExit) as e:
+                    errors[f] = e
+                    filename = None
+
+                if is_netcdf and i + 1 < len(files):
+                    pending = pool.submit(self.prepare, files[i + 1],
+                                          upload_type=upload_type, espg=espg,
+                                          mask=mask)
+                if filename == None:
+                    self.log.error("Unable to extract {}: {}"
+                                   "".format(f, repr(errors[f])))
+                    continue
+
+                try:
+                    if is_netcdf:
+                        self.date = date
+                        self.set_stats(stats, reset=True)
+
+                    self.publish(basin, filename, upload_type=upload_type,
+                                                  layers=layers)
+
+                except (Exception, SystemExit) as e:
+                    self.log.error("Unable to upload {}: {}".format(f, repr(e)))
+                    errors[f] = e
+
+                # Don't let extracted files pile up over a long batch
+                self.remove_tmp(filename)
+
+                self.log.info("Finished {} in {:0.1f}s".format(f,
+                                                        time.time() - start))
+
+        self.log.info("Batch upload complete, {}/{} files uploaded."
+                      "".format(len(files) - len(errors), len(files)))
+
+        if errors:
+            self.log.error("Failed files: {}".format(", ".join(errors.keys())))
+
         # Cleanup
         if self.cleanup:
             self.log.info("Cleaning up files... Removing {}".format(self.tmp))
             rmtree(self.tmp)
 
+        return errors
+
     def submit_topo(self, filename, remote_filename, basin, layers=None):
         """
         Uploads the basins topo images which are static. These images include:
@@ -1156,80 +1832,557 @@ class AWSM_Geoserver(object):
                                        self.date,
                                        dt.today().isoformat().split('T')[0])
 
-        self.create_coveragestore(basin, store_name, remote_filename,
+        if self.publish_format == 'cog':
+            self.submit_modeled_cog(filename, basin, layers=layers)
+
+        elif self.publish_format == 'mosaic':
+            self.submit_modeled_mosaic(filename, basin, layers=layers)
+
+        else:
+            self.create_coveragestore(basin, store_name, remote_filename,
                                                      description=description)
 
-        # Create layers density, specific mass, thickness, cold_content
-        self.create_layers_from_netcdf(basin, store_name, layers=layers)
+            # Create layers density, specific mass, thickness, cold_content
+            self.create_layers_from_netcdf(basin, store_name, layers=layers)
 
-    def submit_shapefile(self, filename, basin, layer=None):
+    def submit_modeled_cog(self, filename, basin, layers=None):
         """
-        Uploads the shapefiles. If layer=None then it simply uses the filename
-        to create the layer name (replacing underscores with spaces)
+        Publishes each modeled variable as its own cloud optimized GeoTIFF
+        store which the geoserver can render tiles from much faster than a
+        netcdf. Stores are named <basin>_<netcdf name>_<variable>.
 
         Args:
-            filename: Local path to a .shp file
-            basin: string name of the workspace or basin
-            layer: Alternate layer name to use
+            filename: local path of the extracted netcdf
+            basin: Basin associated to the modeled data
+            layers: Netcdf variables names to add as layers on GS
+        """
+        from guds.utilities import write_cog
+
+        bname = os.path.basename(filename).split(".")[0]
+
+        for name in layers:
+            store_name = "{}_{}_{}".format(basin, bname, name)
+            tif = os.path.join(self.tmp, "{}_{}.tif".format(bname, name))
+
+            self.log.info("Converting {} to a cloud optimized GeoTIFF..."
+                          "".format(name))
+            with nc_lock:
+                write_cog(filename, name, tif, budget=self.memory_budget)
 
+            remote_fname = self.copy_data(tif, basin)
+
+            description = ("Cloud optimized GeoTIFF of modeled {} from the {} "
+                           "watershed produced by AWSM.\n"
+                           "Model Date: {}\n"
+                           "Date Uploaded: {}").format(name, basin, self.date,
+                                         dt.today().isoformat().split('T')[0])
+
+            self.create_coveragestore(basin, store_name, remote_fname,
+                                                    description=description,
+                                                    store_type='GeoTIFF')
+
+            self.create_layer(basin, store_name, name,
+                              native=os.path.basename(tif).split('.')[0])
+
+            self.remove_tmp(tif)
+
+    def submit_modeled_mosaic(self, filename, basin, layers=None):
         """
-        filename = os.path.abspath(filename)
-        bname = os.path.basename(filename)
-        keyword = bname.split('.')[0]
-        dstore = keyword + "_store"
+        Publishes each modeled variable as a granule of a time enabled
+        ImageMosaic store, one store per basin and variable, so the catalog
+        doesn't grow with each day uploaded. Granules are cloud optimized
+        GeoTIFFs named <variable>_<YYYYMMDD>.tif and the date is read from the
+        name. Uploading a date already in the mosaic replaces its granule.
 
-        # Get all the files associated with the shapefile
-        associate_files = os.listdir(os.path.dirname(filename))
-        associate_files = [f for f in associate_files if keyword in f]
+        Args:
+            filename: local path of the extracted netcdf
+            basin: Basin associated to the modeled data
+            layers: Netcdf variables names to add as layers on GS
+        """
+        from guds.utilities import write_cog
+
+        date = self.date.replace('-', '')
+
+        for var in layers:
+            name = self.remap.get(var, var)
+            store = self.get_mosaic_store(basin, name)
+            folder = "mosaic/{}".format(name)
+
+            tif = os.path.join(self.tmp, "{}_{}.tif".format(name, date))
+
+            self.log.info("Converting {} to a granule for the {} mosaic..."
+                          "".format(var, store))
+            with nc_lock:
+                write_cog(filename, var, tif, budget=self.memory_budget)
+
+            if self.exists(basin, store=store):
+                self.remove_granules(basin, name, date)
+                remote_fname = self.copy_data(tif, basin, folder=folder)
+
+                self.log.info("Adding {} to the {} mosaic".format(self.date,
+                                                                  store))
+                resource = "workspaces/{}/coveragestores/{}/" \
+                           "external.imagemosaic".format(basin, store)
+                self.external(resource, remote_fname, method="POST")
+
+            else:
+                self.create_mosaic(basin, name, tif)
+
+            self.remove_tmp(tif)
+
+    def get_mosaic_store(self, basin, name):
+        """
+        Returns the name of the ImageMosaic store of a variable
+        """
+        return "{}_{}_mosaic".format(basin, name)
+
+    def create_mosaic(self, basin, name, granule):
+        """
+        Creates a time enabled ImageMosaic store and its layer from a first
+        granule. The indexer and time regex properties are sent to the mosaic
+        folder with the granule, then the geoserver builds the store from the
+        folder.
+
+        Args:
+            basin: Name of the basin/workspace
+            name: Name of the variable which names the layer
+            granule: Local path to the first GeoTIFF granule
+        """
+        store = self.get_mosaic_store(basin, name)
+        folder = "mosaic/{}".format(name)
+
+        properties = {"indexer.properties":
+                        "TimeAttribute=ingestion\n"
+                        "Schema=*the_geom:Polygon,location:String,"
+                        "ingestion:java.util.Date\n"
+                        "PropertyCollectors=TimestampFileNameExtractorSPI"
+                        "[timeregex](ingestion)\n"
+                        "Name={}\n".format(name),
+                      "timeregex.properties":"regex=[0-9]{8}\n"}
+
+        for fname, content in properties.items():
+            local = os.path.join(self.tmp, fname)
+            with open(local, 'w') as fp:
+                fp.write(content)
+
+            self.copy_data(local, basin, folder=folder)
+
+        remote_fname = self.copy_data(granule, basin, folder=folder)
+        remote_dir = os.path.dirname(remote_fname)
+
+        self.log.info("Creating the {} mosaic from {}".format(store,
+                                                              remote_dir))
+        resource = "workspaces/{}/coveragestores/{}/external.imagemosaic" \
+                   "".format(basin, store)
+        self.external(resource, remote_dir, configure="all")
+
+        # The geoserver made the store and its layer
+        self.catalog.forget(basin)
+        self.state.add_store(basin, store)
+        self.state.add_layer(basin, store, name)
+
+        # Enable time so any date can be requested with TIME=
+        title = "{} {} Time Series".format(basin.title(),
+                                           name.replace("_", " ").title())
+        payload = {"coverage":{"title":title,
+                               "enabled":True,
+                               "metadata":{"entry":[{
+                                    "@key":"time",
+                                    "dimensionInfo":{
+                                        "enabled":True,
+                                        "presentation":"LIST",
+                                        "units":"ISO8601",
+                                        "defaultValue":{"strategy":"MAXIMUM"}
+                                    }}]}}}
+
+        resource = "workspaces/{}/coveragestores/{}/coverages/{}.json" \
+                   "".format(basin, store, name)
+        self.put(resource, payload)
+
+        self.assign_colormaps(basin, name, current=([], None))
+
+    def remove_granules(self, basin, name, date, purge=False):
+        """
+        Removes the granules of a date from a variable's mosaic
 
-        resource = "workspaces/{}/datastores".format(basin)
-        if self.exists(basin, dstore=dstore):
-           resource = resource + "/" + dstore
-           self.delete(resource, purge=True, recurse=True)
+        Args:
+            basin: Name of the basin/workspace
+            name: Name of the variable's layer
+            date: Date of the granules as YYYYMMDD
+            purge: True to also delete the granule files on the geoserver
+        """
+        store = self.get_mosaic_store(basin, name)
+        resource = "workspaces/{}/coveragestores/{}/coverages/{}/index/" \
+                   "granules.json".format(basin, store, name)
 
-        # Create a new store
-        payload = {"dataStore": {
-                                "name": dstore,
-                                "connectionParameters":
-                                    {"entry":
-                                        [{"@key":"url","$":"file:basins/{}/{}"
-                                                   "".format(basin, bname)}]
+        self.log.info("Removing {} from the {} mosaic".format(date, store))
+        self.delete(resource, filter="location LIKE '%{}%'".format(date),
+                              purge="all" if purge else "none")
 
-                                    }
-                                }
-                    }
+    def find_expired(self, basin, days):
+        """
+        Finds the dated modeled stores, mosaic granules and data files of a
+        basin older than a number of days. Stores come from the catalog and
+        files from listings of the basin's data and mosaic folders. Latest
+        stores and the data files they point at are never included.
 
-        resource = "workspaces/{}/datastores".format(basin)
-        self.make(resource, payload)
+        Args:
+            basin: Name of the basin/workspace
+            days: Number of days of modeled data to keep
 
-        # Upload the related files
-        self.log.info("Uploading {} files.".format(len(associate_files)))
+        Returns:
+            tuple: list of store names, list of granules as (variable, date,
+                   file name) and list of data file names
+        """
+        cutoff = dt.today().date() - timedelta(days=days)
+        pattern = re.compile(r"snow_(\d{8})")
+        granule_pattern = re.compile(r"_(\d{8})\.tif(\.md5)?$")
+
+        def older(date):
+            return dt.strptime(date, "%Y%m%d").date() < cutoff
+
+        def expired(name):
+            match = pattern.search(name)
+            if match == None or "latest" in name:
+                return False
+
+            return older(match.group(1))
+
+        all_stores = self.catalog.get_stores(basin) or {}
+        stores = [s for s in all_stores
+                  if s.startswith(basin + "_") and expired(s)]
+
+        # Data files the latest stores point at have to stay
+        keep = set()
+        for s in all_stores:
+            if s.startswith("latest_"):
+                info = self.get("workspaces/{}/coveragestores/{}"
+                                "".format(basin, s))["coverageStore"]
+                if info.get("url"):
+                    keep.add(os.path.basename(info["url"]))
+
+        files = [f for f in self.get_data_files(basin)
+                 if os.path.splitext(f)[1] in ['.nc', '.tif', '.md5']
+                 and expired(f) and f not in keep
+                 and os.path.splitext(f)[0] not in keep]
+
+        # Granules of the mosaics, their checksums are removed as files
+        granules = []
+        for s in all_stores:
+            if not (s.startswith(basin + "_") and s.endswith("_mosaic")):
+                continue
+
+            name = s[len(basin) + 1:-len("_mosaic")]
+            folder = "mosaic/{}".format(name)
+
+            for f in self.get_data_files(basin, folder=folder):
+                match = granule_pattern.search(f)
+                if match == None or not older(match.group(1)):
+                    continue
+
+                fname = "{}/{}".format(folder, f)
+                if match.group(2):
+                    files.append(fname)
+                else:
+                    granules.append((name, match.group(1), fname))
 
-        for f in associate_files:
-            self.log.debug("Uploading {}".format(f))
-            bname = os.path.basename(f)
-            fresource = "resource/basins/{}/{}".format(basin, bname)
+        return sorted(stores), sorted(granules), sorted(files)
 
-            r = self.get(fresource, skip_json=True)
+    @timed('prune')
+    def prune(self, basins=None, days=30, dry_run=False):
+        """
+        Deletes modeled coverage stores, mosaic granules and their data files
+        that are older than the retention period, self.jobs deletes at a
+        time. Stores are removed with their layers, granules from their
+        mosaic's index with their files and the data files through the
+        resource API. The size of each file is found first to report the
+        space reclaimed and ask before deleting.
 
-            if r.status_code == 200:
-                self.delete(fresource, purge=True, recurse=True)
+        Args:
+            basins: List of basin names, default is every basin
+            days: Number of days of modeled data to keep
+            dry_run: Only report what would be deleted
 
-            # Upload each file
-            self.move(fresource, f, data_type="shapefile")
+        Returns:
+            dict: Number of stores, granules and files pruned, bytes
+                  reclaimed and the errors of anything that failed
+        """
+        if basins == None:
+            basins = sorted(self.catalog.get_workspaces().keys())
 
-        # Create the layer
-        resource = "workspaces/{}/datastores/{}/featuretypes".format(basin,
-                                                                     dstore)
+        stores = []
+        granules = []
+        files = []
+
+        for b in basins:
+            s, g, f = self.find_expired(b, days)
+            stores += [(b, name) for name in s]
+            granules += [(b,) + granule for granule in g]
+            files += [(b, name) for name in f]
+
+        self.log.info("Found {} stores, {} granules and {} data files older"
+                      " than {} days in {} basins".format(len(stores),
+                                                          len(granules),
+                                                          len(files), days,
+                                                          len(basins)))
+
+        def resource(basin, name):
+            return "{}/{}/{}".format(self.data, basin, name)
+
+        # Sizes of the files for reporting
+        paths = [resource(b, fname) for b, name, date, fname in granules] + \
+                [resource(*f) for f in files]
+
+        def remote_size(r):
+            return self.transfer.remote_size(urljoin(self.url, r)) or 0
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            sizes = dict(zip(paths, pool.map(remote_size, paths)))
+        total = sum(sizes.values())
+
+        summary = {"stores":len(stores), "granules":len(granules),
+                   "files":len(files), "bytes":total, "errors":{}}
+
+        if dry_run:
+            for b, name in stores:
+                self.log.info("Would delete store {}:{}".format(b, name))
+
+            for b, name, date, fname in granules:
+                self.log.info("Would remove {} from the {} mosaic ({:0.1f} MB)"
+                              "".format(date, self.get_mosaic_store(b, name),
+                                        sizes[resource(b, fname)] / 1e6))
+
+            for f in files:
+                self.log.info("Would delete {}/{} ({:0.1f} MB)"
+                              "".format(f[0], f[1], sizes[resource(*f)] / 1e6))
+
+            self.log.info("Dry run, {:0.1f} MB would be reclaimed"
+                          "".format(total / 1e6))
+            return summary
+
+        if not paths and not stores:
+            self.log.info("Nothing to prune")
+            return summary
+
+        ans = ask_user("You are about to delete {} stores, {} granules and {}"
+                       " data files older than {} days, {:0.1f} MB.\nAre you"
+                       " sure you want to continue?".format(len(stores),
+                                                            len(granules),
+                                                            len(files), days,
+                                                            total / 1e6),
+                       bypass=self.bypass)
+
+        if not ans:
+            self.log.info("Aborting pruning.")
+            return {"stores":0, "granules":0, "files":0, "bytes":0,
+                    "errors":{}}
+
+        deletes = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            for b, name in stores:
+                r = "workspaces/{}/coveragestores/{}".format(b, name)
+                deletes[pool.submit(self.delete, r, missing_ok=True,
+                                                    recurse=True,
+                                                    purge="metadata")] = r
+
+            for b, name, date, fname in granules:
+                deletes[pool.submit(self.remove_granules, b, name, date,
+                                                          purge=True)] = \
+                    resource(b, fname)
+
+            for f in files:
+                r = resource(*f)
+                deletes[pool.submit(self.delete, r, missing_ok=True)] = r
+
+            for f in as_completed(deletes):
+                try:
+                    f.result()
+
+                except Exception as e:
+                    self.log.error("Unable to delete {}: {}"
+                                   "".format(deletes[f], repr(e)))
+                    summary["errors"][deletes[f]] = e
+
+        # Don't count anything that is still there
+        failed = summary["errors"]
+        summary["stores"] -= len([r for r in failed
+                                  if r.startswith("workspaces/")])
+        summary["granules"] -= len([g for g in granules
+                                    if resource(g[0], g[3]) in failed])
+        summary["files"] -= len([f for f in files if resource(*f) in failed])
+        summary["bytes"] -= sum([sizes[r] for r in failed if r in sizes])
+
+        self.log.info("Pruned {} stores, {} granules and {} files, {:0.1f} MB"
+                      " reclaimed".format(summary["stores"],
+                                          summary["granules"],
+                                          summary["files"],
+                                          summary["bytes"] / 1e6))
+
+        return summary
+
+    @timed('reconcile')
+    def reconcile(self, basins=None):
+        """
+        Re-syncs the local state of basins with the geoserver after changes
+        made outside of GUDS. Each basin's stores, layers, layer styles and
+        data files are listed and replace what was recorded, data files are
+        only recorded if the geoserver has their checksum.
+
+        Args:
+            basins: List of basin names, default is every basin on the
+                    geoserver and in the state
+
+        Returns:
+            dict: Basin names mapped to the number of stores, layers and files
+                  recorded
+        """
+        self.catalog.clear()
+        workspaces = self.catalog.get_workspaces()
 
-        payload = {"featureType":{"name":keyword,
-                            "title":keyword.replace("_"," ").title(),
-                            "store":{"name":"{}:{}".format(basin, dstore)}
-                                 }
-                  }
+        if basins == None:
+            basins = sorted(set(workspaces.keys()) |
+                            set(self.state.get_basins()))
 
-        self.make(resource, payload)
-        self.assign_colormaps(basin, keyword, layer_type="vector")
+        summary = {}
+
+        for basin in basins:
+            if basin not in workspaces:
+                self.log.info("{} isn't on the geoserver, removing it from the"
+                              " local state".format(basin))
+                self.state.remove_basin(basin)
+                continue
+
+            self.log.info("Reconciling the {} basin...".format(basin))
+
+            stores = {}
+            layers = {}
+
+            for store_type in ["coverageStores", "dataStores"]:
+                names = self.catalog.get_stores(basin, store_type=store_type)
+                stores[store_type] = sorted(names or [])
+
+                for s in stores[store_type]:
+                    for lyr in self.catalog.get_store_layers(basin, s,
+                                            store_type=store_type) or []:
+                        layers[lyr] = s
+
+            files = [f for f in self.get_data_files(basin)
+                     if os.path.splitext(f)[1] not in ['', '.md5']]
+
+            def remote(f):
+                url = urljoin(self.url, "{}/{}/{}".format(self.data, basin, f))
+                return (self.transfer.remote_checksum(url),
+                        self.transfer.remote_size(url))
+
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                styles = dict(zip(layers, pool.map(lambda lyr:
+                                    self.get_layer_styles(basin, lyr),
+                                    layers)))
+                files = dict(zip(files, pool.map(remote, files)))
+
+            files = {f:v for f, v in files.items() if v[0] != None}
+
+            self.state.replace_basin(basin, files, stores, layers, styles)
+
+            summary[basin] = {"stores":sum([len(v) for v in stores.values()]),
+                              "layers":len(layers),
+                              "files":len(files)}
+
+            self.log.info("Recorded {stores} stores, {layers} layers and"
+                          " {files} data files".format(**summary[basin]))
+
+        return summary
+
+    def remove_dates(self, basin, dates, variables=None):
+        """
+        Removes dates from the ImageMosaic stores of a basin, deleting the
+        granule files as well
+
+        Args:
+            basin: Name of the basin/workspace
+            dates: List of string dates
+            variables: Layer names of the mosaics, default is all the modeled
+                       variables
+        """
+        if variables == None:
+            variables = list(self.remap.values())
+
+        for name in variables:
+            store = self.get_mosaic_store(basin, name)
+
+            if not self.exists(basin, store=store):
+                self.log.warning("No {} mosaic found".format(store))
+                continue
+
+            for d in dates:
+                self.remove_granules(basin, name, d.replace('-', ''),
+                                                  purge=True)
+
+    def submit_shapefile(self, filename, basin, layer=None):
+        """
+        Uploads the shapefiles. If layer=None then it simply uses the filename
+        to create the layer name (replacing underscores with spaces)
+
+        The .shp and its sidecar files are zipped in memory and sent with a
+        single upload to the datastore which also creates the layer.
+
+        Args:
+            filename: Local path to a .shp file
+            basin: string name of the workspace or basin
+            layer: Alternate layer name to use
+
+        """
+        filename = os.path.abspath(filename)
+        bname = os.path.basename(filename)
+        keyword = os.path.splitext(bname)[0]
+        dstore = keyword + "_store"
+
+        # Get all the files associated with the shapefile
+        associate_files = []
+        for f in sorted(os.listdir(os.path.dirname(filename))):
+            name, ext = os.path.splitext(f)
+
+            if name == keyword and ext.lower() in self.shapefile_exts:
+                associate_files.append(os.path.join(os.path.dirname(filename),
+                                                    f))
+
+        # Bundle them up
+        self.log.info("Zipping {} files.".format(len(associate_files)))
+        buf = io.BytesIO()
+
+        with ZipFile(buf, 'w', ZIP_DEFLATED) as z:
+            for f in associate_files:
+                self.log.debug("Adding {}".format(f))
+                z.write(f, arcname=os.path.basename(f))
+
+        buf.seek(0)
+
+        # Replacing the data keeps the existing layer and its styles
+        existed = self.exists(basin, dstore=dstore)
+
+        self.log.info("Uploading {} to the {} datastore...".format(bname,
+                                                                   dstore))
+        resource = "workspaces/{}/datastores/{}/file.shp".format(basin, dstore)
+        self.move(resource, buf, data_type="shapefile",
+                                 params={"configure":"first",
+                                         "update":"overwrite",
+                                         "filename":keyword})
+
+        # The upload made the store and its layer
+        self.catalog.forget(basin)
+        self.state.add_store(basin, dstore, store_type="dataStores")
+        self.state.add_layer(basin, dstore, keyword)
+
+        if not existed:
+            resource = "workspaces/{}/datastores/{}/featuretypes/{}.json" \
+                       "".format(basin, dstore, keyword)
+            self.put(resource, {"featureType":{
+                                "title":keyword.replace("_"," ").title()}})
+
+            self.assign_colormaps(basin, keyword, layer_type="vector",
+                                                  current=([], None))
+        else:
+            self.assign_colormaps(basin, keyword, layer_type="vector")
 
     def download(self, basin, date_str, download_type="modeled"):
         """
@@ -1238,6 +2391,24 @@ class AWSM_Geoserver(object):
             basin: String name of the basin.
             date_str: String date of the file you want to download
         """
+        fname = self.download_name(date_str, download_type=download_type)
+
+        self.log.info("Download Requested. Attempting to download {} from the "
+                      "{}.".format(fname, basin))
+
+        resource = "{}/{}/{}".format(self.data, basin,fname)
+        self.grab(resource, fname)
+
+    def download_name(self, date_str, download_type="modeled"):
+        """
+        Returns the name of the remote file holding the data for a date
+
+        Args:
+            date_str: String date of the file
+            download_type: Type of data to download
+        """
+        import pandas as pd
+
         date = pd.to_datetime(date_str)
         date_str = "".join(date.isoformat().split('T')[0].split("-"))
 
@@ -1245,14 +2416,200 @@ class AWSM_Geoserver(object):
             fname = "masked_snow_{}.nc".format(date_str)
 
         else:
-            self.log.error("{} data downloads have not been develop yet!")
+            self.log.error("{} data downloads have not been develop yet!"
+                           "".format(download_type))
             sys.exit()
 
-        self.log.info("Download Requested. Attempting to download {} from the "
-                      "{}.".format(fname, basin))
+        return fname
 
-        resource = "{}/{}/{}".format(self.data, basin,fname)
-        self.grab(resource, fname)
+    def download_dates(self, basins, dates, download_type="modeled"):
+        """
+        Downloads the data for many dates and basins, self.jobs files at a
+        time. The files available are listed once per basin up front so
+        dates without data are skipped instead of requested. When more than
+        one basin is requested files are saved in a folder per basin.
+
+        Args:
+            basins: List of basin names
+            dates: List of string dates
+            download_type: Type of data to download
+
+        Returns:
+            dict: Local file names that failed to download and their errors
+        """
+        downloads = []
+        missing = []
+
+        for basin in basins:
+            available = self.get_data_files(basin)
+
+            for d in dates:
+                fname = self.download_name(d, download_type=download_type)
+
+                if fname in available:
+                    local = fname
+                    if len(basins) > 1:
+                        local = os.path.join(basin, fname)
+
+                    downloads.append(("{}/{}/{}".format(self.data, basin,
+                                                                   fname),
+                                      local))
+                else:
+                    missing.append("{}/{}".format(basin, fname))
+
+        self.log.info("Downloading {} files from {} basins using {} workers..."
+                      "".format(len(downloads), len(basins), self.jobs))
+
+        if missing:
+            self.log.warning("{} requested files are not on the geoserver"
+                             "".format(len(missing)))
+            self.log.debug("Missing: {}".format(", ".join(missing)))
+
+        errors = {}
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {}
+
+            for resource, local in downloads:
+                if os.path.dirname(local):
+                    os.makedirs(os.path.dirname(local), exist_ok=True)
+
+                futures[pool.submit(self.grab, resource, local)] = local
+
+            for f in as_completed(futures):
+                try:
+                    f.result()
+
+                except Exception as e:
+                    self.log.error("Unable to download {}: {}"
+                                   "".format(futures[f], repr(e)))
+                    errors[futures[f]] = e
+
+        self.log.info("Download complete, {}/{} files downloaded."
+                      "".format(len(downloads) - len(errors), len(downloads)))
+
+        return errors
+
+    @timed('download')
+    def download_subset(self, basin, layer, bbox=None, bbox_crs=None,
+                                            output_format="geotiff",
+                                            fname=None):
+        """
+        Downloads a piece of a published layer using the geoserver's WCS
+        GetCoverage so only the area requested is sent, streamed to disk.
+
+        Args:
+            basin: String name of the basin
+            layer: Name of a layer in the basin, e.g. density20190401
+            bbox: List of minx, miny, maxx, maxy, None for the whole layer
+            bbox_crs: CRS of the bbox such as EPSG:4326, default is the
+                      layer's native CRS
+            output_format: Format to download, geotiff or netcdf
+            fname: Local file to write, default is <basin>_<layer>.<ext>
+
+        Returns:
+            string: Path to the file written
+        """
+        mime, ext = self.wcs_formats[output_format]
+
+        if fname == None:
+            fname = "{}_{}.{}".format(basin, layer, ext)
+
+        # Coverage ids in WCS 2.0 are <workspace>__<layer>
+        url = urljoin(self.url, "../{}/wcs".format(basin))
+        params = [("service", "WCS"), ("version", "2.0.1"),
+                  ("request", "GetCoverage"),
+                  ("coverageId", "{}__{}".format(basin, layer)),
+                  ("format", mime)]
+
+        if bbox != None:
+            minx, miny, maxx, maxy = bbox
+            axes = ("E", "N")
+
+            if bbox_crs != None:
+                code = bbox_crs.split(":")[-1]
+                params.append(("subsettingCrs", "http://www.opengis.net/def/"
+                                                "crs/EPSG/0/{}".format(code)))
+                if code == "4326":
+                    axes = ("Long", "Lat")
+
+            params.append(("subset", "{}({},{})".format(axes[0], minx, maxx)))
+            params.append(("subset", "{}({},{})".format(axes[1], miny, maxy)))
+
+        self.log.info("Requesting {} from the {} WCS as {}..."
+                      "".format(layer, basin, output_format))
+        self.log.debug("GetCoverage parameters: {}".format(pformat(params)))
+
+        r = self.transfer.stream(url, fname, params=params, types=[mime])
+        self.handle_status(url, r.status_code)
+
+        # WCS reports problems as an exception document with a 200
+        if not r.headers.get('Content-Type', '').startswith(mime):
+            raise GeoserverError("Unable to get a subset of {}:\n{}"
+                                 "".format(layer, r.text), url, r.status_code)
+
+        self.log.info("Subset written to {}".format(fname))
+
+        return fname
+
+    def download_subsets(self, basins, variable, dates, **kwargs):
+        """
+        Downloads WCS subsets of a variable's layer for many dates and basins,
+        self.jobs at a time. Layers are listed once per basin up front so
+        dates without a layer are skipped.
+
+        Args:
+            basins: List of basin names
+            variable: Layer name without the date, e.g. density
+            dates: List of string dates
+            kwargs: Passed to download_subset
+
+        Returns:
+            dict: Layers that failed to download and their errors
+        """
+        subsets = []
+        missing = []
+
+        for basin in basins:
+            available = self.get_layers(basin)
+
+            for d in dates:
+                layer = "{}{}".format(variable, d.replace('-', ''))
+
+                if layer in available:
+                    subsets.append((basin, layer))
+                else:
+                    missing.append("{}:{}".format(basin, layer))
+
+        self.log.info("Downloading {} subsets from {} basins using {} "
+                      "workers...".format(len(subsets), len(basins), self.jobs))
+
+        if missing:
+            self.log.warning("{} requested layers are not on the geoserver"
+                             "".format(len(missing)))
+            self.log.debug("Missing: {}".format(", ".join(missing)))
+
+        errors = {}
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {pool.submit(self.download_subset, basin, layer,
+                                                         **kwargs):
+                       "{}:{}".format(basin, layer)
+                       for basin, layer in subsets}
+
+            for f in as_completed(futures):
+                try:
+                    f.result()
+
+                except Exception as e:
+                    self.log.error("Unable to download {}: {}"
+                                   "".format(futures[f], repr(e)))
+                    errors[futures[f]] = e
+
+        self.log.info("Download complete, {}/{} subsets downloaded."
+                      "".format(len(subsets) - len(errors), len(subsets)))
+
+        return errors
 
     def submit_styles(self, local_files, basin=None):
         """
@@ -1266,10 +2623,7 @@ class AWSM_Geoserver(object):
                  default is none which will apply them to all
 
         """
-        resource = "styles/"
-        existing_styles = self.get(resource)
-        existing_styles = [style['name'] for style in \
-                                             existing_styles['styles']['style']]
+        existing_styles = self.catalog.get_styles()
         self.log.info("Uploading {} styles.".format(len(local_files)))
         self.log.info("{} styles already exist.".format(len(existing_styles)))
 
@@ -1314,22 +2668,95 @@ class AWSM_Geoserver(object):
         else:
             basins = self.get_basins()
 
+        return self.propagate_styles(basins, local_files)
+
+    @timed('styling')
+    def propagate_styles(self, basins, local_files):
+        """
+        Adds styles to every layer in the basins that is missing one it should
+        have. The layers matching the keywords of the styles are listed once,
+        their current styles are read from the geoserver concurrently, then
+        only the layers that are missing styles are updated with self.jobs
+        workers. Layers of data stores are styled as vectors
+        which never changes their default style.
+
+        Args:
+            basins: List of basin names
+            local_files: List of the style files uploaded
+
+        Returns:
+            dict: Layers that failed to update and their errors
+        """
+        # Keywords of every style uploaded
+        keys = set()
+        for f in local_files:
+            style_name = os.path.basename(f).split('.')[0].lower()
+            keys.update([k for k in self.colormaps_keys if k in style_name])
+
+        layers = []
         for b in basins:
-            layers = self.get_layers(b)
+            names = self.get_layers(b)
+
+            # Feature types are vectors, everything else is a coverage
+            vectors = set()
+            for store in (self.catalog.get_stores(b, "dataStores") or {}):
+                vectors.update(self.catalog.get_store_layers(b, store,
+                                                   store_type="dataStores")
+                               or [])
+
+            layers += [(b, lyr, "vector" if lyr in vectors else "raster")
+                       for lyr in names
+                       if len([True for k in keys if k in lyr.lower()]) > 0]
+
+        self.log.info("Checking the styles of {} layers in {} basins..."
+                      "".format(len(layers), len(basins)))
 
-            # Go back and assign colormaps only to the ones that we mess with
-            for f in local_files:
-                keys = [k for k in self.colormaps_keys if k in f]
+        errors = {}
+        changes = {}
+        count = 0
 
-            final_layers = []
-            for lyr in layers:
-                if len([True for k in keys if k in lyr]) > 0:
-                    final_layers.append(lyr)
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {pool.submit(self.get_layer_styles, b, lyr):
+                       (b, lyr, layer_type) for b, lyr, layer_type in layers}
 
-            self.log.info("Assigning style to {} layers on the {}"
-                          "".format(len(final_layers), b))
-            for lyr in final_layers:
-                self.assign_colormaps(b, lyr)
+            for f in as_completed(futures):
+                b, lyr, layer_type = futures[f]
+
+                try:
+                    styles, default = f.result()
+
+                except Exception as e:
+                    errors["{}:{}".format(b, lyr)] = e
+                    continue
+
+                colormaps, new_default = self.get_layer_colormaps(lyr,
+                                                      layer_type=layer_type)
+                missing = [c for c in colormaps if c not in styles]
+
+                if missing or new_default not in [None, default]:
+                    changes[(b, lyr)] = (styles + missing, new_default)
+                    count += len(missing)
+
+        self.log.info("Updating the styles of {}/{} layers ({} assignments)..."
+                      "".format(len(changes), len(layers), count))
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {pool.submit(self.set_layer_styles, b, lyr, styles,
+                                                          default=default):
+                       "{}:{}".format(b, lyr)
+                       for (b, lyr), (styles, default) in changes.items()}
+
+            for f in as_completed(futures):
+                try:
+                    f.result()
+
+                except Exception as e:
+                    errors[futures[f]] = e
+
+        for name, e in errors.items():
+            self.log.error("Unable to style {}: {}".format(name, repr(e)))
+
+        return errors
 
     def submit_flight(self, filename, basin):
         """
@@ -1340,6 +2767,7 @@ class AWSM_Geoserver(object):
             filename: Remote name of the file
             basin: basin the file is associated with
         """
+        import pandas as pd
 
         # Naming
         bname = os.path.basename(filename).split('.')[0]
@@ -1407,6 +2835,35 @@ def ask_user(msg, bypass=False):
 
     return response
 
+def parse_dates(values):
+    """
+    Expands the dates given on the command line. Each value can be a date, a
+    comma separated list of dates or a range of dates written as start/end
+    which includes both ends.
+
+    Args:
+        values: List of strings from the command line
+
+    Returns:
+        list: Sorted ISO formatted dates without duplicates
+    """
+    import pandas as pd
+
+    dates = set()
+
+    for value in values:
+        for item in value.split(','):
+            if not item:
+                continue
+
+            if '/' in item:
+                start, end = item.split('/')
+                dates.update(pd.date_range(start, end, freq='D'))
+            else:
+                dates.add(pd.to_datetime(item))
+
+    return sorted([d.date().isoformat() for d in dates])
+
 def write_json(bypass=False):
     """
     Writes a blank json with all the keys required to run the script
@@ -1439,13 +2896,15 @@ def main():
     p.add_argument('-f','--files', dest='filenames', nargs='+',
                     help="Path(s) to a file containing either a lidar flight,"
                     "AWSM/SMRF topo image, AWSM modeling snow.nc, shapefiles"
-                    " or a list of styles")
+                    " or a list of styles. Multiple files, globs or model run"
+                    " directories are uploaded as a batch")
 
-    p.add_argument('-b','--basin', dest='basin',
+    p.add_argument('-b','--basin', dest='basin', nargs='+',
                     choices=['brb', 'kaweah', 'kings', 'lakes', 'merced',
                              'sanjoaquin','tuolumne','gunnison'], required=False,
                     help="Basin name to submit to which is also the geoserver"
-                         " workspace name")
+                         " workspace name. Several basins can be given when"
+                         " downloading")
 
     p.add_argument('-c','--credentials', dest='credentials',
                     default='./geoserver.json',
@@ -1483,16 +2942,125 @@ def main():
                     help="When used, it doesn't clean up the files it creates."
                     " Not to be used for other than debugging.")
 
-    p.add_argument('-do','--download', dest='download',
-                    help="Receives a date for downloading files")
+    p.add_argument('-do','--download', dest='download', nargs='+',
+                    help="Receives dates for downloading files. Dates can be"
+                         " listed, comma separated or given as a range like"
+                         " 2019-04-01/2019-04-30")
+
+    p.add_argument('--layer', dest='layer', default=None,
+                    help="Layer to download a subset of using WCS, e.g."
+                         " density20190401. Used with --download dates it is a"
+                         " variable name and each date's layer is downloaded")
+
+    p.add_argument('--bbox', dest='bbox', type=float, nargs=4, default=None,
+                    metavar=('MINX', 'MINY', 'MAXX', 'MAXY'),
+                    help="Bounding box of the subset to download with --layer")
+
+    p.add_argument('--bbox_crs', dest='bbox_crs', default=None,
+                    help="CRS of the bounding box such as EPSG:4326, default"
+                         " is the layer's native CRS")
+
+    p.add_argument('--wcs_format', dest='wcs_format', default='geotiff',
+                    choices=['geotiff', 'netcdf'],
+                    help="Format of subsets downloaded with --layer")
 
     p.add_argument('-l','--latest', dest='latest', action="store_true",
                     help="If used guds will also create a latest layer if "
                          "after uploading by looking at all the layers "
                          "available for the associated basin")
 
+    p.add_argument('--pool_size', dest='pool_size', type=int, default=10,
+                    help="Number of keep-alive connections to hold open to the"
+                         " geoserver")
+
+    p.add_argument('-j','--jobs', dest='jobs', type=int, default=1,
+                    help="Number of workers to use when creating layers on the"
+                         " geoserver or downloading files concurrently")
+
+    p.add_argument('--catalog_ttl', dest='catalog_ttl', type=float,
+                    default=None,
+                    help="Seconds before the cached listing of the geoserver"
+                         " catalog is refreshed, default is never")
+
+    p.add_argument('--verify', dest='verify', action='store_true',
+                    help="Reads uploaded data back from the geoserver to"
+                         " confirm its checksum matches the local file")
+
+    p.add_argument('--force', dest='force', action='store_true',
+                    help="Copies data to the geoserver even if an identical"
+                         " file is already there")
+
+    p.add_argument('--memory', dest='memory', type=int, default=256,
+                    help="Max megabytes of netcdf data held in memory at once"
+                         " while extracting")
+
+    p.add_argument('--percentiles', dest='percentiles', type=float, nargs='+',
+                    default=None,
+                    help="Percentiles to estimate for each layer, reported"
+                         " with the layer statistics in debug mode")
+
+    p.add_argument('--nc_profile', dest='nc_profile', default='default',
+                    choices=list(nc_profiles.keys()),
+                    help="Output profile for netcdfs sent to the geoserver."
+                         " compressed uses zlib and tiled chunks, quantized"
+                         " also rounds modeled variables to useful precision")
+
+    p.add_argument('--format', dest='publish_format', default='netcdf',
+                    choices=['netcdf', 'cog', 'mosaic'],
+                    help="Format to publish modeled data in. cog makes a cloud"
+                         " optimized GeoTIFF store for each variable, mosaic"
+                         " adds each day to a time enabled ImageMosaic store"
+                         " per variable. Both require rasterio")
+
+    p.add_argument('--remove_dates', dest='remove_dates', nargs='+',
+                    default=None,
+                    help="Dates to remove from the basin's ImageMosaic stores,"
+                         " given like --download")
+
+    p.add_argument('--prune', dest='prune', type=int, default=None,
+                    metavar='DAYS',
+                    help="Deletes modeled stores and data files older than"
+                         " DAYS days from the basins given or every basin")
+
+    p.add_argument('--dry_run', dest='dry_run', action='store_true',
+                    help="Reports what --prune would delete without deleting"
+                         " anything")
+
+    p.add_argument('--reconcile', dest='reconcile', action='store_true',
+                    help="Re-syncs the local record of what is on the"
+                         " geoserver for the basins given or every basin")
+
+    p.add_argument('--state', dest='state', default=None,
+                    help="Path to the local record of what has been"
+                         " published, default is ~/.guds/state_<host>.db per"
+                         " geoserver")
+
+    p.add_argument('--segments', dest='segments', type=int, default=4,
+                    help="Number of byte ranges of a file to download at once")
+
+    p.add_argument('--timeout', dest='timeout', type=float, default=300,
+                    help="Seconds to wait on the geoserver for a response"
+                         " before retrying")
+
+    p.add_argument('--retries', dest='retries', type=int, default=3,
+                    help="Number of times to retry a request the geoserver"
+                         " dropped or was too busy to answer")
+
+    p.add_argument('--profile', dest='profile', default=None,
+                    help="Path to write a json report of the time spent in each"
+                         " phase and on each request to the geoserver")
+
     args = p.parse_args()
 
+    # Only downloads, pruning and reconciling work across basins
+    if args.basin != None and args.download == None and args.layer == None \
+                          and args.prune == None and not args.reconcile:
+        if len(args.basin) > 1:
+            p.error("Only one basin can be used unless downloading, pruning"
+                    " or reconciling")
+
+        args.basin = args.basin[0]
+
     # Timing
     start = time.time()
 
@@ -1504,42 +3072,131 @@ def main():
         # Get an instance to interact with the geoserver.
         gs = AWSM_Geoserver(args.credentials, debug=args.debug,
                                               bypass=args.bypass,
-                                              cleanup=args.cleanup)
+                                              cleanup=args.cleanup,
+                                              pool_size=args.pool_size,
+                                              jobs=args.jobs,
+                                              catalog_ttl=args.catalog_ttl,
+                                              verify=args.verify,
+                                              force=args.force,
+                                              memory=args.memory,
+                                              percentiles=args.percentiles,
+                                              nc_profile=args.nc_profile,
+                                              publish_format=args.publish_format,
+                                              segments=args.segments,
+                                              timeout=(10, args.timeout),
+                                              retries=args.retries,
+                                              state=args.state)
+
+        ok = True
+
+        try:
+            if args.reconcile:
+                gs.reconcile(basins=args.basin)
+
+            elif args.prune != None:
+                summary = gs.prune(basins=args.basin, days=args.prune,
+                                                      dry_run=args.dry_run)
+
+                if summary["errors"]:
+                    gs.log.error("Unable to prune {} stores, granules and"
+                                 " files".format(len(summary["errors"])))
+                    ok = False
+
+            elif args.remove_dates != None:
+                if args.basin == None:
+                    gs.log.error("Basin name required for removing dates!")
+                    sys.exit()
 
-        if args.download != None:
-            # Download a file
-            if args.basin == None:
-                gs.log.error("Basin name required for downloading data!")
-                sys.exit()
+                gs.remove_dates(args.basin, parse_dates(args.remove_dates))
 
-            gs.download(args.basin, args.download, download_type=args.data_type)
+            elif args.download != None or args.layer != None:
+                # Download a file
+                if args.basin == None:
+                    gs.log.error("Basin name required for downloading data!")
+                    sys.exit()
 
-        else:
-            if args.filenames != None:
-                # Submitting styles only
-                if args.data_type=="styles":
+                subset = {"bbox":args.bbox, "bbox_crs":args.bbox_crs,
+                          "output_format":args.wcs_format}
 
-                    if type(args.filenames)!= list:
-                        args.filenames = [args.filenames]
+                # Subset of one layer
+                if args.download == None:
+                    if len(args.basin) > 1:
+                        p.error("Only one basin can be used with a single layer")
 
-                    gs.submit_styles(args.filenames)
+                    gs.download_subset(args.basin[0], args.layer, **subset)
 
                 else:
-                    if args.basin == None:
-                        gs.log.error("Basin name required for uploading data!")
-                        sys.exit()
-                    # Upload a file
-                    gs.upload(args.basin, args.filenames[0],
-                                          upload_type=args.data_type,
-                                          espg=args.espg,
-                                          mask=args.mask)
+                    dates = parse_dates(args.download)
+
+                    # Subsets of a variable's layer on each date
+                    if args.layer != None:
+                        errors = gs.download_subsets(args.basin, args.layer,
+                                                     dates, **subset)
+                        if errors:
+                            ok = False
+
+                    elif len(args.basin) == 1 and len(dates) == 1:
+                        gs.download(args.basin[0], dates[0],
+                                                   download_type=args.data_type)
+                    else:
+                        errors = gs.download_dates(args.basin, dates,
+                                                   download_type=args.data_type)
+                        if errors:
+                            ok = False
+
+            else:
+                if args.filenames != None:
+                    # Submitting styles only
+                    if args.data_type=="styles":
 
-        if args.data_type=='modeled' and args.latest:
-            gs.create_latest_layers(args.basin)
+                        if type(args.filenames)!= list:
+                            args.filenames = [args.filenames]
+
+                        gs.submit_styles(args.filenames)
+
+                    else:
+                        if args.basin == None:
+                            gs.log.error("Basin name required for uploading data!")
+                            sys.exit()
+                        # Upload a file or a batch of files
+                        files = gs.find_files(args.filenames,
+                                              upload_type=args.data_type)
+
+                        if len(files) > 1:
+                            errors = gs.upload_batch(args.basin, files,
+                                                        upload_type=args.data_type,
+                                                        espg=args.espg,
+                                                        mask=args.mask)
+                            if errors:
+                                gs.log.error("Unable to upload {}/{} files"
+                                             "".format(len(errors),
+                                                       len(files)))
+                                ok = False
+                        else:
+                            fname = files[0] if files else args.filenames[0]
+                            gs.upload(args.basin, fname,
+                                                  upload_type=args.data_type,
+                                                  espg=args.espg,
+                                                  mask=args.mask)
+
+            if args.data_type=='modeled' and args.latest:
+                gs.create_latest_layers(args.basin)
+
+        # Failures talking to the geoserver end the run with a message
+        except (GeoserverError, TransferError) as e:
+            gs.log.error(str(e))
+            ok = False
 
         # Timing
         end = time.time()
         gs.log.info("Completed in {0:0.1f}s".format(end-start))
 
+        if args.profile != None:
+            gs.profiler.write(args.profile)
+            gs.log.info("Profile written to {}".format(args.profile))
+
+        if not ok:
+            sys.exit(1)
+
 if __name__ =='__main__':
     main()
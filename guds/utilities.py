@@ -0,0 +1,435 @@
+import os
+from itertools import product
+
+import numpy as np
+from netCDF4 import Dataset
+
+
+def iter_slabs(shape, itemsize, budget):
+    """
+    Yields index tuples that cover an array of a given shape in slabs that
+    are no bigger than budget bytes. Slabs are cut along the first axis (time)
+    and if a single step of that is still too big they are cut into blocks of
+    rows along the next axis and so on.
+
+    Args:
+        shape: Shape of the array to cover
+        itemsize: Bytes per value in the array
+        budget: Max bytes of a slab
+
+    Yields:
+        tuple: slices/indices to read or write a slab with
+    """
+    if len(shape) == 0:
+        yield ()
+        return
+
+    # Find the first axis where a single step fits in the budget
+    for axis in range(len(shape)):
+        step_bytes = itemsize * int(np.prod(shape[axis + 1:]))
+
+        if step_bytes <= budget:
+            break
+
+    step = max(1, int(budget // step_bytes))
+
+    # Every index on the axes before the one being blocked
+    outer = product(*[range(n) for n in shape[:axis]])
+
+    for idx in outer:
+        for start in range(0, shape[axis], step):
+            stop = min(start + step, shape[axis])
+            yield idx + (slice(start, stop),)
+
+
+class RangeStats(object):
+    """
+    Accumulates statistics of a variable one slab at a time. The min, max
+    and mean are exact. Percentiles are estimated from a uniform random sample
+    of the valid values so memory stays bounded.
+
+    Args:
+        percentiles: List of percentiles to estimate, None to skip them
+        sample_size: Max number of values kept for estimating percentiles
+    """
+
+    def __init__(self, percentiles=None, sample_size=100000):
+        self.percentiles = percentiles
+        self.sample_size = sample_size
+
+        self.count = 0
+        self.total = 0.0
+        self.min = np.nan
+        self.max = np.nan
+
+        self.rng = np.random.default_rng(0)
+        self.sample = np.empty(0)
+        self.keys = np.empty(0)
+
+    def add(self, data, mask=None):
+        """
+        Adds a slab of data, ignoring nans, masked values and anything outside
+        of the mask.
+
+        Args:
+            data: numpy or masked array
+            mask: Array broadcastable to data, zeros are excluded
+        """
+        values = np.ma.filled(np.ma.asarray(data, dtype=float), np.nan)
+        valid = np.isfinite(values)
+
+        if mask is not None:
+            valid &= (mask != 0)
+
+        values = values[valid]
+
+        if values.size == 0:
+            return
+
+        self.count += values.size
+        self.total += values.sum()
+        self.min = np.fmin(self.min, values.min())
+        self.max = np.fmax(self.max, values.max())
+
+        if self.percentiles:
+            self.add_sample(values)
+
+    def add_sample(self, values):
+        """
+        Keeps the values with the smallest random keys seen so far which is a
+        uniform sample of everything added.
+        """
+        keys = np.concatenate([self.keys, self.rng.random(values.size)])
+        values = np.concatenate([self.sample, values])
+
+        if keys.size > self.sample_size:
+            keep = np.argpartition(keys, self.sample_size)[:self.sample_size]
+            keys = keys[keep]
+            values = values[keep]
+
+        self.keys = keys
+        self.sample = values
+
+    def get_range(self):
+        return [self.min, self.max]
+
+    def get_mean(self):
+        return self.total / self.count if self.count else np.nan
+
+    def get_percentiles(self):
+        if not self.percentiles or self.sample.size == 0:
+            return {}
+
+        return dict(zip(self.percentiles,
+                        np.percentile(self.sample, self.percentiles)))
+
+    def summary(self):
+        """
+        Returns a dictionary of all the statistics gathered
+        """
+        result = {"min":self.min, "max":self.max, "mean":self.get_mean(),
+                  "count":self.count}
+
+        for p, v in self.get_percentiles().items():
+            result["p{}".format(p)] = v
+
+        return result
+
+
+def mask_slab(mask, mask_dims, var_dims, slab):
+    """
+    Cuts the piece of a mask that lines up with a slab of a variable
+
+    Args:
+        mask: Array of the mask
+        mask_dims: Dimension names of the mask
+        var_dims: Dimension names of the variable
+        slab: Index tuple of the slab from iter_slabs
+
+    Returns:
+        array: Mask that broadcasts against the slab, None if the variable
+               doesn't have all the mask dimensions
+    """
+    if not all([d in var_dims for d in mask_dims]):
+        return None
+
+    # Slabs only index the leading dimensions, the rest are whole
+    full = dict(zip(var_dims, slab + (slice(None),) * (len(var_dims) - len(slab))))
+
+    return mask[tuple([full[d] for d in mask_dims])]
+
+
+def copy_variable(src, dst, budget, stats=None, mask=None, mask_dims=None,
+                                     apply_mask=False):
+    """
+    Copies the data of one netcdf variable into another a slab at a time so
+    the whole variable is never held in memory. Statistics of the data inside
+    the mask are gathered along the way.
+
+    Args:
+        src: netCDF4 variable to read from
+        dst: netCDF4 variable to write to, same shape as src
+        budget: Max bytes to read at once
+        stats: RangeStats to add the data to
+        mask: Array of the mask, zeros are left out of the stats
+        mask_dims: Dimension names of the mask
+        apply_mask: True to multiply each slab by the mask before writing it,
+                    zeros become nans
+
+    Returns:
+        RangeStats: statistics of the data copied
+    """
+    if stats == None:
+        stats = RangeStats()
+
+    for slab in iter_slabs(src.shape, src.dtype.itemsize, budget):
+        data = src[slab]
+
+        m = None
+        if mask is not None:
+            m = mask_slab(mask, mask_dims, src.dimensions, slab)
+
+        if apply_mask and m is not None:
+            data = data * np.where(m == 0, np.nan, m)
+
+        dst[slab] = data
+        stats.add(data, mask=m)
+
+    return stats
+
+
+def copy_dataset(src, fname, budget, exclude=(), mask=None, mask_dims=None,
+                                     mask_exclude=(), percentiles=None):
+    """
+    Copies a netcdf into a new file a slab at a time, leaving out some
+    variables and optionally masking the ones on the mask's dimensions.
+
+    Args:
+        src: netCDF4 Dataset to copy
+        fname: Path of the netcdf to write
+        budget: Max bytes to read at once
+        exclude: Names of the variables to leave out
+        mask: Array of the mask, zeros become nans, None to copy as is
+        mask_dims: Dimension names of the mask
+        mask_exclude: Names of the variables to copy without masking
+        percentiles: Percentiles for the RangeStats of each variable
+
+    Returns:
+        tuple: The new netCDF4 Dataset open for writing and a dictionary of
+               the RangeStats of each variable copied inside the mask
+    """
+    dst = Dataset(fname, 'w')
+    dst.setncatts(src.__dict__)
+    dst.set_fill_on()
+
+    for name, dimension in src.dimensions.items():
+        dst.createDimension(name, None if dimension.isunlimited()
+                                       else len(dimension))
+
+    stats = {}
+    for name, variable in src.variables.items():
+        if name in exclude:
+            continue
+
+        dst.createVariable(name, variable.datatype, variable.dimensions)
+        dst[name].setncatts({k:v for k, v in variable.__dict__.items()
+                             if k not in ["_FillValue", "fill_value"]})
+
+        # Only the attributes of the projection matter
+        if name == 'projection':
+            continue
+
+        m = None if name in mask_exclude else mask
+        stats[name] = copy_variable(variable, dst[name], budget,
+                                    stats=RangeStats(percentiles),
+                                    mask=m, mask_dims=mask_dims,
+                                    apply_mask=True)
+
+    return dst, stats
+
+
+def variable_stats(variable, budget, stats=None, mask=None, mask_dims=None):
+    """
+    Gathers statistics of a netcdf variable reading a slab at a time
+
+    Args:
+        variable: netCDF4 variable
+        budget: Max bytes to read at once
+        stats: RangeStats to add the data to
+        mask: Array of the mask, zeros are left out of the stats
+        mask_dims: Dimension names of the mask
+
+    Returns:
+        RangeStats: statistics of the variable
+    """
+    if stats == None:
+        stats = RangeStats()
+
+    for slab in iter_slabs(variable.shape, variable.dtype.itemsize, budget):
+        m = None
+        if mask is not None:
+            m = mask_slab(mask, mask_dims, variable.dimensions, slab)
+
+        stats.add(variable[slab], mask=m)
+
+    return stats
+
+
+def write_profile(fname, profile, budget, spatial_dims=('y', 'x')):
+    """
+    Rewrites a netcdf in place using an output profile from
+    guds.upload.nc_profiles.
+    Variables on the spatial dimensions are compressed, tiled and optionally
+    quantized. Data is moved a slab at a time.
+
+    Args:
+        fname: Path to the netcdf to rewrite
+        profile: Dictionary from guds.upload.nc_profiles
+        budget: Max bytes to read at once
+        spatial_dims: Dimension names that are tiled
+
+    Returns:
+        tuple: size in bytes before and after
+    """
+    before = os.path.getsize(fname)
+    out = fname + '.tmp'
+
+    src = Dataset(fname)
+    dst = Dataset(out, 'w')
+    dst.setncatts(src.__dict__)
+
+    for name, dimension in src.dimensions.items():
+        dst.createDimension(name, None if dimension.isunlimited() \
+                                       else len(dimension))
+
+    for name, variable in src.variables.items():
+        kwargs = {}
+        attrs = variable.__dict__.copy()
+        fill = attrs.pop('_FillValue', None)
+
+        if all([d in variable.dimensions for d in spatial_dims]):
+            kwargs["zlib"] = profile["zlib"]
+            kwargs["complevel"] = profile["complevel"]
+            kwargs["shuffle"] = profile["shuffle"]
+            kwargs["chunksizes"] = [min(profile["tile"], len(src.dimensions[d]))
+                                    if d in spatial_dims else 1
+                                    for d in variable.dimensions]
+
+            if name in profile["digits"]:
+                kwargs["least_significant_digit"] = profile["digits"][name]
+
+        dst.createVariable(name, variable.datatype, variable.dimensions,
+                                 fill_value=fill, **kwargs)
+        dst.variables[name].setncatts(attrs)
+
+        if variable.ndim > 0:
+            for slab in iter_slabs(variable.shape, variable.dtype.itemsize,
+                                                   budget):
+                dst.variables[name][slab] = variable[slab]
+
+        # Scalars like projection and time hold a single value
+        else:
+            dst.variables[name][...] = variable[...]
+
+    src.close()
+    dst.close()
+    os.replace(out, fname)
+
+    return before, os.path.getsize(fname)
+
+
+def write_cog(fname, name, out, blocksize=256, overviews=(2, 4, 8, 16),
+                                 budget=256 * 1024**2):
+    """
+    Writes a variable from a netcdf as a cloud optimized GeoTIFF, internally
+    tiled and compressed with overviews. Each time step becomes a band. Data
+    is moved a slab at a time. Requires rasterio.
+
+    Args:
+        fname: Path to a netcdf with x, y and projection variables
+        name: Name of the variable to write
+        out: Path of the GeoTIFF to write
+        blocksize: Size of the internal tiles
+        overviews: Decimation factors of the overviews to build
+        budget: Max bytes to read at once
+
+    Returns:
+        string: Path of the GeoTIFF written
+    """
+    try:
+        import rasterio
+        from rasterio.enums import Resampling
+        from rasterio.shutil import copy as rio_copy
+        from rasterio.transform import from_origin
+        from rasterio.windows import Window
+
+    except ImportError:
+        raise ImportError("Publishing cloud optimized GeoTIFFs requires "
+                          "rasterio, install it with pip install guds[cog]")
+
+    ds = Dataset(fname)
+    variable = ds.variables[name]
+    x = ds.variables['x'][:]
+    y = ds.variables['y'][:]
+
+    # Projection from the spatial_ref spatialnc writes
+    proj = ds.variables['projection']
+    crs = getattr(proj, 'spatial_ref', None) or getattr(proj, 'crs_wkt', None)
+
+    dx = abs(float(x[1] - x[0]))
+    dy = abs(float(y[1] - y[0]))
+    transform = from_origin(float(x.min()) - dx / 2, float(y.max()) + dy / 2,
+                            dx, dy)
+
+    # Treat everything as a stack of 2D images
+    shape = variable.shape
+    if len(shape) == 2:
+        shape = (1,) + shape
+
+    count, height, width = shape
+
+    # GeoTIFFs are north up
+    flip = y[0] < y[-1]
+
+    profile = {"driver":"GTiff", "dtype":"float32", "nodata":np.nan,
+               "count":count, "height":height, "width":width, "crs":crs,
+               "transform":transform}
+
+    options = {"tiled":True, "blockxsize":blocksize, "blockysize":blocksize,
+               "compress":"deflate", "predictor":3, "bigtiff":"IF_SAFER"}
+
+    # Build overviews in a scratch file then copy them to the front of the
+    # final file which is what makes it cloud optimized.
+    scratch = out + '.tmp.tif'
+    with rasterio.open(scratch, 'w', **profile, **options) as dst:
+        for slab in iter_slabs(variable.shape, 4, budget):
+            data = np.ma.filled(variable[slab].astype('float32'), np.nan)
+
+            # Full slices for the axes the slab doesn't cut
+            slab = slab + (slice(None),) * (variable.ndim - len(slab))
+            if variable.ndim == 2:
+                slab = (slice(0, 1),) + slab
+
+            bands, rows, cols = [range(*(s if isinstance(s, slice) else
+                                         slice(s, s + 1)).indices(n))
+                                 for s, n in zip(slab, shape)]
+            data = data.reshape(len(bands), len(rows), len(cols))
+
+            row_off = rows.start
+            if flip:
+                data = data[:, ::-1, :]
+                row_off = height - rows.stop
+
+            dst.write(data, indexes=[b + 1 for b in bands],
+                            window=Window(cols.start, row_off, len(cols),
+                                          len(rows)))
+
+        levels = [o for o in overviews if min(height, width) // o >= 1]
+        dst.build_overviews(levels, Resampling.average)
+
+    ds.close()
+
+    rio_copy(scratch, out, driver="GTiff", copy_src_overviews=True, **options)
+    os.remove(scratch)
+
+    return out
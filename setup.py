@@ -30,11 +30,15 @@ setup(
     packages=find_packages(include=['guds']),
     entry_points={
         'console_scripts': [
-            'guds=guds.upload:main'
+            'guds=guds.upload:main',
+            'guds_basins=guds.orchestrate:main'
         ]
     },
     include_package_data=True,
     install_requires=requirements,
+    extras_require={
+        'cog': ['rasterio>=1.0'],
+    },
     license="GNU General Public License v3",
     zip_safe=False,
     keywords=['guds', 'geoserver', 'modeling'],
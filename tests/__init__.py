@@ -0,0 +1,8 @@
+"""Unit test package for guds."""
+
+import os
+import sys
+
+# The stub geoserver and the synthetic AWSM data live with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+                                os.path.abspath(__file__))), 'benchmarks'))
@@ -0,0 +1,171 @@
+"""Tests for resumable transfers and the journal in guds.transfer"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from multiprocessing import Pool
+from unittest import mock
+
+import requests
+
+from guds.transfer import Journal, Transfer, TransferError, file_checksum
+from stub_geoserver import Catalog, StubGeoserver
+
+
+def fill_journal(args):
+    """
+    Writes keys to a shared journal from another process
+    """
+    fname, worker, count = args
+    journal = Journal(fname)
+
+    for i in range(count):
+        journal.update("{}:{}".format(worker, i), sent=i)
+
+    # Removing a key only removes it for everyone
+    journal.remove("{}:0".format(worker))
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmp, "journal", "transfers.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_save_and_read(self):
+        journal = Journal(self.fname)
+        journal.update("a", sent=1)
+        journal.update("a", size=2)
+        journal.update("b", sent=3)
+        journal.remove("b")
+
+        self.assertEqual(Journal(self.fname).entries, {"a":{"sent":1,
+                                                            "size":2}})
+
+    def test_concurrent_processes_merge(self):
+        workers = 4
+        count = 20
+
+        with Pool(workers) as pool:
+            pool.map(fill_journal, [(self.fname, w, count)
+                                    for w in range(workers)])
+
+        with open(self.fname) as fp:
+            entries = json.load(fp)
+
+        expected = {"{}:{}".format(w, i):{"sent":i}
+                    for w in range(workers) for i in range(1, count)}
+        self.assertEqual(entries, expected)
+
+    def test_unwritable_kept_in_memory(self):
+        log = mock.Mock()
+        journal = Journal("/proc/guds/transfers.json", log=log)
+        journal.update("a", sent=1)
+        journal.update("a", size=2)
+
+        self.assertEqual(journal.get("a"), {"sent":1, "size":2})
+        self.assertEqual(log.warning.call_count, 1)
+
+
+class TestTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.catalog = Catalog()
+        self.stub = StubGeoserver(catalog=self.catalog).__enter__()
+        self.url = self.stub.url + "rest/resource/data/basins/kings/x.bin"
+        self.data = os.urandom(3000000)
+
+        self.session = requests.Session()
+        self.journal = Journal(os.path.join(self.tmp, "transfers.json"))
+        self.transfer = Transfer(self.session, self.journal,
+                                 logging.getLogger("guds.tests"),
+                                 retries=0, backoff=0)
+
+    def tearDown(self):
+        self.stub.__exit__()
+        self.session.close()
+        shutil.rmtree(self.tmp)
+
+    def test_upload_resumes(self):
+        fname = os.path.join(self.tmp, "x.bin")
+        with open(fname, "wb") as fp:
+            fp.write(self.data)
+
+        # A prior attempt got half of the file to the geoserver
+        half = len(self.data) // 2
+        self.catalog.resources["data/basins/kings/x.bin"] = self.data[:half]
+        self.journal.update(self.url, file=fname, size=len(self.data),
+                                      checksum=file_checksum(fname), sent=half)
+
+        sent = []
+        put = self.session.put
+
+        def record(url, **kwargs):
+            sent.append(kwargs["headers"].get("Content-Range"))
+            return put(url, **kwargs)
+
+        with mock.patch.object(self.session, "put", side_effect=record):
+            r = self.transfer.upload(self.url, fname)
+
+        self.assertEqual(r.status_code, 201)
+        self.assertEqual(sent[0], "bytes {}-{}/{}".format(half,
+                                                          len(self.data) - 1,
+                                                          len(self.data)))
+        self.assertEqual(self.catalog.resources["data/basins/kings/x.bin"],
+                         self.data)
+        self.assertEqual(self.journal.get(self.url), None)
+
+    def test_download_resumes(self):
+        self.catalog.resources["data/basins/kings/x.bin"] = self.data
+        fname = os.path.join(self.tmp, "x.bin")
+
+        self.transfer.min_segment = 2**18
+        self.transfer.progress_step = 2**16
+        self.transfer.buffer_size = 2**14
+
+        # Drop the connection part way through
+        iter_content = requests.Response.iter_content
+        chunks = [0]
+
+        def drop(response, chunk_size=1, **kwargs):
+            for chunk in iter_content(response, chunk_size=chunk_size,
+                                      **kwargs):
+                chunks[0] += 1
+                if chunks[0] == 100:
+                    raise requests.exceptions.ConnectionError("dropped")
+                yield chunk
+
+        with mock.patch.object(requests.Response, "iter_content", drop):
+            with self.assertRaises(TransferError):
+                self.transfer.download(self.url, fname, segments=6)
+
+        # Only bytes on disk are journaled
+        entry = self.journal.get("download:{}".format(self.url))
+        with open(fname + ".part", "rb") as fp:
+            part = fp.read()
+
+        done = 0
+        for start, end, count in entry["ranges"]:
+            self.assertEqual(part[start:start + count],
+                             self.data[start:start + count])
+            done += count
+
+        self.assertLess(done, len(self.data))
+
+        # The rest is fetched next time
+        r = self.transfer.download(self.url, fname, segments=6)
+
+        self.assertEqual(r.status_code, 200)
+        with open(fname, "rb") as fp:
+            self.assertEqual(fp.read(), self.data)
+
+        self.assertFalse(os.path.isfile(fname + ".part"))
+        self.assertEqual(self.journal.get("download:{}".format(self.url)),
+                         None)
@@ -0,0 +1,194 @@
+"""Tests for AWSM_Geoserver against the stub geoserver"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+from bench_guds import make_modeled, make_styles
+from guds.upload import AWSM_Geoserver
+from stub_geoserver import Catalog, StubGeoserver
+
+try:
+    import rasterio
+except ImportError:
+    rasterio = None
+
+
+class StubTestCase(unittest.TestCase):
+    """
+    Runs a stub geoserver for each test with credentials to reach it
+    """
+
+    basins = ["kings"]
+    stores = 0
+    styles = 0
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.catalog = Catalog(basins=self.basins, stores=self.stores,
+                               styles=self.styles)
+        self.stub = StubGeoserver(catalog=self.catalog).__enter__()
+
+        self.credentials = os.path.join(self.tmp, "geoserver.json")
+        with open(self.credentials, "w") as fp:
+            json.dump({"url":self.stub.url, "geoserver_username":"admin",
+                       "geoserver_password":"geoserver",
+                       "data":"resource/data/basins"}, fp)
+
+    def tearDown(self):
+        self.stub.__exit__()
+        shutil.rmtree(self.tmp)
+
+    def geoserver(self, **kwargs):
+        """
+        Returns an AWSM_Geoserver keeping all of its files in the test's
+        temporary directory
+        """
+        kwargs.setdefault("state", os.path.join(self.tmp, "state.db"))
+        gs = AWSM_Geoserver(self.credentials, bypass=True,
+                            tmp=os.path.join(self.tmp, "tmp"),
+                            journal=os.path.join(self.tmp, "transfers.json"),
+                            **kwargs)
+        gs.log.setLevel(logging.WARNING)
+        return gs
+
+    def upload_days(self, days, **kwargs):
+        """
+        Uploads a small modeled run for each day in one batch
+        """
+        gs = self.geoserver(**kwargs)
+        runs = [make_modeled(os.path.join(self.tmp, "run" + d), 20, day=d)
+                for d in days]
+
+        errors = gs.upload_batch("kings", [snow for snow, _ in runs],
+                                 mask=runs[0][1])
+        self.assertEqual(errors, {})
+
+        return gs
+
+
+class TestPrune(StubTestCase):
+
+    days = ["2019-04-01", "2019-04-02", "2019-04-03"]
+
+    def setUp(self):
+        super().setUp()
+
+        # Keep everything from the last day
+        self.keep = (date.today() - date(2019, 4, 3)).days
+
+    def names(self):
+        stores = sorted(self.catalog.workspaces["kings"]["coverageStores"])
+        files = sorted([f.split("/")[-1] for f in self.catalog.resources])
+        return stores, files
+
+    def test_dry_run_matches_prune(self):
+        gs = self.upload_days(self.days)
+        gs.create_latest_layers("kings")
+        before = self.names()
+
+        dry = gs.prune(days=self.keep, dry_run=True)
+        self.assertEqual(self.names(), before)
+
+        summary = gs.prune(days=self.keep)
+        stores, files = self.names()
+
+        self.assertEqual(summary, dry)
+        self.assertEqual(summary["stores"], 2)
+        self.assertEqual(summary["files"], 4)
+        self.assertEqual(summary["errors"], {})
+
+        self.assertEqual(stores, ["kings_masked_snow_20190403",
+                                  "latest_kings_masked_snow"])
+        self.assertEqual(files, ["masked_snow_20190403.nc",
+                                 "masked_snow_20190403.nc.md5"])
+
+    def test_latest_data_kept(self):
+        gs = self.upload_days(self.days)
+        gs.create_latest_layers("kings")
+
+        # Latest points at a file that's otherwise expired
+        latest = self.catalog.workspaces["kings"]["coverageStores"][
+                                                "latest_kings_masked_snow"]
+        latest["info"]["url"] = "file:basins/kings/masked_snow_20190401.nc"
+
+        gs.prune(days=self.keep)
+        stores, files = self.names()
+
+        self.assertIn("masked_snow_20190401.nc", files)
+        self.assertNotIn("masked_snow_20190402.nc", files)
+        self.assertNotIn("kings_masked_snow_20190401", stores)
+
+    def test_declined(self):
+        gs = self.upload_days(self.days)
+        before = self.names()
+        gs.bypass = False
+
+        with mock.patch("builtins.input", return_value="n"):
+            summary = gs.prune(days=self.keep)
+
+        self.assertEqual(summary["stores"], 0)
+        self.assertEqual(self.names(), before)
+
+    @unittest.skipIf(rasterio == None, "rasterio is required for mosaics")
+    def test_mosaic_granules(self):
+        gs = self.upload_days(self.days, publish_format="mosaic")
+
+        dry = gs.prune(days=self.keep, dry_run=True)
+        summary = gs.prune(days=self.keep)
+
+        self.assertEqual(summary, dry)
+        self.assertEqual(summary["granules"], 8)
+
+        for store, info in self.catalog.workspaces["kings"][
+                                            "coverageStores"].items():
+            self.assertEqual([g.split("_")[-1] for g in info["granules"]],
+                             ["20190403.tif"], store)
+
+
+class TestStyles(StubTestCase):
+
+    stores = 2
+    styles = 6
+
+    def setUp(self):
+        super().setUp()
+        self.catalog.styles["raster"] = b""
+        self.layer = "kings:depth20181001"
+
+    def test_styles_added_outside_kept(self):
+        styles = make_styles(os.path.join(self.tmp, "styles"), 2)
+        self.geoserver().submit_styles(styles)
+
+        # Someone styles the layer by hand
+        self.catalog.layers[self.layer]["styles"].append("admin_custom")
+        self.catalog.styles["admin_custom"] = b""
+
+        # Then another style is added by a later run
+        self.catalog.styles["depth_new"] = b""
+        self.geoserver().submit_styles(styles)
+
+        current = self.catalog.layers[self.layer]["styles"]
+        self.assertIn("admin_custom", current)
+        self.assertIn("depth_new", current)
+        self.assertEqual(self.catalog.layers[self.layer]["defaultStyle"],
+                         "raster")
+
+    def test_vector_default_kept(self):
+        self.catalog.add_store("kings", "dataStores",
+                               {"name":"kings_depth", "type":"Shapefile"})
+        self.catalog.add_layer("kings", "dataStores", "kings_depth",
+                               {"name":"depth_outline"})
+        self.catalog.layers["kings:depth_outline"]["defaultStyle"] = "line"
+
+        styles = make_styles(os.path.join(self.tmp, "styles"), 1)
+        self.geoserver().submit_styles(styles)
+
+        layer = self.catalog.layers["kings:depth_outline"]
+        self.assertEqual(layer["defaultStyle"], "line")
+        self.assertNotIn("raster", layer["styles"])
@@ -0,0 +1,97 @@
+"""Tests for the slab iteration and statistics in guds.utilities"""
+
+import unittest
+
+import numpy as np
+
+from guds.utilities import RangeStats, iter_slabs
+
+
+class TestIterSlabs(unittest.TestCase):
+
+    def cover(self, shape, itemsize, budget):
+        """
+        Returns how many times each value of an array is hit by the slabs and
+        the size of the biggest slab
+        """
+        hits = np.zeros(shape, dtype=int)
+        biggest = 0
+
+        for slab in iter_slabs(shape, itemsize, budget):
+            hits[slab] += 1
+            biggest = max(biggest, hits[slab].size * itemsize)
+
+        return hits, biggest
+
+    def test_whole_array_fits(self):
+        slabs = list(iter_slabs((3, 4, 5), 4, 10**6))
+        self.assertEqual(slabs, [(slice(0, 3),)])
+
+    def test_cut_along_time(self):
+        hits, biggest = self.cover((7, 10, 10), 4, 2 * 10 * 10 * 4)
+        self.assertTrue((hits == 1).all())
+        self.assertEqual(biggest, 2 * 10 * 10 * 4)
+
+    def test_cut_into_rows(self):
+        hits, biggest = self.cover((3, 37, 41), 4, 5 * 41 * 4)
+        self.assertTrue((hits == 1).all())
+        self.assertLessEqual(biggest, 5 * 41 * 4)
+
+    def test_cut_into_columns(self):
+        hits, biggest = self.cover((2, 9, 41), 8, 60)
+        self.assertTrue((hits == 1).all())
+        self.assertLessEqual(biggest, 60)
+
+    def test_scalar(self):
+        self.assertEqual(list(iter_slabs((), 4, 1)), [()])
+
+
+class TestRangeStats(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.data = rng.random((4, 30, 20)) * 100
+        self.data[0, 0, 0] = np.nan
+        self.mask = np.zeros((30, 20))
+        self.mask[5:25, 3:17] = 1
+
+    def add_slabs(self, stats, mask=None):
+        for slab in iter_slabs(self.data.shape, 8, 30 * 20 * 8):
+            stats.add(self.data[slab], mask=mask)
+        return stats
+
+    def test_exact_stats(self):
+        stats = self.add_slabs(RangeStats())
+
+        self.assertEqual(stats.count, np.isfinite(self.data).sum())
+        self.assertEqual(stats.min, np.nanmin(self.data))
+        self.assertEqual(stats.max, np.nanmax(self.data))
+        self.assertAlmostEqual(stats.get_mean(), np.nanmean(self.data))
+
+    def test_mask(self):
+        stats = self.add_slabs(RangeStats(), mask=self.mask)
+        inside = self.data[:, self.mask == 1]
+
+        self.assertEqual(stats.count, inside.size)
+        self.assertEqual(stats.get_range(), [inside.min(), inside.max()])
+
+    def test_masked_values_ignored(self):
+        stats = RangeStats()
+        stats.add(np.ma.masked_greater(self.data[1], 50))
+
+        self.assertLessEqual(stats.max, 50)
+
+    def test_percentiles_sampled(self):
+        stats = self.add_slabs(RangeStats(percentiles=[50], sample_size=500))
+        values = self.data[np.isfinite(self.data)]
+
+        self.assertEqual(stats.sample.size, 500)
+        self.assertAlmostEqual(stats.get_percentiles()[50],
+                               np.percentile(values, 50), delta=10)
+
+    def test_empty(self):
+        stats = RangeStats()
+        stats.add(np.full((3, 3), np.nan))
+
+        self.assertEqual(stats.count, 0)
+        self.assertTrue(np.isnan(stats.get_mean()))